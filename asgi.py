@@ -0,0 +1,206 @@
+"""
+ASGI serving mode: the same routes and payloads as web.py, with every upstream call made
+through the AsyncOpenAI client so one event loop carries many in-flight conversations.
+
+    hypercorn asgi:app          # or: uvicorn asgi:app
+
+Catalog, vector store, caches and the non-I/O pipeline steps are shared with web.py.
+"""
+
+import asyncio
+import logging
+
+from quart import Quart, Response, render_template, request, jsonify
+
+import config
+import web
+from config import CHAT_MODEL
+from helpers import (
+    intent_gate_async,
+    safety_check_async,
+    moderation_verdicts_async,
+    has_cached_verdict,
+    clean_reply,
+    ReplyCleaner,
+)
+from prompts import build_messages_and_tools
+from rag import llm_expand_query_async
+from routes_media_async import media_async_bp
+
+logger = logging.getLogger("smartlibrarian.asgi")
+
+# ---------- app & blueprints ----------
+app = Quart(__name__, template_folder="templates", static_folder="static")
+app.register_blueprint(media_async_bp, url_prefix="/api")
+
+# ---------- error handlers ----------
+@app.errorhandler(400)
+async def bad_request(e):
+    return jsonify({"error": "bad_request"}), 400
+
+@app.errorhandler(404)
+async def not_found(e):
+    return jsonify({"error": "not_found"}), 404
+
+@app.errorhandler(500)
+async def server_error(e):
+    logger.exception("Unhandled server error")
+    return jsonify({"error": "server_error"}), 500
+
+# ---------- routes ----------
+@app.get("/")
+async def index():
+    return await render_template("index.html")
+
+@app.get("/stats")
+async def stats():
+    return jsonify(web._stats_payload())
+
+# ---------- chat pipeline ----------
+async def _pre_chat(user_text: str):
+    """Async twin of web._pre_chat: gate, moderation and expansion awaited concurrently."""
+    hit = web._cached_reply(user_text)
+    if hit is not None:
+        allow, _reason = await safety_check_async(user_text, context_hint="informational")
+        return web._cached_payload(hit, allow), None
+
+    local_hint = web.local_intent(user_text)
+    proceed = local_hint is None or local_hint["action"] == "proceed"
+    fast = web._title_fast_path(user_text) if proceed else None
+    expansion = None
+    if proceed and fast is None and web._needs_expansion(user_text):
+        expansion = asyncio.create_task(llm_expand_query_async(user_text, max_terms=10))
+    moderation = None
+    if not has_cached_verdict(user_text, web._known_hint(local_hint)):
+        moderation = asyncio.create_task(moderation_verdicts_async(user_text))
+
+    try:
+        gate_hint = local_hint or await intent_gate_async(user_text)
+        context_hint = "informational" if gate_hint.get("action") == "proceed" else ""
+        allow, _reason = await safety_check_async(user_text, context_hint=context_hint, prefetched=moderation)
+    except BaseException:
+        for task in (expansion, moderation):
+            if task is not None:
+                task.cancel()
+        raise
+    if moderation is not None:
+        moderation.cancel()
+
+    payload = web._gate_payload(allow, gate_hint)
+    if payload is not None:
+        if expansion is not None:
+            expansion.cancel()
+        return payload, None
+
+    if fast is not None:
+        web._count_fast_path(fast)
+        return fast
+
+    # Chroma is a local, synchronous library: keep it off the event loop
+    terms = await expansion if expansion is not None else []
+    return await asyncio.to_thread(web._retrieve, user_text, terms)
+
+async def _tool_round(messages: list, tools: list):
+    """Async twin of web._tool_round."""
+    first = await config.aclient.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=messages,
+        tools=tools,
+        tool_choice="auto",
+        temperature=0.2,
+    )
+    ai_msg = first.choices[0].message
+
+    if not getattr(ai_msg, "tool_calls", None):
+        return None, (ai_msg.content or "")
+
+    rendered = web._rendered_reply(ai_msg)
+    if rendered is not None:
+        return None, rendered
+
+    web._apply_tool_calls(messages, ai_msg)
+    return messages, None
+
+@app.post("/chat")
+async def chat():
+    data = await request.get_json(force=True) or {}
+    user_text = (data.get("message") or data.get("text") or "").strip()
+    if not user_text:
+        return jsonify({"reply": web.EMPTY_MSG})
+
+    payload, candidates = await _pre_chat(user_text)
+    if payload is not None:
+        return jsonify(payload)
+
+    messages, tools = build_messages_and_tools(user_text, candidates)
+    messages, direct = await _tool_round(messages, tools)
+
+    if messages is not None:
+        final = await config.aclient.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=0.2,
+        )
+        reply = clean_reply((final.choices[0].message.content or "").strip())
+    else:
+        reply = clean_reply(direct.strip())
+
+    web._remember_reply(user_text, reply)
+    return jsonify({"reply": reply, "cached": False})
+
+@app.post("/chat/stream")
+async def chat_stream():
+    """Async twin of web.chat_stream (same SSE events)."""
+    data = await request.get_json(force=True) or {}
+    user_text = (data.get("message") or data.get("text") or "").strip()
+
+    async def events():
+        try:
+            if not user_text:
+                payload, candidates = {"reply": web.EMPTY_MSG}, None
+            else:
+                payload, candidates = await _pre_chat(user_text)
+            if payload is not None:
+                yield web._sse("delta", {"text": payload["reply"]})
+                yield web._sse("done", payload)
+                return
+
+            messages, tools = build_messages_and_tools(user_text, candidates)
+            messages, direct = await _tool_round(messages, tools)
+
+            if messages is None:
+                reply = clean_reply(direct.strip())
+                yield web._sse("delta", {"text": reply})
+            else:
+                cleaner = ReplyCleaner()
+                parts = []
+                stream = await config.aclient.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=messages,
+                    temperature=0.2,
+                    stream=True,
+                )
+                async for chunk in stream:
+                    text = cleaner.feed(web._delta_text(chunk))
+                    if text:
+                        parts.append(text)
+                        yield web._sse("delta", {"text": text})
+                text = cleaner.flush()
+                if text:
+                    parts.append(text)
+                    yield web._sse("delta", {"text": text})
+                reply = "".join(parts)
+
+            web._remember_reply(user_text, reply)
+            yield web._sse("done", {"reply": reply, "cached": False})
+        except Exception:
+            logger.exception("Streaming chat failed")
+            yield web._sse("error", {"error": "server_error"})
+
+    r = Response(events(), mimetype="text/event-stream")
+    r.headers["Cache-Control"] = "no-cache"
+    r.headers["X-Accel-Buffering"] = "no"
+    return r
+
+if __name__ == "__main__":
+    app.run(host="127.0.0.1", port=5000)
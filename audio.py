@@ -0,0 +1,220 @@
+"""
+Audio helpers for the STT path: decode uploads to mono 16-bit PCM, measure signal energy
+and shrink clips before transcription (resample, trim silence, re-encode).
+
+Samples are NumPy int16 arrays, so every per-sample step runs vectorized. WAV is
+decoded/encoded with the standard library; compressed uploads (webm/opus, ogg, mp3,
+m4a) and Ogg/Opus output go through PyAV (`av` in requirements.txt). When a clip cannot be
+decoded, callers fall back to a size heuristic and forward the upload unchanged.
+"""
+
+from __future__ import annotations
+
+import io
+import wave
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+try:
+    import av  # in requirements; the import guard keeps WAV-only setups working
+except ImportError:
+    av = None
+
+
+class PCM(NamedTuple):
+    samples: np.ndarray  # mono, int16
+    rate: int
+
+    @property
+    def duration_ms(self) -> int:
+        return len(self.samples) * 1000 // self.rate if self.rate else 0
+
+
+def _native_int16(raw: bytes) -> np.ndarray:
+    # WAV and PyAV's packed s16 planes are little-endian
+    return np.frombuffer(raw[: len(raw) // 2 * 2], dtype="<i2").astype(np.int16)
+
+
+def downmix(samples: np.ndarray, channels: int) -> np.ndarray:
+    """Average interleaved channels into one."""
+    if channels <= 1:
+        return samples
+    frames = samples[: len(samples) // channels * channels].reshape(-1, channels)
+    return (frames.sum(axis=1, dtype=np.int32) // channels).astype(np.int16)
+
+
+def _decode_wav(data: bytes) -> Optional[PCM]:
+    try:
+        with wave.open(io.BytesIO(data), "rb") as w:
+            channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+            raw = w.readframes(w.getnframes())
+    except (wave.Error, EOFError):
+        return None
+
+    if width == 2:
+        s = _native_int16(raw)
+    elif width == 1:  # unsigned 8-bit
+        s = ((np.frombuffer(raw, dtype=np.uint8).astype(np.int16) - 128) << 8).astype(np.int16)
+    elif width == 4:
+        s = (np.frombuffer(raw[: len(raw) // 4 * 4], dtype="<i4") >> 16).astype(np.int16)
+    else:
+        return None
+    return PCM(downmix(s, channels), rate)
+
+
+def _decode_av(data: bytes, rate: Optional[int] = None) -> Optional[PCM]:
+    try:
+        with av.open(io.BytesIO(data)) as container:
+            stream = next((s for s in container.streams if s.type == "audio"), None)
+            if stream is None:
+                return None
+            rate = rate or stream.rate or stream.codec_context.sample_rate
+            resampler = av.AudioResampler(format="s16", layout="mono", rate=rate)
+            out = []
+            for frame in container.decode(stream):
+                for chunk in resampler.resample(frame):
+                    out.append(_native_int16(bytes(chunk.planes[0])[: chunk.samples * 2]))
+            for chunk in resampler.resample(None):
+                out.append(_native_int16(bytes(chunk.planes[0])[: chunk.samples * 2]))
+            return PCM(np.concatenate(out) if out else np.zeros(0, np.int16), rate)
+    except Exception:
+        return None
+
+
+def decode(data: bytes, mime: str = "", rate: Optional[int] = None) -> Optional[PCM]:
+    """
+    Mono PCM for an upload, or None when it cannot be decoded here.
+    With `rate`, PyAV resamples while decoding; WAV keeps its native rate (see resample()).
+    """
+    if data[:4] == b"RIFF" or mime == "audio/wav":
+        pcm = _decode_wav(data)
+        if pcm is not None:
+            return pcm
+    if av is not None:
+        return _decode_av(data, rate)
+    return None
+
+
+def resample(pcm: PCM, rate: int) -> PCM:
+    """Linear-interpolation resampler; a box filter in front keeps downsampling from aliasing badly."""
+    src, s = pcm.rate, pcm.samples
+    if src == rate:
+        return pcm
+    if not len(s):
+        return PCM(s, rate)
+    width = int(round(src / rate))
+    if width > 1:
+        # running mean over the last `width` samples (fewer at the start)
+        acc = np.cumsum(s, dtype=np.int64)
+        acc[width:] -= acc[:-width].copy()
+        s = acc // np.minimum(np.arange(1, len(s) + 1), width)
+    n = len(s) * rate // src
+    pos = np.arange(n) * (src / rate)
+    out = np.interp(pos, np.arange(len(s)), s)
+    return PCM(out.astype(np.int16), rate)  # truncates toward zero
+
+
+def frame_dbfs(pcm: PCM, frame_ms: int = 30) -> np.ndarray:
+    """RMS level of consecutive frames in dBFS (-inf for digital silence)."""
+    n = max(1, pcm.rate * frame_ms // 1000)
+    s = pcm.samples
+    if not len(s):
+        return np.zeros(0)
+    starts = np.arange(0, len(s), n)
+    energy = np.add.reduceat(np.square(s, dtype=np.float64), starts)
+    rms = np.sqrt(energy / np.diff(starts, append=len(s)))
+    with np.errstate(divide="ignore"):
+        return 20 * np.log10(rms / 32768)
+
+
+def voiced_ms(pcm: PCM, threshold_dbfs: float, frame_ms: int = 30) -> int:
+    """Total duration of frames louder than `threshold_dbfs`."""
+    return int(np.count_nonzero(frame_dbfs(pcm, frame_ms) > threshold_dbfs)) * frame_ms
+
+
+def trim_silence(pcm: PCM, threshold_dbfs: float, *, frame_ms: int = 30, pad_ms: int = 200) -> PCM:
+    """Drop leading/trailing frames below `threshold_dbfs`, keeping `pad_ms` of context on each side."""
+    voiced = np.flatnonzero(frame_dbfs(pcm, frame_ms) > threshold_dbfs)
+    if not len(voiced):
+        return PCM(np.zeros(0, np.int16), pcm.rate)
+    n = max(1, pcm.rate * frame_ms // 1000)
+    pad = pcm.rate * pad_ms // 1000
+    start = max(0, int(voiced[0]) * n - pad)
+    end = min(len(pcm.samples), (int(voiced[-1]) + 1) * n + pad)
+    return PCM(pcm.samples[start:end], pcm.rate)
+
+
+def encode_wav(pcm: PCM) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(pcm.rate)
+        w.writeframes(pcm.samples.astype("<i2").tobytes())
+    return buf.getvalue()
+
+
+def _encode_opus(pcm: PCM, bitrate: int = 24000) -> Optional[bytes]:
+    try:
+        buf = io.BytesIO()
+        with av.open(buf, "w", format="ogg") as out:
+            stream = out.add_stream("libopus", rate=pcm.rate)
+            stream.bit_rate = bitrate
+            stream.layout = "mono"
+            frame = av.AudioFrame(format="s16", layout="mono", samples=len(pcm.samples))
+            frame.sample_rate = pcm.rate
+            frame.planes[0].update(pcm.samples.astype("<i2").tobytes())
+            for packet in stream.encode(frame):
+                out.mux(packet)
+            for packet in stream.encode(None):
+                out.mux(packet)
+        return buf.getvalue()
+    except Exception:
+        return None
+
+
+def encode(pcm: PCM):
+    """(bytes, mime): Ogg/Opus when PyAV can encode it, else 16-bit mono WAV."""
+    if av is not None:
+        data = _encode_opus(pcm)
+        if data:
+            return data, "audio/ogg"
+    return encode_wav(pcm), "audio/wav"
+
+
+class Prepared(NamedTuple):
+    data: bytes
+    mime: str
+    silent: Optional[bool]  # None: could not decode, so nothing is known
+    saved_bytes: int
+
+
+def preprocess(data: bytes, mime: str, *, threshold_dbfs: float, min_speech_ms: int,
+               rate: int = 16000, pad_ms: int = 200) -> Prepared:
+    """
+    Decode, downmix to mono, resample to `rate`, trim leading/trailing silence and
+    re-encode. The re-encoded clip is only used when it is smaller than the upload.
+    """
+    pcm = decode(data, mime, rate=rate)
+    if pcm is None:
+        return Prepared(data, mime, None, 0)
+    if voiced_ms(pcm, threshold_dbfs) < min_speech_ms:
+        return Prepared(data, mime, True, 0)
+
+    pcm = trim_silence(resample(pcm, rate), threshold_dbfs, pad_ms=pad_ms)
+    out, out_mime = encode(pcm)
+    if len(out) >= len(data):
+        return Prepared(data, mime, False, 0)
+    return Prepared(out, out_mime, False, len(data) - len(out))
+
+
+def is_silent(data: bytes, mime: str, *, threshold_dbfs: float, min_speech_ms: int) -> Optional[bool]:
+    """
+    True when the clip holds less than `min_speech_ms` of signal above `threshold_dbfs`,
+    False when it has enough, None when it cannot be decoded.
+    """
+    pcm = decode(data, mime)
+    if pcm is None:
+        return None
+    return voiced_ms(pcm, threshold_dbfs) < min_speech_ms
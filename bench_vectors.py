@@ -0,0 +1,119 @@
+"""
+Compare the Chroma and NumPy vector backends on a synthetic catalog (no API calls):
+build time, query latency (p50/p95) and peak RSS. Each backend runs in its own process
+so RSS figures are not mixed.
+
+    python bench_vectors.py --docs 5000 --dim 1536 --queries 200
+    python bench_vectors.py --backends numpy --dtypes float32,float16,int8
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import hashlib
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+class HashEmbedding:
+    """Deterministic pseudo-embeddings seeded by the text, so both backends index identical vectors."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def __call__(self, input):
+        out = []
+        for text in input:
+            seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:4], "little")
+            out.append(np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32).tolist())
+        return out
+
+
+def _client(backend: str, path: str, dtype: str):
+    if backend == "numpy":
+        from vectorstore import NumpyClient
+        return NumpyClient(path, dtype=dtype)
+    import chromadb
+    return chromadb.PersistentClient(path=path)
+
+
+def run_one(backend: str, dtype: str, docs: int, dim: int, queries: int, k: int) -> dict:
+    ef = HashEmbedding(dim)
+    with tempfile.TemporaryDirectory() as path:
+        coll = _client(backend, path, dtype).get_or_create_collection(
+            name="bench", embedding_function=ef, metadata={"hnsw:space": "cosine"},
+        )
+        t0 = time.perf_counter()
+        deferred = getattr(coll, "deferred", None)  # as rag.build_vector_store syncs it
+        with deferred() if deferred else contextlib.nullcontext():
+            for start in range(0, docs, 500):
+                ids = [f"doc-{i}" for i in range(start, min(docs, start + 500))]
+                coll.upsert(ids=ids, documents=[f"document {i}" for i in ids], metadatas=[{"title": i} for i in ids])
+        build_s = time.perf_counter() - t0
+
+        # reopen, as a fresh server process would
+        t0 = time.perf_counter()
+        coll = _client(backend, path, dtype).get_or_create_collection(name="bench", embedding_function=ef)
+        open_s = time.perf_counter() - t0
+
+        lat = []
+        for i in range(queries):
+            t0 = time.perf_counter()
+            coll.query(query_texts=[f"query {i}"], n_results=k, include=["documents", "metadatas", "distances"])
+            lat.append((time.perf_counter() - t0) * 1000)
+        lat.sort()
+
+    return {
+        "backend": backend,
+        "dtype": dtype if backend == "numpy" else "float32",
+        "build_s": round(build_s, 3),
+        "open_s": round(open_s, 3),
+        "p50_ms": round(statistics.median(lat), 3),
+        "p95_ms": round(lat[int(len(lat) * 0.95) - 1], 3),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),  # KiB on Linux
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--docs", type=int, default=2000)
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("-k", type=int, default=7)
+    ap.add_argument("--backends", default="chroma,numpy")
+    ap.add_argument("--dtypes", default="float32,int8", help="numpy backend storage types")
+    ap.add_argument("--child", nargs=2, metavar=("BACKEND", "DTYPE"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        print(json.dumps(run_one(*args.child, args.docs, args.dim, args.queries, args.k)))
+        return
+
+    runs = []
+    for backend in args.backends.split(","):
+        for dtype in (args.dtypes.split(",") if backend == "numpy" else ["float32"]):
+            runs.append((backend, dtype))
+
+    print(f"{'backend':8} {'dtype':8} {'build s':>8} {'open s':>7} {'p50 ms':>8} {'p95 ms':>8} {'RSS MB':>8}")
+    for backend, dtype in runs:
+        cmd = [sys.executable, __file__, "--child", backend, dtype, "--docs", str(args.docs),
+               "--dim", str(args.dim), "--queries", str(args.queries), "-k", str(args.k)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"{backend:8} {dtype:8} failed: {proc.stderr.strip().splitlines()[-1:]}")
+            continue
+        r = json.loads(proc.stdout.strip().splitlines()[-1])
+        print(f"{r['backend']:8} {r['dtype']:8} {r['build_s']:>8} {r['open_s']:>7} "
+              f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['max_rss_mb']:>8}")
+
+
+if __name__ == "__main__":
+    main()
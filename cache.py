@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+_SQL_VARS = 500  # stay well below SQLite's bound-parameter limit
+
+
+def make_key(*parts: Any) -> str:
+    """Stable hex key for any JSON-serialisable parts (order matters)."""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class DiskStore:
+    """
+    Tiny SQLite key/value store for JSON values with optional per-entry expiry.
+    Opens a short-lived connection per operation, so it is safe to share between
+    threads and between worker processes. Nothing touches disk until first use.
+    """
+
+    def __init__(self, path: str | os.PathLike, table: str = "kv"):
+        self.path = Path(path)
+        self.table = table
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    with closing(sqlite3.connect(str(self.path), timeout=10)) as conn, conn:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.execute(
+                            f"CREATE TABLE IF NOT EXISTS {self.table} "
+                            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)"
+                        )
+                    self._ready = True
+        return sqlite3.connect(str(self.path), timeout=10)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Return {key: value} for the keys that exist and have not expired."""
+        keys = list(keys)
+        out: Dict[str, Any] = {}
+        now = time.time()
+        with closing(self._connect()) as conn:
+            for start in range(0, len(keys), _SQL_VARS):
+                chunk = keys[start:start + _SQL_VARS]
+                marks = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT key, value, expires FROM {self.table} WHERE key IN ({marks})", chunk
+                ).fetchall()
+                for key, value, expires in rows:
+                    if expires is not None and expires <= now:
+                        continue
+                    try:
+                        out[key] = json.loads(value)
+                    except Exception:
+                        continue
+        return out
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.set_many({key: value}, ttl=ttl)
+
+    def set_many(self, items: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        if not items:
+            return
+        expires = time.time() + ttl if ttl else None
+        rows = [(k, json.dumps(v, ensure_ascii=False), expires) for k, v in items.items()]
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires) VALUES (?, ?, ?)", rows
+            )
+
+    def delete(self, key: str) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe in-process LRU cache with a per-entry TTL and hit/miss counters.
+    With a DiskStore attached, misses fall through to it and writes go to both,
+    so several worker processes can share entries.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None, store: Optional[DiskStore] = None):
+        self.maxsize = max(0, int(maxsize))
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self.store = store
+        self._data: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, value = item
+                if expires and expires <= now:
+                    del self._data[key]
+                else:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+        value = _MISSING
+        if self.store is not None:
+            try:
+                value = self.store.get(key, _MISSING)
+            except Exception:
+                value = _MISSING
+
+        with self._lock:
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._put(key, value, now)
+            return value
+
+    def peek(self, key: str, default: Any = None) -> Any:
+        """Like get(), but leaves counters and LRU order untouched."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and not (item[0] and item[0] <= time.time()):
+                return item[1]
+        if self.store is not None:
+            try:
+                return self.store.get(key, default)
+            except Exception:
+                pass
+        return default
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._put(key, value, time.time())
+        if self.store is not None:
+            try:
+                self.store.set(key, value, ttl=self.ttl)
+            except Exception:
+                pass
+
+    def _put(self, key: str, value: Any, now: float) -> None:
+        if not self.maxsize:
+            return
+        self._data[key] = (now + self.ttl if self.ttl else 0.0, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+class FileCache:
+    """
+    Content-addressed files in one directory with a byte quota (and optional file-count quota).
+    Recency is the file mtime, refreshed on every hit; the least recently used files are
+    evicted first. Only files matching `pattern` are managed, so the directory can be shared.
+    """
+
+    def __init__(self, directory: str | os.PathLike, *, max_bytes: int, max_files: int = 0, pattern: str = "*"):
+        self.dir = Path(directory)
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_files = max(0, int(max_files))
+        self.pattern = pattern
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key: str, suffix: str) -> Path:
+        return self.dir / f"{key}{suffix}"
+
+    def get(self, key: str, suffix: str) -> Optional[Path]:
+        """Path of a cached file (marked as recently used), or None."""
+        p = self.path(key, suffix)
+        try:
+            os.utime(p)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return p
+
+    def put(self, key: str, suffix: str, data: bytes) -> Path:
+        """Atomically write `data` under `key`, then evict down to the quota."""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        p = self.path(key, suffix)
+        tmp = p.with_name(f".{p.name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, p)
+        self.evict(keep=p)
+        return p
+
+    def _entries(self):
+        out = []
+        for p in self.dir.glob(self.pattern):
+            if p.name.startswith("."):
+                continue
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            out.append((st.st_mtime, st.st_size, p))
+        return out
+
+    def evict(self, keep: Optional[Path] = None) -> int:
+        """Delete least recently used files until both quotas hold; returns files removed."""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda e: e[0])
+            total = sum(e[1] for e in entries)
+            count = len(entries)
+            removed = 0
+            for _, size, p in entries:
+                over_bytes = self.max_bytes and total > self.max_bytes
+                over_count = self.max_files and count > self.max_files
+                if not (over_bytes or over_count):
+                    break
+                if keep is not None and p == keep:
+                    continue
+                try:
+                    p.unlink()
+                except OSError:
+                    continue
+                total -= size
+                count -= 1
+                removed += 1
+            return removed
+
+    def usage(self) -> Dict[str, Any]:
+        entries = self._entries() if self.dir.exists() else []
+        with self._lock:
+            return {
+                "files": len(entries),
+                "bytes": sum(e[1] for e in entries),
+                "max_bytes": self.max_bytes,
+                "max_files": self.max_files,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
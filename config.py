@@ -4,7 +4,7 @@ import os
 from pathlib import Path
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
 # Load environment 
 load_dotenv()
@@ -18,6 +18,10 @@ BOOKS_PATH: Path = DATA_DIR / "books.json"
 BOOKS_EXT_PATH: Path = DATA_DIR / "books_ext.json" 
 PERSIST_DIR: Path = BASE / "chroma_db"             
 COLLECTION_NAME: str = "books"
+# "chroma" (persistent HNSW) or "numpy" (memory-mapped matrix under VECTOR_INDEX_DIR, see vectorstore.py)
+VECTOR_BACKEND: str = os.getenv("VECTOR_BACKEND", "chroma")
+VECTOR_INDEX_DIR: Path = BASE / "vector_index"
+VECTOR_DTYPE: str = os.getenv("VECTOR_DTYPE", "float32")  # numpy backend only: float32 | float16 | int8
 
 # Static output folders used by media routes
 GENERATED_IMAGES_DIR: Path = STATIC_DIR / "gen"
@@ -26,22 +30,98 @@ GENERATED_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
 STATIC_AUDIO_DIR: Path = STATIC_DIR / "audio"
 STATIC_AUDIO_DIR.mkdir(parents=True, exist_ok=True)
 
+# On-disk caches (SQLite files, created lazily)
+CACHE_DIR: Path = BASE / "cache"
+THEME_VOCAB_DB: Path = CACHE_DIR / "theme_vocab.sqlite3"
+TTS_CHUNK_DB: Path = CACHE_DIR / "tts_chunks.sqlite3"  # playlist chunk specs, shared by all workers
+
 # --- Model & tuning defaults ---
 EMB_MODEL: str  = os.getenv("EMB_MODEL", "text-embedding-3-small")
 CHAT_MODEL: str = os.getenv("CHAT_MODEL", "gpt-4o-mini")
 GATE_MODEL: str = os.getenv("GATE_MODEL", "gpt-4o")  # intent/insult gates
+# "model" (default): the model fetches summaries via a tool and writes the reply in a second (streamable) call;
+# "server" (opt-in): the model picks {title, reasons} and the server formats the reply (one chat call)
+RENDER_MODE: str = os.getenv("RENDER_MODE", "model")
+
+# Thread pool shared by the concurrent pre-retrieval calls (moderation, insult gate, expansion)
+GATE_WORKERS: int = int(os.getenv("GATE_WORKERS", "32"))
+
+# Moderation verdict cache: (allow, reason) per raw text + context hint
+MODERATION_CACHE_SIZE: int  = int(os.getenv("MODERATION_CACHE_SIZE", "4096"))
+MODERATION_CACHE_TTL: float = float(os.getenv("MODERATION_CACHE_TTL", "3600"))
+MODERATION_CACHE_DB: str    = os.getenv("MODERATION_CACHE_DB", "")
+
+# Full /chat response cache (off unless RESPONSE_CACHE_SIZE > 0)
+RESPONSE_CACHE_SIZE: int  = int(os.getenv("RESPONSE_CACHE_SIZE", "0"))
+RESPONSE_CACHE_TTL: float = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_DB: str    = os.getenv("RESPONSE_CACHE_DB", "")
+
+# Embedding cache in front of the Chroma embedding function (build + query); EMBED_CACHE_DB shares it on disk
+EMBED_CACHE_SIZE: int = int(os.getenv("EMBED_CACHE_SIZE", "4096"))
+EMBED_CACHE_DB: str   = os.getenv("EMBED_CACHE_DB", "")
 
 TOP_K: int = int(os.getenv("TOP_K", "7"))
+# Candidates sent to the chat model (selection.py): relative distance cutoff + elbow, bounded k, token budget;
+# "all/more" requests get up to CANDIDATES_WIDE_MAX_K
+CANDIDATES_MIN_K: int        = int(os.getenv("CANDIDATES_MIN_K", "3"))
+CANDIDATES_MAX_K: int        = int(os.getenv("CANDIDATES_MAX_K", "8"))
+CANDIDATES_WIDE_MAX_K: int   = int(os.getenv("CANDIDATES_WIDE_MAX_K", "20"))
+CANDIDATES_REL_CUTOFF: float = float(os.getenv("CANDIDATES_REL_CUTOFF", "0.25"))
+CANDIDATES_GAP: float        = float(os.getenv("CANDIDATES_GAP", "0.08"))
+CANDIDATES_TOKEN_BUDGET: int = int(os.getenv("CANDIDATES_TOKEN_BUDGET", "2500"))  # 0 = no budget
+# fuzzy title lookups (titles.py) accept a match at or above this confidence (0..1)
+TITLE_MATCH_THRESHOLD: float = float(os.getenv("TITLE_MATCH_THRESHOLD", "0.6"))
+# candidate summaries in the prompt are cut to this many tokens (the tool still returns the full text)
+CANDIDATE_SUMMARY_TOKENS: int = int(os.getenv("CANDIDATE_SUMMARY_TOKENS", "60"))
+# "hybrid" fuses BM25 over the catalog with vector results (RRF); "vector" is Chroma only
+RETRIEVAL_MODE: str      = os.getenv("RETRIEVAL_MODE", "hybrid")
+# skip the LLM query rewrite when this share of the query's terms is already in the catalog (>1 = never skip)
+LEXICAL_SKIP_EXPANSION: float = float(os.getenv("LEXICAL_SKIP_EXPANSION", "0.8"))
+
+# Theme synonym expansion (only themes missing from THEME_VOCAB_DB are sent upstream)
+THEME_VOCAB_BATCH: int   = int(os.getenv("THEME_VOCAB_BATCH", "50"))
+THEME_VOCAB_WORKERS: int = int(os.getenv("THEME_VOCAB_WORKERS", "4"))
+
+# Query expansion cache (in-process LRU; set QUERY_CACHE_DB to share entries between workers)
+QUERY_CACHE_SIZE: int  = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL: float = float(os.getenv("QUERY_CACHE_TTL", "86400"))
+QUERY_CACHE_DB: str    = os.getenv("QUERY_CACHE_DB", "")
 
 # TTS
 TTS_MODEL: str          = os.getenv("TTS_MODEL", "gpt-4o-mini-tts")
 TTS_DEFAULT_VOICE: str  = os.getenv("TTS_DEFAULT_VOICE", "alloy")
 TTS_DEFAULT_FORMAT: str = os.getenv("TTS_DEFAULT_FORMAT", "mp3")
+TTS_CACHE_MAX_BYTES: int = int(os.getenv("TTS_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))  # STATIC_AUDIO_DIR quota
+TTS_STREAM_CHUNK: int    = int(os.getenv("TTS_STREAM_CHUNK", "16384"))
+# streamed replies longer than this are passed through but not cached (bounds per-request memory)
+TTS_CACHE_MAX_ITEM_BYTES: int = int(os.getenv("TTS_CACHE_MAX_ITEM_BYTES", str(8 * 1024 * 1024)))
+# long-form playlists: replies are split into chunks of at most TTS_CHUNK_CHARS, synthesized TTS_WORKERS at a time
+TTS_CHUNK_CHARS: int     = int(os.getenv("TTS_CHUNK_CHARS", "600"))
+TTS_WORKERS: int         = int(os.getenv("TTS_WORKERS", "4"))
+
+# ---------- STT ----------
+# clips with less than STT_MIN_SPEECH_MS above STT_SILENCE_DBFS are answered locally as silence
+STT_SILENCE_DBFS: float  = float(os.getenv("STT_SILENCE_DBFS", "-45"))
+STT_MIN_SPEECH_MS: int   = int(os.getenv("STT_MIN_SPEECH_MS", "250"))
+# decodable clips are downmixed, resampled to STT_SAMPLE_RATE, trimmed and re-encoded before upload
+STT_PREPROCESS: bool     = os.getenv("STT_PREPROCESS", "1") not in ("0", "false", "False")
+STT_SAMPLE_RATE: int     = int(os.getenv("STT_SAMPLE_RATE", "16000"))
+STT_TRIM_PAD_MS: int     = int(os.getenv("STT_TRIM_PAD_MS", "200"))
 
 # Image generation
 IMG_MODEL: str           = os.getenv("IMG_MODEL", "gpt-image-1")
 IMG_DEFAULT_SIZE: str    = os.getenv("IMG_DEFAULT_SIZE", "1024x1024")  
-IMG_DEFAULT_QUALITY: str = os.getenv("IMG_DEFAULT_QUALITY", "low")     
+IMG_DEFAULT_QUALITY: str = os.getenv("IMG_DEFAULT_QUALITY", "low")
+IMG_CACHE_MAX_BYTES: int = int(os.getenv("IMG_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))  # GENERATED_IMAGES_DIR quota
+IMG_CACHE_MAX_FILES: int = int(os.getenv("IMG_CACHE_MAX_FILES", "2000"))                 # 0 = no count limit
+# WebP renditions written next to each cover (needs Pillow); own quota, LRU-evicted like the PNGs
+IMG_DERIVATIVE_WIDTHS: list = [int(w) for w in os.getenv("IMG_DERIVATIVE_WIDTHS", "256,512").split(",") if w.strip()]
+IMG_WEBP_QUALITY: int    = int(os.getenv("IMG_WEBP_QUALITY", "80"))
+IMG_DERIVATIVE_MAX_BYTES: int = int(os.getenv("IMG_DERIVATIVE_MAX_BYTES", str(100 * 1024 * 1024)))
+IMG_WORKERS: int         = int(os.getenv("IMG_WORKERS", "3"))       # global cap on concurrent image generations
+IMG_JOB_TTL: float       = float(os.getenv("IMG_JOB_TTL", "3600"))  # finished jobs are forgotten after this     
+# longest ?wait= a job poll may block a sync Flask worker; the ASGI app allows routes_media.MAX_JOB_WAIT
+IMG_JOB_MAX_WAIT_WSGI: float = float(os.getenv("IMG_JOB_MAX_WAIT_WSGI", "2"))
 
 # --- OpenAI client ---
 api_key = os.getenv("OPENAI_API_KEY")
@@ -49,3 +129,4 @@ if not api_key:
     raise RuntimeError("OPENAI_API_KEY is missing. Set it in your environment or in a .env file.")
 
 client = OpenAI(api_key=api_key)
+aclient = AsyncOpenAI(api_key=api_key)  # used by the ASGI serving mode (asgi.py)
@@ -0,0 +1,147 @@
+"""
+Caching wrapper around a Chroma embedding function.
+
+Vectors are keyed on (embedding model, whitespace-collapsed text) and kept as float32
+arrays in an in-process LRU; with a DiskStore attached they are also shared between
+workers and restarts. Only texts missing from both tiers reach the wrapped function,
+in one batched call.
+"""
+
+from __future__ import annotations
+
+import base64
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+from cache import DiskStore, make_key
+
+try:
+    from chromadb.api.types import EmbeddingFunction as _EmbeddingFunction
+except ImportError:  # older chromadb, or the test stub
+    _EmbeddingFunction = object
+
+
+def _pack(vec: array) -> str:
+    if sys.byteorder == "big":
+        vec = array("f", vec)
+        vec.byteswap()
+    return base64.b64encode(vec.tobytes()).decode("ascii")
+
+
+def _unpack(raw: str) -> array:
+    vec = array("f")
+    vec.frombytes(base64.b64decode(raw))
+    if sys.byteorder == "big":
+        vec.byteswap()
+    return vec
+
+
+class EmbeddingCache:
+    """Thread-safe LRU of float32 vectors with an optional SQLite tier and hit counters."""
+
+    def __init__(self, maxsize: int = 4096, store: Optional[DiskStore] = None):
+        self.maxsize = max(0, int(maxsize))
+        self.store = store
+        self._data: "OrderedDict[str, array]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return make_key("emb", model, " ".join(str(text).split()))
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, array]:
+        found: Dict[str, array] = {}
+        with self._lock:
+            for k in keys:
+                vec = self._data.get(k)
+                if vec is not None:
+                    self._data.move_to_end(k)
+                    found[k] = vec
+
+        missing = [k for k in dict.fromkeys(keys) if k not in found]
+        from_disk: Dict[str, array] = {}
+        if missing and self.store is not None:
+            try:
+                from_disk = {k: _unpack(v) for k, v in self.store.get_many(missing).items()}
+            except Exception:
+                from_disk = {}
+
+        with self._lock:
+            for k, vec in from_disk.items():
+                self._put(k, vec)
+            found.update(from_disk)
+            for k in keys:
+                if k in from_disk:
+                    self.disk_hits += 1
+                elif k in found:
+                    self.memory_hits += 1
+                else:
+                    self.misses += 1
+        return found
+
+    def set_many(self, items: Dict[str, array]) -> None:
+        with self._lock:
+            for k, vec in items.items():
+                self._put(k, vec)
+        if self.store is not None and items:
+            try:
+                self.store.set_many({k: _pack(v) for k, v in items.items()})
+            except Exception:
+                pass
+
+    def _put(self, key: str, vec: array) -> None:
+        if not self.maxsize:
+            return
+        self._data[key] = vec
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+            }
+
+
+class CachingEmbeddingFunction(_EmbeddingFunction):
+    """Chroma embedding function that serves repeated texts from an EmbeddingCache."""
+
+    def __init__(self, inner, model: str, cache: EmbeddingCache):
+        self.inner = inner
+        self.model = model
+        self.cache = cache
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        texts = [str(t) for t in input]
+        keys = [self.cache.key(self.model, t) for t in texts]
+        found = self.cache.get_many(keys)
+
+        todo: Dict[str, str] = {}
+        for k, t in zip(keys, texts):
+            if k not in found:
+                todo.setdefault(k, t)
+        if todo:
+            vectors = self.inner(list(todo.values()))
+            fresh = {k: array("f", vec) for k, vec in zip(todo, vectors)}
+            self.cache.set_many(fresh)
+            found.update(fresh)
+
+        return [found[k].tolist() for k in keys]
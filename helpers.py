@@ -1,11 +1,45 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import re
-from typing import Dict, Callable, Any
+import threading
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Callable, Any, Awaitable, Optional
 
-from config import client, GATE_MODEL
+import config
+from cache import DiskStore, TTLCache, make_key
+from config import (
+    client,
+    GATE_MODEL,
+    GATE_WORKERS,
+    MODERATION_CACHE_SIZE,
+    MODERATION_CACHE_TTL,
+    MODERATION_CACHE_DB,
+    TITLE_MATCH_THRESHOLD,
+)
 from rag import normalize_text
+from titles import PhraseMatcher, TitleIndex, TitleMentions
+
+
+GREET_REPLY = "Hi! What kind of books are you interested in?"
+
+_gate_pool = ThreadPoolExecutor(max_workers=GATE_WORKERS, thread_name_prefix="gate")
+_prefetched_moderation: ContextVar[Optional[tuple]] = ContextVar("_prefetched_moderation", default=None)
+
+moderation_cache = TTLCache(
+    maxsize=MODERATION_CACHE_SIZE,
+    ttl=MODERATION_CACHE_TTL,
+    store=DiskStore(MODERATION_CACHE_DB, table="moderation") if MODERATION_CACHE_DB else None,
+)
+
+
+def submit_upstream(fn: Callable, *args, **kwargs) -> Future:
+    """Run a blocking upstream call on the shared gate pool."""
+    return _gate_pool.submit(fn, *args, **kwargs)
 
 
 def _to_text(v: Any) -> str:
@@ -29,10 +63,15 @@ def parse_json_loose(text: str) -> Dict:
 
 
 def get_summary_by_title_local_factory(
-    books_ext: list, _books_small_unused: list
+    books_ext: list, _books_small_unused: list, threshold: float = TITLE_MATCH_THRESHOLD
 ) -> Callable[[str], str]:
+    """
+    Extended-summary lookup by title. Exact normalized/raw titles first, then the fuzzy
+    TitleIndex (dropped subtitle or article, typos) when its confidence reaches `threshold`.
+    """
     ext_map_norm = {normalize_text(b["title"]): _to_text(b["summary"]) for b in books_ext}
     ext_map_raw = {b["title"]: _to_text(b["summary"]) for b in books_ext}
+    index = TitleIndex(list(ext_map_raw), threshold=threshold)
 
     def _impl(title: str) -> str:
         if not title:
@@ -42,11 +81,34 @@ def get_summary_by_title_local_factory(
             return ext_map_norm[t_norm]
         if title in ext_map_raw:
             return ext_map_raw[title]
+        match = index.resolve(title)
+        if match is not None:
+            return ext_map_raw[match]
         return "NOT_FOUND"
 
     return _impl
 
 
+def render_recommendations(picks: list, get_summary: Callable[[str], str]) -> str:
+    """
+    Format a recommend_books selection ([{title, reasons}]) in the layout the model-rendered
+    prompt asks for. Summaries come verbatim from `get_summary`; NOT_FOUND omits the section,
+    and an empty reasons list (a "what is X about" question) omits 'Why this book?'.
+    """
+    blocks = []
+    for pick in picks:
+        lines = [f"**{pick['title']}**"]
+        reasons = pick.get("reasons") or []
+        if reasons:
+            lines.append("Why this book?")
+            lines.extend(f"- {r}" for r in reasons)
+        summary = get_summary(pick["title"])
+        if summary and summary != "NOT_FOUND":
+            lines.extend(["Summary:", summary])
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+
 # --- light normalization for logs / prompt context (LLM must judge by RAW text) ---
 def normalize_for_moderation(s: str) -> str:
     if not s:
@@ -58,28 +120,38 @@ def normalize_for_moderation(s: str) -> str:
     return t
 
 
-def is_offensive(text: str) -> bool:
-    """Focus on abuse/hate/threats; ignore generic 'violence' buckets."""
+_MODERATION_KEYS = (
+    "harassment", "harassment/threats",
+    "hate", "hate/threatening",
+    "sexual/harassment", "sexual/minors",
+)
+
+
+def _flagged_categories(resp) -> bool:
+    r = resp.results[0]
+    cats = getattr(r, "categories", {}) or {}
+    return any(bool(cats.get(k, False)) for k in _MODERATION_KEYS)
+
+
+def is_offensive(text: str) -> Optional[bool]:
+    """Focus on abuse/hate/threats; ignore generic 'violence' buckets. None when the API call failed."""
     try:
         resp = client.moderations.create(model="omni-moderation-latest", input=text)
-        r = resp.results[0]
-        cats = getattr(r, "categories", {}) or {}
-        keys = (
-            "harassment", "harassment/threats",
-            "hate", "hate/threatening",
-            "sexual/harassment", "sexual/minors",
-        )
-        return any(bool(cats.get(k, False)) for k in keys)
+        return _flagged_categories(resp)
     except Exception:
-        return False
+        return None
 
 
-def insult_gate_llm(user_text: str, *, context_hint: str = "") -> bool:
-    """
-    Return True to ALLOW, False to BLOCK.
-    Strict rule: block if the message contains any insult/profanity/slur/harassment/hate,
-    even when mixed with a normal book request. Language-agnostic.
-    """
+async def is_offensive_async(text: str) -> Optional[bool]:
+    """Async twin of is_offensive (AsyncOpenAI client)."""
+    try:
+        resp = await config.aclient.moderations.create(model="omni-moderation-latest", input=text)
+        return _flagged_categories(resp)
+    except Exception:
+        return None
+
+
+def _insult_gate_messages(user_text: str) -> list:
     cleaned = normalize_for_moderation(user_text)
 
     system = (
@@ -90,30 +162,95 @@ def insult_gate_llm(user_text: str, *, context_hint: str = "") -> bool:
         "Output JSON only."
     )
     user = f"RAW:\n{user_text}\n\nNORMALIZED:\n{cleaned}\n"
+    return [{"role": "system", "content": system},
+            {"role": "user", "content": user}]
+
 
+def insult_gate_llm(user_text: str, *, context_hint: str = "") -> Optional[bool]:
+    """
+    Return True to ALLOW, False to BLOCK, None when the gate call failed.
+    Strict rule: block if the message contains any insult/profanity/slur/harassment/hate,
+    even when mixed with a normal book request. Language-agnostic.
+    """
     try:
         resp = client.chat.completions.create(
             model=GATE_MODEL,
-            messages=[{"role": "system", "content": system},
-                      {"role": "user", "content": user}],
+            messages=_insult_gate_messages(user_text),
             temperature=0,
             max_tokens=50,
         )
         data = parse_json_loose(resp.choices[0].message.content)
         return not bool(data.get("block", False))
     except Exception:
-        return True
+        return None
 
 
-def safety_check(user_text: str, *, context_hint: str = "") -> tuple[bool, str]:
+async def insult_gate_llm_async(user_text: str, *, context_hint: str = "") -> Optional[bool]:
+    """Async twin of insult_gate_llm."""
+    try:
+        resp = await config.aclient.chat.completions.create(
+            model=GATE_MODEL,
+            messages=_insult_gate_messages(user_text),
+            temperature=0,
+            max_tokens=50,
+        )
+        data = parse_json_loose(resp.choices[0].message.content)
+        return not bool(data.get("block", False))
+    except Exception:
+        return None
+
+
+def has_cached_verdict(user_text: str, context_hint: Optional[str] = None) -> bool:
     """
-    Returns (allow, reason).
-    - informational: follow LLM gate (reduce false positives for neutral queries).
-    - other: strict OR with Moderation API.
+    True when safety_check(user_text, context_hint=...) will be answered from the cache.
+    With context_hint None (not known yet), a verdict must be cached under every hint.
+    """
+    hints = ("informational", "") if context_hint is None else (context_hint,)
+    return all(moderation_cache.peek(_verdict_key(user_text, h)) is not None for h in hints)
+
+
+@contextmanager
+def prefetched_moderation(user_text: str, context_hint: Optional[str] = None):
     """
-    api_flagged = is_offensive(user_text)
-    llm_allows = insult_gate_llm(user_text, context_hint=context_hint)
+    Start is_offensive and insult_gate_llm in the background for the duration of the block.
+    safety_check() on the same text joins these calls instead of issuing new ones, so the
+    moderation round-trips overlap with whatever the caller does meanwhile (e.g. intent_gate).
+    Nothing is started when safety_check will find its verdict cached (see has_cached_verdict).
+    """
+    if has_cached_verdict(user_text, context_hint):
+        yield
+        return
+
+    api = submit_upstream(is_offensive, user_text)
+    llm = submit_upstream(insult_gate_llm, user_text)
+    token = _prefetched_moderation.set((user_text, api, llm))
+    try:
+        yield
+    finally:
+        _prefetched_moderation.reset(token)
+        api.cancel()
+        llm.cancel()
+
 
+def _verdict_key(user_text: str, context_hint: str) -> str:
+    return make_key("moderation", GATE_MODEL, user_text, context_hint)
+
+
+def _moderation_verdicts(user_text: str, context_hint: str) -> tuple:
+    """(api_flagged, llm_allows), both upstream checks running concurrently; None marks a failed call."""
+    pre = _prefetched_moderation.get()
+    if pre is not None and pre[0] == user_text:
+        _, api, llm = pre
+    else:
+        api = submit_upstream(is_offensive, user_text)
+        llm = submit_upstream(insult_gate_llm, user_text, context_hint=context_hint)
+    return api.result(), llm.result()
+
+
+def _combine_verdicts(api_flagged: Optional[bool], llm_allows: Optional[bool], context_hint: str) -> tuple[bool, str]:
+    # a failed check does not block (api: not flagged, llm: allows); see _verdict_cacheable
+    api_flagged = bool(api_flagged)
+    llm_allows = llm_allows is not False
     if context_hint == "informational":
         return (llm_allows, "informational_pass" if llm_allows else "informational_block_llm")
 
@@ -121,10 +258,63 @@ def safety_check(user_text: str, *, context_hint: str = "") -> tuple[bool, str]:
     return (allow, "strict_pass" if allow else "strict_or_block")
 
 
-def intent_gate(user_text: str) -> Dict[str, str]:
+def _verdict_cacheable(api_flagged: Optional[bool], llm_allows: Optional[bool], context_hint: str) -> bool:
+    """Only verdicts from checks that answered are cached; fail-open verdicts are re-asked next time."""
+    used = (llm_allows,) if context_hint == "informational" else (api_flagged, llm_allows)
+    return None not in used
+
+
+def safety_check(user_text: str, *, context_hint: str = "") -> tuple[bool, str]:
     """
-    Returns one of: greet / clarify / offtopic / proceed as JSON {action, reply}.
+    Returns (allow, reason).
+    - informational: follow LLM gate (reduce false positives for neutral queries).
+    - other: strict OR with Moderation API.
+    Verdicts are cached per (raw text, context_hint) for MODERATION_CACHE_TTL seconds,
+    unless a check they depend on failed.
+    """
+    key = _verdict_key(user_text, context_hint)
+    cached = moderation_cache.get(key)
+    if cached is not None:
+        return (bool(cached[0]), str(cached[1]))
+
+    api_flagged, llm_allows = _moderation_verdicts(user_text, context_hint)
+    verdict = _combine_verdicts(api_flagged, llm_allows, context_hint)
+    if _verdict_cacheable(api_flagged, llm_allows, context_hint):
+        moderation_cache.set(key, list(verdict))
+    return verdict
+
+
+async def safety_check_async(
+    user_text: str, *, context_hint: str = "", prefetched: Optional[Awaitable] = None
+) -> tuple[bool, str]:
     """
+    Async twin of safety_check. `prefetched` may be an awaitable of (api_flagged, llm_allows)
+    started earlier with moderation_verdicts_async(); it is awaited instead of new calls.
+    """
+    key = _verdict_key(user_text, context_hint)
+    cached = moderation_cache.get(key)
+    if cached is not None:
+        return (bool(cached[0]), str(cached[1]))
+
+    if prefetched is None:
+        prefetched = moderation_verdicts_async(user_text, context_hint=context_hint)
+    api_flagged, llm_allows = await prefetched
+    verdict = _combine_verdicts(api_flagged, llm_allows, context_hint)
+    if _verdict_cacheable(api_flagged, llm_allows, context_hint):
+        moderation_cache.set(key, list(verdict))
+    return verdict
+
+
+async def moderation_verdicts_async(user_text: str, *, context_hint: str = "") -> tuple:
+    """(api_flagged, llm_allows) from both upstream checks, awaited concurrently; None marks a failed call."""
+    api_flagged, llm_allows = await asyncio.gather(
+        is_offensive_async(user_text),
+        insult_gate_llm_async(user_text, context_hint=context_hint),
+    )
+    return bool(api_flagged), bool(llm_allows)
+
+
+def _intent_gate_messages(user_text: str) -> list:
     system = (
         "You are an intent gate for a BOOK recommendation chatbot. "
         "Always respond in English. Output STRICT JSON with keys: action, reply. "
@@ -134,19 +324,17 @@ def intent_gate(user_text: str) -> Dict[str, str]:
         "- 'proceed' when there is ANY book-related clue: title or high-level theme/genre/mood/audience.\n"
         "- 'clarify' only when the message is too vague.\n\n"
         "Replies (use exactly):\n"
-        "- greet → 'Hi! What kind of books are you interested in?'\n"
+        f"- greet → '{GREET_REPLY}'\n"
         "- clarify → 'Please ask about books — a theme, mood, or a specific title from our small library.'\n"
         "- offtopic → 'I can only help with books from this small library. Please mention a title or themes.'\n"
         "- proceed → ''"
     )
-    resp = client.chat.completions.create(
-        model=GATE_MODEL,
-        messages=[{"role": "system", "content": system},
-                  {"role": "user", "content": user_text}],
-        temperature=0,
-        max_tokens=120,
-    )
-    data = parse_json_loose(resp.choices[0].message.content)
+    return [{"role": "system", "content": system},
+            {"role": "user", "content": user_text}]
+
+
+def _parse_intent(content: str) -> Dict[str, str]:
+    data = parse_json_loose(content)
     action = (data.get("action") or "").lower()
     reply = (data.get("reply") or "").strip()
     if action not in {"greet", "clarify", "offtopic", "proceed"}:
@@ -154,11 +342,191 @@ def intent_gate(user_text: str) -> Dict[str, str]:
     return {"action": action, "reply": reply}
 
 
+def intent_gate(user_text: str) -> Dict[str, str]:
+    """
+    Returns one of: greet / clarify / offtopic / proceed as JSON {action, reply}.
+    """
+    resp = client.chat.completions.create(
+        model=GATE_MODEL,
+        messages=_intent_gate_messages(user_text),
+        temperature=0,
+        max_tokens=120,
+    )
+    return _parse_intent(resp.choices[0].message.content)
+
+
+async def intent_gate_async(user_text: str) -> Dict[str, str]:
+    """Async twin of intent_gate."""
+    resp = await config.aclient.chat.completions.create(
+        model=GATE_MODEL,
+        messages=_intent_gate_messages(user_text),
+        temperature=0,
+        max_tokens=120,
+    )
+    return _parse_intent(resp.choices[0].message.content)
+
+
+# --- local intent fast path (skips GATE_MODEL when the answer is obvious) ---
+_GREETINGS = (
+    "hi", "hii", "hello", "hey", "heya", "hiya", "howdy", "yo", "greetings",
+    "good morning", "good afternoon", "good evening", "good day",
+    "salut", "buna", "buna ziua", "buna seara", "hola", "bonjour", "ciao", "hallo", "servus",
+)
+_GREETING_FILLERS = ("there", "again", "all", "everyone", "friend", "bot", "librarian", "smart librarian")
+_GREETING_RE = re.compile(
+    r"^(?:(?:%s)\s*)+(?:(?:%s)\s*)*$" % (
+        "|".join(sorted(map(re.escape, _GREETINGS), key=len, reverse=True)),
+        "|".join(sorted(map(re.escape, _GREETING_FILLERS), key=len, reverse=True)),
+    )
+)
+# words that make a theme mention a book request rather than small talk ("I love pizza")
+_BOOK_CUES = frozenset((
+    "book", "books", "novel", "novels", "read", "reading", "story", "stories", "recommend",
+    "recommendation", "suggest", "author", "literature", "title", "carte", "carti",
+))
+# "what is <title> about" vs "books like <title>" (normalized text)
+_ABOUT_RE = re.compile(
+    r"\b(about|summary|summarize|plot|synopsis|what is|what s|tell me|describe|despre|rezumat|rezumatul|ce e|ce este)\b"
+)
+_SIMILAR_RE = re.compile(
+    r"\b(similar|else|other|others|another|alternatives?|besides|(?<!would )(?<!i d )like|asemanatoare|asemanator|alte|altele|altceva|ca)\b"
+)
+
+_intent_counts: Counter = Counter()
+_intent_lock = threading.Lock()
+
+
+def _count_intent(path: str) -> None:
+    with _intent_lock:
+        _intent_counts[path] += 1
+
+
+def title_question_kind(user_text: str) -> Optional[str]:
+    """'similar' for "books like X", 'about' for "what is X about", else None."""
+    norm = normalize_text(user_text or "")
+    if _SIMILAR_RE.search(norm):
+        return "similar"
+    if _ABOUT_RE.search(norm):
+        return "about"
+    return None
+
+
+def intent_path_stats() -> Dict[str, int]:
+    """How often each intent path was taken; local_* paths are GATE_MODEL calls saved."""
+    with _intent_lock:
+        out = dict(_intent_counts)
+    out["gate_calls_saved"] = out.get("local_greet", 0) + out.get("local_proceed", 0)
+    return out
+
+
+def title_mentions_factory(books_small: list) -> TitleMentions:
+    """Explicit title mentions; numeric/short titles need a book cue next to them."""
+    return TitleMentions((b.get("title", "") for b in books_small), _BOOK_CUES)
+
+
+def local_intent_factory(books_small: list) -> Callable[[str], Optional[Dict[str, str]]]:
+    """
+    Deterministic pre-classifier in front of intent_gate.
+    Returns {action, reply} for standalone greetings and for messages naming a catalog title
+    (or a catalog theme next to a book cue); returns None when unsure so the LLM gate decides.
+    """
+    titles = title_mentions_factory(books_small)
+    themes = PhraseMatcher({
+        t: t for t in (normalize_text(str(x)) for b in books_small for x in b.get("themes", [])) if t
+    })
+
+    def _impl(user_text: str) -> Optional[Dict[str, str]]:
+        norm = normalize_text(user_text or "")
+        if norm and _GREETING_RE.match(norm):
+            _count_intent("local_greet")
+            return {"action": "greet", "reply": GREET_REPLY}
+
+        tokens = norm.split()
+        if tokens and (
+            titles.find(norm)
+            or (_BOOK_CUES.intersection(tokens) and themes.spans(norm))
+        ):
+            _count_intent("local_proceed")
+            return {"action": "proceed", "reply": ""}
+
+        _count_intent("llm")
+        return None
+
+    return _impl
+
+
+_REPLY_LABELS = ("Extended summary:", "extended summary:", "Summary:", "summary:")
+_MAX_LABEL = max(len(lab) for lab in _REPLY_LABELS)
+
+
+def _strip_labels(text: str) -> str:
+    for lab in _REPLY_LABELS:
+        text = text.replace(lab, "")
+    return text
+
+
 def clean_reply(text: str) -> str:
     if not text:
         return text
-    for lab in ("Extended summary:", "extended summary:", "Summary:", "summary:"):
-        text = text.replace(lab, "")
+    text = _strip_labels(text)
     lines = [ln.strip() for ln in text.splitlines()]
     text = "\n".join(ln for ln in lines if ln)
     return text.strip()
+
+
+class ReplyCleaner:
+    """
+    Incremental clean_reply() for streamed text: feed() chunks as they arrive, then flush().
+    The concatenated output equals clean_reply(full_text); only a tail that could still
+    become a label, and trailing whitespace, is held back.
+    """
+
+    def __init__(self):
+        self._line = ""          # raw, not yet emitted part of the current line
+        self._ws = ""            # whitespace waiting for more text on this line
+        self._line_open = False  # current line already produced visible text
+        self._emitted = False
+
+    def feed(self, chunk: str) -> str:
+        self._line += chunk or ""
+        out = []
+        while "\n" in self._line:
+            line, self._line = self._line.split("\n", 1)
+            out.append(self._emit(_strip_labels(line), end_of_line=True))
+        self._line = _strip_labels(self._line)
+        hold = self._label_prefix_len(self._line)
+        safe = self._line[:len(self._line) - hold]
+        self._line = self._line[len(safe):]
+        out.append(self._emit(safe, end_of_line=False))
+        return "".join(out)
+
+    def flush(self) -> str:
+        line, self._line = self._line, ""
+        return self._emit(_strip_labels(line), end_of_line=True)
+
+    @staticmethod
+    def _label_prefix_len(text: str) -> int:
+        for n in range(min(len(text), _MAX_LABEL - 1), 0, -1):
+            tail = text[-n:]
+            if any(lab.startswith(tail) for lab in _REPLY_LABELS):
+                return n
+        return 0
+
+    def _emit(self, text: str, *, end_of_line: bool) -> str:
+        if not self._line_open:
+            text = text.lstrip()
+        body = text.rstrip()
+        out = ""
+        if body:
+            if not self._line_open and self._emitted:
+                out = "\n"
+            out += self._ws + body
+            self._ws = ""
+            self._line_open = True
+            self._emitted = True
+        if end_of_line:
+            self._ws = ""
+            self._line_open = False
+        else:
+            self._ws += text[len(body):]
+        return out
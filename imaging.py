@@ -0,0 +1,59 @@
+"""
+Compressed derivatives of generated covers: WebP renditions at a few widths, used to
+build an <img srcset>. Needs Pillow (`pillow` in requirements.txt); without it only
+the original PNG is served, and a warning says so at startup.
+"""
+
+from __future__ import annotations
+
+import io
+import logging
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger("smartlibrarian.imaging")
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+    logger.warning("Pillow is not installed: WebP cover derivatives are disabled, serving PNG only.")
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def image_width(data: bytes) -> Optional[int]:
+    """Pixel width of an encoded image, or None when it cannot be read."""
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            return im.width
+    except Exception:
+        return None
+
+
+def webp_derivatives(data: bytes, widths: Iterable[int], quality: int = 80) -> Dict[int, bytes]:
+    """
+    {width: webp bytes} for every requested width smaller than the original (aspect kept).
+    Returns {} when Pillow is missing or the image cannot be decoded.
+    """
+    if Image is None:
+        return {}
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            im.load()
+            src = im.convert("RGBA" if "A" in im.getbands() else "RGB")
+    except Exception:
+        return {}
+
+    out = {}
+    for width in sorted(set(widths)):
+        if width >= src.width:
+            continue
+        height = max(1, round(src.height * width / src.width))
+        buf = io.BytesIO()
+        src.resize((width, height), Image.LANCZOS).save(buf, "WEBP", quality=quality, method=4)
+        out[width] = buf.getvalue()
+    return out
@@ -0,0 +1,139 @@
+"""
+Local BM25 index over the catalog (title, themes, theme synonyms, summary) and
+reciprocal-rank fusion with the vector results.
+
+Terms come from rag.normalize_text, so matching is case/diacritic-insensitive.
+Title and theme fields are weighted by repeating their tokens (a cheap BM25F).
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from rag import normalize_text
+
+# English + Romanian function words; they carry no retrieval signal
+STOPWORDS = frozenset("""
+a about after all also an and any are as at be book books by can could do does for from get give
+has have how i in into is it its like me more most my need of on one or other please read recommend
+recommendation recommendations some something suggest tell than that the their them there these this
+to want was what which who why with would you your
+al ale am ar as au ca care carte carti cartea cartile ce cu da de despre din este eu fi imi in la
+mai mi o pe pentru sa se si sunt un una unei unor unui vreau
+""".split())
+
+FIELD_WEIGHTS = {"title": 3, "themes": 2, "synonyms": 1, "summary": 1}
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in normalize_text(text).split() if len(t) > 1 and t not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over one document per book. Postings never change after construction; only the counters are locked."""
+
+    def __init__(self, books: List[Dict], synonyms: Optional[Dict[str, List[str]]] = None,
+                 k1: float = 1.2, b: float = 0.75):
+        synonyms = synonyms or {}
+        self.k1 = k1
+        self.b = b
+        self.titles: List[str] = []
+        self.summaries: List[str] = []
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}  # term -> [(doc, weighted tf)]
+        self._len: List[int] = []
+
+        for book in books:
+            themes = [str(t) for t in book.get("themes", [])]
+            fields = {
+                "title": book.get("title", ""),
+                "themes": " ".join(themes),
+                "synonyms": " ".join(s for t in themes for s in synonyms.get(t, [])),
+                "summary": book.get("summary", ""),
+            }
+            tf: Counter = Counter()
+            for name, text in fields.items():
+                for tok in tokenize(text):
+                    tf[tok] += FIELD_WEIGHTS[name]
+            doc = len(self.titles)
+            self.titles.append(book.get("title", ""))
+            self.summaries.append(book.get("summary", ""))
+            self._len.append(sum(tf.values()))
+            for tok, f in tf.items():
+                self._postings.setdefault(tok, []).append((doc, f))
+
+        n = len(self.titles)
+        self._avg_len = (sum(self._len) / n) if n else 0.0
+        self._idf = {t: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for t, p in self._postings.items()}
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.confident = 0
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        """[(doc index, bm25 score)] best first; only documents sharing a term with the query."""
+        terms = set(tokenize(query))
+        scores: Dict[int, float] = {}
+        for term in terms:
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for i, f in self._postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self._len[i] / self._avg_len)
+                scores[i] = scores.get(i, 0.0) + idf * f * (self.k1 + 1) / (f + norm)
+        return sorted(scores.items(), key=lambda kv: -kv[1])[:k]
+
+    def coverage(self, query: str) -> float:
+        """Share of the query's content terms that occur anywhere in the catalog (0.0 without terms)."""
+        terms = set(tokenize(query))
+        if not terms:
+            return 0.0
+        return sum(t in self._idf for t in terms) / len(terms)
+
+    def is_confident(self, query: str, threshold: float) -> bool:
+        """
+        True when the catalog vocabulary already covers the query (coverage >= threshold)
+        and at least one book matches, i.e. an LLM keyword rewrite would add little.
+        """
+        ok = self.coverage(query) >= threshold and bool(self.search(query, k=1))
+        with self._lock:
+            self.queries += 1
+            self.confident += ok
+        return ok
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "documents": len(self),
+                "queries": self.queries,
+                "expansion_skipped": self.confident,
+            }
+
+
+def rrf_fuse(vector_candidates: List[Dict], index: BM25Index, query: str,
+             k: int, rrf_k: int = 60) -> List[Dict]:
+    """
+    Reciprocal-rank fusion of vector candidates ({title, summary, score}) with BM25 hits.
+    Candidates keep their vector `score` (distance); books found only lexically get score None.
+    """
+    fused: Dict[str, float] = {}
+    by_title: Dict[str, Dict] = {}
+    for rank, cand in enumerate(vector_candidates):
+        title = cand.get("title", "")
+        if title in by_title:
+            continue
+        by_title[title] = cand
+        fused[title] = fused.get(title, 0.0) + 1.0 / (rrf_k + rank + 1)
+
+    for rank, (i, _score) in enumerate(index.search(query, k=max(k, 1))):
+        title = index.titles[i]
+        if title not in by_title:
+            by_title[title] = {"title": title, "summary": index.summaries[i], "score": None}
+        fused[title] = fused.get(title, 0.0) + 1.0 / (rrf_k + rank + 1)
+
+    order = sorted(fused, key=lambda t: -fused[t])
+    return [by_title[t] for t in order[:k]]
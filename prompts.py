@@ -1,85 +1,234 @@
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
+import functools
 import json as pyjson
+import threading
 
-def build_messages_and_tools(query: str, candidates: List[Dict]) -> Tuple[list, list]:
+from config import CHAT_MODEL, CANDIDATE_SUMMARY_TOKENS, RENDER_MODE
+
+try:
+    import tiktoken  # optional: exact counts; otherwise ~4 characters per token
+except ImportError:
+    tiktoken = None
+
+
+# --------------------------- token accounting ---------------------------
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(CHAT_MODEL)
+    except Exception:
+        try:
+            return tiktoken.get_encoding("o200k_base")
+        except Exception:
+            return None
+
+
+def count_tokens(text: str) -> int:
+    """Token count for `text` (tiktoken when installed, else an estimate)."""
+    enc = _encoding()
+    if enc is not None:
+        return len(enc.encode(text or "", disallowed_special=()))
+    return (len(text or "") + 3) // 4
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut `text` to about `max_tokens` tokens at a word boundary, marking the cut with '…'."""
+    text = " ".join((text or "").split())
+    if max_tokens <= 0 or count_tokens(text) <= max_tokens:
+        return text
+    enc = _encoding()
+    head = enc.decode(enc.encode(text, disallowed_special=())[:max_tokens]) if enc is not None else text[: max_tokens * 4]
+    cut = head.rsplit(" ", 1)[0] if " " in head else head
+    return cut.rstrip(" ,;:.") + "…"
+
+
+def messages_tokens(messages: list, tools: Optional[list] = None) -> int:
+    """Prompt size of a chat request: message contents plus the serialized tool schemas."""
+    total = sum(count_tokens(m.get("content") or "") + 4 for m in messages)
+    if tools:
+        total += count_tokens(pyjson.dumps(tools, separators=(",", ":")))
+    return total
+
+
+_prompt_lock = threading.Lock()
+_prompt_counts = {"requests": 0, "tokens_total": 0, "tokens_last": 0, "tokens_max": 0}
+
+
+def _record_prompt(tokens: int) -> None:
+    with _prompt_lock:
+        _prompt_counts["requests"] += 1
+        _prompt_counts["tokens_total"] += tokens
+        _prompt_counts["tokens_last"] = tokens
+        _prompt_counts["tokens_max"] = max(_prompt_counts["tokens_max"], tokens)
+
+
+def prompt_stats() -> Dict[str, float]:
+    """Input tokens of the first chat call per request (tool results not included)."""
+    with _prompt_lock:
+        out = dict(_prompt_counts)
+    out["tokens_avg"] = round(out["tokens_total"] / out["requests"], 1) if out["requests"] else 0.0
+    return out
+
+
+# --------------------------- candidate encoding ---------------------------
+
+def candidate_line(cand: Dict, summary_tokens: int = CANDIDATE_SUMMARY_TOKENS) -> str:
+    """One candidate as compact JSON: t = exact title, s = summary cut to `summary_tokens`. Scores are dropped."""
+    return pyjson.dumps(
+        {"t": cand.get("title", ""), "s": truncate_tokens(cand.get("summary", ""), summary_tokens)},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+
+
+def encode_candidates(candidates: List[Dict], summary_tokens: int = CANDIDATE_SUMMARY_TOKENS) -> str:
+    return "\n".join(candidate_line(c, summary_tokens) for c in candidates)
+
+
+_PREAMBLE = (
+    "You are Smart Librarian — a focused book-recommendation assistant. "
+    "Use ONLY the provided candidates (title + short summary). Do not invent facts.\n\n"
+    "Language:\n"
+    "- Always reply in English.\n"
+    "- Keep book titles exactly as written.\n\n"
+    "Civility:\n"
+    "- If the user's message contains insults/harassment/profanity/hate speech, "
+    "reply exactly: 'Please rephrase respectfully.' and stop.\n\n"
+    "Selection rules (very important):\n"
+    "1) If the user explicitly asks for ONE book, return exactly one title.\n"
+    "2) If the user gives a number N, return exactly N titles.\n"
+    "3) If the user explicitly requests an UNBOUNDED quantity (e.g., 'more', 'all', 'as many as possible'), "
+    "return EVERY relevant candidate — do NOT cap the count.\n"
+    "4) If quantity is unspecified (no number and no unbounded request), return a short list of 1–3 strong matches.\n"
+    "5) Never return more titles than requested, except when rule #3 applies (unbounded request).\n\n"
+)
+
+_MODEL_RENDERED = (
+    "Mandatory tool call:\n"
+    "- After deciding the final list of titles, call the tool 'get_summaries_by_titles' EXACTLY ONCE with that list "
+    "(even if it contains many titles). Wait for the tool result before producing the final answer.\n"
+    "- The tool returns a JSON map {title: full_extended_summary}. For each recommended title, paste the value "
+    "verbatim under 'Summary:'. Do not paraphrase or translate tool content. Do not add extra labels.\n\n"
+    "Output format (repeat the block for each recommended title; if many, repeat for all):\n"
+    "**<Title>**\n"
+    "Why this book?\n"
+    "- <2–3 short reasons based only on the candidate summary>\n"
+    "Summary:\n"
+    "<paste here the exact extended summary from the tool>\n"
+    "If a title has no extended summary (NOT_FOUND or missing), omit the 'Summary:' section for that title.\n\n"
+    "Special case — about a single title:\n"
+    "- If the user only asks what a specific candidate title is about, output ONLY:\n"
+    "  **<Title>**\n"
+    "  Summary:\n"
+    "  <verbatim extended summary from the tool>\n"
+    "  (Do NOT include 'Why this book?' in this case.)"
+)
+
+_SERVER_RENDERED = (
+    "Mandatory tool call:\n"
+    "- After deciding the final list of titles, call the tool 'recommend_books' EXACTLY ONCE with that list, "
+    "best match first. For each title give 2–3 short reasons based only on its candidate summary.\n"
+    "- Do not write the answer yourself: the server formats it and adds the full summaries.\n\n"
+    "Special case — about a single title:\n"
+    "- If the user only asks what a specific candidate title is about, pass just that title with an empty reasons list."
+)
+
+_REMEMBER = (
+    "Remember:\n"
+    "- If the user asked for ONE book, return EXACTLY ONE.\n"
+    "- If the user asked for a number N, return EXACTLY N.\n"
+    "- If the user asked for an UNBOUNDED quantity (e.g., 'more', 'all', 'as many as possible'), return EVERY relevant candidate.\n"
+    "- If quantity is unspecified, return 1–3 strong matches."
+)
+
+_TITLES_DESCRIPTION = "Exact book titles as they appear in the candidates' t field (case-sensitive)."
+
+SUMMARIES_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "get_summaries_by_titles",
+        "description": "Return a JSON map {title: full_extended_summary} for all requested titles.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "titles": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": _TITLES_DESCRIPTION,
+                }
+            },
+            "required": ["titles"],
+        },
+    },
+}
+
+RECOMMEND_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "recommend_books",
+        "description": "Submit the final recommendations; the server renders the reply with full summaries.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "books": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "title": {"type": "string", "description": _TITLES_DESCRIPTION},
+                            "reasons": {
+                                "type": "array",
+                                "items": {"type": "string"},
+                                "description": "2–3 short reasons in English; empty when the user only asked what the book is about.",
+                            },
+                        },
+                        "required": ["title", "reasons"],
+                    },
+                }
+            },
+            "required": ["books"],
+        },
+    },
+}
+
+
+def build_messages_and_tools(query: str, candidates: List[Dict], render: str = RENDER_MODE) -> Tuple[list, list]:
     """
     Build system/user messages and the single tool schema for the chat call.
     Planner + executor in one round with an enforced single tool call.
+
+    render="model": the model fetches summaries with get_summaries_by_titles and writes the
+    final reply in a second call. render="server": the model only submits {title, reasons}
+    through recommend_books and the server formats the reply (helpers.render_recommendations).
     """
-    system_msg = (
-        "You are Smart Librarian — a focused book-recommendation assistant. "
-        "Use ONLY the provided candidates (title + short summary). Do not invent facts.\n\n"
-        "Language:\n"
-        "- Always reply in English.\n"
-        "- Keep book titles exactly as written.\n\n"
-        "Civility:\n"
-        "- If the user's message contains insults/harassment/profanity/hate speech, "
-        "reply exactly: 'Please rephrase respectfully.' and stop.\n\n"
-        "Selection rules (very important):\n"
-        "1) If the user explicitly asks for ONE book, return exactly one title.\n"
-        "2) If the user gives a number N, return exactly N titles.\n"
-        "3) If the user explicitly requests an UNBOUNDED quantity (e.g., 'more', 'all', 'as many as possible'), "
-        "return EVERY relevant candidate — do NOT cap the count.\n"
-        "4) If quantity is unspecified (no number and no unbounded request), return a short list of 1–3 strong matches.\n"
-        "5) Never return more titles than requested, except when rule #3 applies (unbounded request).\n\n"
-        "Mandatory tool call:\n"
-        "- After deciding the final list of titles, call the tool 'get_summaries_by_titles' EXACTLY ONCE with that list "
-        "(even if it contains many titles). Wait for the tool result before producing the final answer.\n"
-        "- The tool returns a JSON map {title: full_extended_summary}. For each recommended title, paste the value "
-        "verbatim under 'Summary:'. Do not paraphrase or translate tool content. Do not add extra labels.\n\n"
-        "Output format (repeat the block for each recommended title; if many, repeat for all):\n"
-        "**<Title>**\n"
-        "Why this book?\n"
-        "- <2–3 short reasons based only on the candidate summary>\n"
-        "Summary:\n"
-        "<paste here the exact extended summary from the tool>\n"
-        "If a title has no extended summary (NOT_FOUND or missing), omit the 'Summary:' section for that title.\n\n"
-        "Special case — about a single title:\n"
-        "- If the user only asks what a specific candidate title is about, output ONLY:\n"
-        "  **<Title>**\n"
-        "  Summary:\n"
-        "  <verbatim extended summary from the tool>\n"
-        "  (Do NOT include 'Why this book?' in this case.)"
-    )
+    server = render == "server"
+    system_msg = _PREAMBLE + (_SERVER_RENDERED if server else _MODEL_RENDERED)
 
-    user_prompt = (
-        "Task:\n"
+    task = (
+        "Choose book recommendations strictly from these candidates, then call 'recommend_books' ONCE "
+        "with the selected titles and your reasons.\n\n"
+        if server else
         "Choose book recommendations strictly from these candidates, then call the tool ONCE to fetch full summaries "
         "for ALL selected titles. Finally, format the answer exactly as requested.\n\n"
-        "Candidates (JSON with 'title' and 'summary'):\n"
-        f"{pyjson.dumps(candidates, ensure_ascii=False, indent=2)}\n\n"
+    )
+    user_prompt = (
+        "Task:\n"
+        f"{task}"
+        "Candidates (one JSON object per line; t = exact title, s = short summary):\n"
+        f"{encode_candidates(candidates)}\n\n"
         "User message:\n"
         f"{query}\n\n"
-        "Remember:\n"
-        "- If the user asked for ONE book, return EXACTLY ONE.\n"
-        "- If the user asked for a number N, return EXACTLY N.\n"
-        "- If the user asked for an UNBOUNDED quantity (e.g., 'more', 'all', 'as many as possible'), return EVERY relevant candidate.\n"
-        "- If quantity is unspecified, return 1–3 strong matches."
+        f"{_REMEMBER}"
     )
 
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "get_summaries_by_titles",
-                "description": "Return a JSON map {title: full_extended_summary} for all requested titles.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "titles": {
-                            "type": "array",
-                            "items": {"type": "string"},
-                            "description": "Exact book titles as they appear in candidates (case-sensitive).",
-                        }
-                    },
-                    "required": ["titles"],
-                },
-            },
-        }
-    ]
+    tools = [RECOMMEND_TOOL if server else SUMMARIES_TOOL]
 
     messages = [
         {"role": "system", "content": system_msg},
         {"role": "user", "content": user_prompt},
     ]
+    _record_prompt(messages_tokens(messages, tools))
     return messages, tools
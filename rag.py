@@ -1,24 +1,42 @@
 from __future__ import annotations
 
+import contextlib
+import hashlib
 import json
 import os
 import re
 import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List
 
 import chromadb
 from chromadb.utils import embedding_functions
 
+import config
 from config import (
     BOOKS_PATH,
     BOOKS_EXT_PATH,
     PERSIST_DIR,
     COLLECTION_NAME,
+    VECTOR_BACKEND,
+    VECTOR_INDEX_DIR,
+    VECTOR_DTYPE,
     EMB_MODEL,
     CHAT_MODEL,
     TOP_K,
+    THEME_VOCAB_DB,
+    THEME_VOCAB_BATCH,
+    THEME_VOCAB_WORKERS,
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_TTL,
+    QUERY_CACHE_DB,
+    EMBED_CACHE_SIZE,
+    EMBED_CACHE_DB,
     client,
 )
+from cache import DiskStore, TTLCache, make_key
+from embeddings import CachingEmbeddingFunction, EmbeddingCache
+from vectorstore import NumpyClient
 
 
 # --------------------------- small utilities ---------------------------
@@ -57,22 +75,30 @@ def normalize_text(s: str) -> str:
     return re.sub(r"\s+", " ", s).strip()
 
 
+def cache_text(s: str) -> str:
+    """
+    Cache-key form of a message: casefolded, whitespace collapsed, trailing .!? dropped.
+    Unlike normalize_text it keeps every script, emoji and symbol, so different messages never share an entry.
+    """
+    return " ".join((s or "").casefold().split()).rstrip(" .!?")
+
+
 # --------------------------- LLM augmentation ---------------------------
 
-def llm_expand_theme_vocab(unique_themes: List[str], per_theme_max: int = 3) -> Dict[str, List[str]]:
+_theme_vocab_store = DiskStore(THEME_VOCAB_DB, table="theme_synonyms")
+
+
+def _expand_theme_batch(themes: List[str], per_theme_max: int) -> Dict[str, List[str]]:
     """
-    Ask the model for up to `per_theme_max` near-synonyms per theme.
-    Returns a mapping for all input themes. On failure, returns empty lists.
+    One upstream call for a batch of themes.
+    Returns only the themes the model answered for; on failure, returns {}.
     """
-    if not unique_themes:
-        return {}
-
     system = (
         "Expand each short theme tag into up to "
         f"{per_theme_max} near-synonyms or closely related terms, English only. "
         "Return STRICT JSON mapping the exact input theme to a list of short terms."
     )
-    user = {"themes": unique_themes}
+    user = {"themes": themes}
 
     try:
         resp = client.chat.completions.create(
@@ -86,10 +112,14 @@ def llm_expand_theme_vocab(unique_themes: List[str], per_theme_max: int = 3) ->
         data = parse_json_safe((resp.choices[0].message.content or "").strip()) or {}
     except Exception:
         data = {}
+    if not isinstance(data, dict):
+        return {}
 
     out: Dict[str, List[str]] = {}
-    for t in unique_themes:
-        vals = data.get(t, [])
+    for t in themes:
+        if t not in data:
+            continue
+        vals = data[t]
         out[t] = [
             str(v).strip()
             for v in (vals if isinstance(vals, list) else [])
@@ -98,34 +128,82 @@ def llm_expand_theme_vocab(unique_themes: List[str], per_theme_max: int = 3) ->
     return out
 
 
-def llm_expand_query(query: str, max_terms: int = 10) -> List[str]:
+def _theme_vocab_keys(themes: List[str], per_theme_max: int) -> Dict[str, str]:
+    return {t: make_key("theme", t, CHAT_MODEL, per_theme_max) for t in themes}
+
+
+def stored_theme_vocab(themes: List[str], per_theme_max: int = 3) -> Dict[str, List[str]]:
+    """Synonyms already in the store for `themes` (no upstream calls); unknown themes are left out."""
+    keys = _theme_vocab_keys(themes, per_theme_max)
+    try:
+        stored = _theme_vocab_store.get_many(keys.values())
+    except Exception:
+        stored = {}
+    return {t: stored[k] for t, k in keys.items() if isinstance(stored.get(k), list)}
+
+
+def llm_expand_theme_vocab(unique_themes: List[str], per_theme_max: int = 3) -> Dict[str, List[str]]:
     """
-    Ask the model to rewrite the query into up to `max_terms` short English retrieval terms.
-    Returns a list; on failure, returns [].
+    Ask the model for up to `per_theme_max` near-synonyms per theme.
+    Answers are persisted per (theme, CHAT_MODEL, per_theme_max); only themes not yet in the
+    store are sent upstream, in batches of THEME_VOCAB_BATCH run concurrently.
+    Returns a mapping for all input themes. Themes that could not be expanded map to [].
     """
+    if not unique_themes:
+        return {}
+
+    keys = _theme_vocab_keys(unique_themes, per_theme_max)
+    found = stored_theme_vocab(unique_themes, per_theme_max)
+
+    missing = [t for t in unique_themes if t not in found]
+    if missing:
+        size = max(1, THEME_VOCAB_BATCH)
+        batches = [missing[i:i + size] for i in range(0, len(missing), size)]
+        with ThreadPoolExecutor(max_workers=max(1, min(THEME_VOCAB_WORKERS, len(batches)))) as pool:
+            results = list(pool.map(lambda b: _expand_theme_batch(b, per_theme_max), batches))
+
+        fresh: Dict[str, List[str]] = {}
+        for r in results:
+            fresh.update(r)
+        found.update(fresh)
+        try:
+            _theme_vocab_store.set_many({keys[t]: v for t, v in fresh.items()})
+        except Exception:
+            pass
+
+    return {t: found.get(t, []) for t in unique_themes}
+
+
+query_expansion_cache = TTLCache(
+    maxsize=QUERY_CACHE_SIZE,
+    ttl=QUERY_CACHE_TTL,
+    store=DiskStore(QUERY_CACHE_DB, table="query_expansion") if QUERY_CACHE_DB else None,
+)
+
+
+def _query_expansion_key(query: str, max_terms: int) -> str:
+    return make_key("expand", CHAT_MODEL, max_terms, cache_text(query))
+
+
+def _query_expansion_messages(query: str, max_terms: int) -> List[Dict]:
     system = (
         "Rewrite the user's query into English retrieval terms ONLY. "
         f"Return STRICT JSON: {{\"english_keywords\": [up to {max_terms} short terms]}}. "
         "Use single words or very short phrases. No outside facts."
     )
     user = {"query": query}
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": json.dumps(user, ensure_ascii=False)},
+    ]
 
-    try:
-        resp = client.chat.completions.create(
-            model=CHAT_MODEL,
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": json.dumps(user, ensure_ascii=False)},
-            ],
-            temperature=0.0,
-        )
-        data = parse_json_safe((resp.choices[0].message.content or "").strip()) or {}
-        terms = data.get("english_keywords", [])
-    except Exception:
-        terms = []
 
+def _parse_query_terms(content: str, max_terms: int) -> List[str] | None:
+    """Terms from the model answer, or None when the answer is unusable."""
+    data = parse_json_safe((content or "").strip()) or {}
+    terms = data.get("english_keywords", []) if isinstance(data, dict) else None
     if not isinstance(terms, list):
-        return []
+        return None
 
     out: List[str] = []
     for t in terms:
@@ -135,6 +213,56 @@ def llm_expand_query(query: str, max_terms: int = 10) -> List[str]:
     return out[:max_terms]
 
 
+def llm_expand_query(query: str, max_terms: int = 10) -> List[str]:
+    """
+    Ask the model to rewrite the query into up to `max_terms` short English retrieval terms.
+    Successful answers are cached on (normalized query, CHAT_MODEL, max_terms).
+    Returns a list; on failure, returns [].
+    """
+    key = _query_expansion_key(query, max_terms)
+    cached = query_expansion_cache.get(key)
+    if cached is not None:
+        return list(cached)
+
+    try:
+        resp = client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=_query_expansion_messages(query, max_terms),
+            temperature=0.0,
+        )
+        out = _parse_query_terms(resp.choices[0].message.content, max_terms)
+    except Exception:
+        return []
+
+    if out is None:
+        return []
+    query_expansion_cache.set(key, out)
+    return out
+
+
+async def llm_expand_query_async(query: str, max_terms: int = 10) -> List[str]:
+    """Async twin of llm_expand_query (AsyncOpenAI client, same cache)."""
+    key = _query_expansion_key(query, max_terms)
+    cached = query_expansion_cache.get(key)
+    if cached is not None:
+        return list(cached)
+
+    try:
+        resp = await config.aclient.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=_query_expansion_messages(query, max_terms),
+            temperature=0.0,
+        )
+        out = _parse_query_terms(resp.choices[0].message.content, max_terms)
+    except Exception:
+        return []
+
+    if out is None:
+        return []
+    query_expansion_cache.set(key, out)
+    return out
+
+
 # --------------------------- loading & vector store ---------------------------
 
 def load_books(path: str | os.PathLike = BOOKS_PATH) -> List[Dict]:
@@ -177,62 +305,166 @@ def load_books_ext(path: str | os.PathLike = BOOKS_EXT_PATH) -> List[Dict]:
     return data
 
 
-def build_vector_store(books: List[Dict]):
+def catalog_version(*paths: str | os.PathLike) -> str:
+    """Short content hash over the catalog files; missing files count as empty."""
+    h = hashlib.sha256()
+    for p in paths:
+        h.update(str(p).encode("utf-8") + b"\0")
+        if os.path.exists(p):
+            with open(p, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+        h.update(b"\0")
+    return h.hexdigest()[:16]
+
+
+_UPSERT_BATCH = 500
+
+
+def _book_id(title: str) -> str:
+    """Stable document id derived from the normalized title (survives catalog reordering)."""
+    digest = hashlib.sha1(normalize_text(title).encode("utf-8")).hexdigest()[:16]
+    return f"book-{digest}"
+
+
+def _book_document(title: str, themes: List[str], syns: List[str], summary: str) -> str:
+    return (
+        f"Title: {title}\n"
+        f"Themes: {', '.join(themes)}\n"
+        f"ThemeSynonyms: {', '.join(syns)}\n"
+        f"ThemesBoost: {', '.join(themes)} {', '.join(syns)}\n"
+        f"Summary: {summary}"
+    )
+
+
+def _content_hash(title: str, themes: List[str], summary: str, syns: List[str]) -> str:
+    """Hash of everything that ends up in the embedded document, plus the embedding model."""
+    payload = json.dumps(
+        {"model": EMB_MODEL, "title": title, "themes": themes, "summary": summary, "synonyms": syns},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _stored_theme_synonyms(metadatas) -> Dict[str, List[str]]:
     """
-    Build a persistent Chroma collection and populate it with book documents.
-    Recreates the collection each run.
+    Recover the theme -> synonyms map recorded on previously indexed books. Empty lists are
+    left out: they may come from a failed expansion, so llm_expand_theme_vocab gets to retry
+    them (themes the model really answered with [] are served from its store, not re-asked).
     """
+    out: Dict[str, List[str]] = {}
+    for meta in metadatas:
+        raw = (meta or {}).get("theme_synonyms")
+        data = parse_json_safe(raw) if isinstance(raw, str) else None
+        if isinstance(data, dict):
+            for t, syns in data.items():
+                if isinstance(syns, list) and syns:
+                    out.setdefault(t, [str(s) for s in syns])
+    return out
+
+
+embedding_cache = EmbeddingCache(
+    maxsize=EMBED_CACHE_SIZE,
+    store=DiskStore(EMBED_CACHE_DB, table="embeddings") if EMBED_CACHE_DB else None,
+)
+
+
+def _vector_client():
+    """Persistent Chroma client, or the in-process NumPy index when VECTOR_BACKEND=numpy."""
+    if VECTOR_BACKEND == "numpy":
+        return NumpyClient(VECTOR_INDEX_DIR, dtype=VECTOR_DTYPE)
     os.makedirs(PERSIST_DIR, exist_ok=True)
-    client_chroma = chromadb.PersistentClient(path=str(PERSIST_DIR))
+    return chromadb.PersistentClient(path=str(PERSIST_DIR))
 
-    try:
-        client_chroma.delete_collection(name=COLLECTION_NAME)
-    except Exception:
-        pass
+
+def build_vector_store(books: List[Dict]):
+    """
+    Open (or create) the persistent collection (Chroma or NumPy, see VECTOR_BACKEND) and sync it with `books`.
+    Each book carries a content hash; only new or changed books are embedded and upserted,
+    and books no longer in the catalog are deleted. An unchanged catalog costs no upstream calls.
+    The embedding function is wrapped in `embedding_cache`, so repeated query texts are embedded once.
+    """
+    client_chroma = _vector_client()
 
     try:
-        embedder = embedding_functions.OpenAIEmbeddingFunction(
-            api_key=client.api_key,
-            model_name=EMB_MODEL,
+        embedder = CachingEmbeddingFunction(
+            embedding_functions.OpenAIEmbeddingFunction(api_key=client.api_key, model_name=EMB_MODEL),
+            EMB_MODEL,
+            embedding_cache,
         )
     except Exception as e:
         raise RuntimeError(f"Failed to create OpenAI embedding function: {e!r}")
 
-    collection = client_chroma.create_collection(
+    coll_metadata = {"hnsw:space": "cosine", "emb_model": EMB_MODEL}
+    collection = client_chroma.get_or_create_collection(
         name=COLLECTION_NAME,
         embedding_function=embedder,
-        metadata={"hnsw:space": "cosine"},
+        metadata=coll_metadata,
     )
+    if (collection.metadata or {}).get("emb_model") != EMB_MODEL:
+        # vectors from another embedding model (or a pre-hash layout) are not reusable
+        client_chroma.delete_collection(name=COLLECTION_NAME)
+        collection = client_chroma.create_collection(
+            name=COLLECTION_NAME,
+            embedding_function=embedder,
+            metadata=coll_metadata,
+        )
+
+    existing = collection.get(include=["metadatas"]) or {}
+    existing_meta = dict(zip(existing.get("ids") or [], existing.get("metadatas") or []))
 
-    unique_themes = sorted({t for b in books for t in b.get("themes", [])})
-    theme_syn_map = llm_expand_theme_vocab(unique_themes, per_theme_max=3)
+    unique_themes = sorted({str(t) for b in books for t in b.get("themes", [])})
+    theme_syn_map = _stored_theme_synonyms(existing_meta.values())
+    missing_themes = [t for t in unique_themes if t not in theme_syn_map]
+    if missing_themes:
+        theme_syn_map.update(llm_expand_theme_vocab(missing_themes, per_theme_max=3))
 
     documents: List[str] = []
     metadatas: List[Dict] = []
     ids: List[str] = []
+    wanted: set = set()
 
-    for idx, b in enumerate(books):
+    for b in books:
         title = b["title"]
         themes = [str(t) for t in b.get("themes", [])]
 
+        book_id = _book_id(title)
+        n = 1
+        while book_id in wanted:
+            n += 1
+            book_id = f"{_book_id(title)}-{n}"
+        wanted.add(book_id)
+
         syns: List[str] = []
         for t in themes:
             syns.extend(theme_syn_map.get(t, []))
         syns = [s for s in syns if s]
 
-        doc_text = (
-            f"Title: {title}\n"
-            f"Themes: {', '.join(themes)}\n"
-            f"ThemeSynonyms: {', '.join(syns)}\n"
-            f"ThemesBoost: {', '.join(themes)} {', '.join(syns)}\n"
-            f"Summary: {b['summary']}"
-        )
-
-        documents.append(doc_text)
-        metadatas.append({"title": title})
-        ids.append(f"book-{idx}")
+        content_hash = _content_hash(title, themes, b["summary"], syns)
+        if (existing_meta.get(book_id) or {}).get("content_hash") == content_hash:
+            continue
+
+        documents.append(_book_document(title, themes, syns, b["summary"]))
+        metadatas.append({
+            "title": title,
+            "content_hash": content_hash,
+            "theme_synonyms": json.dumps(
+                {t: theme_syn_map.get(t, []) for t in themes}, ensure_ascii=False
+            ),
+        })
+        ids.append(book_id)
+
+    stale = [i for i in existing_meta if i not in wanted]
+    deferred = getattr(collection, "deferred", None)  # NumPy backend: write the index once per sync
+    with deferred() if deferred else contextlib.nullcontext():
+        for start in range(0, len(stale), _UPSERT_BATCH):
+            collection.delete(ids=stale[start:start + _UPSERT_BATCH])
+
+        for start in range(0, len(ids), _UPSERT_BATCH):
+            end = start + _UPSERT_BATCH
+            collection.upsert(documents=documents[start:end], metadatas=metadatas[start:end], ids=ids[start:end])
 
-    collection.add(documents=documents, metadatas=metadatas, ids=ids)
     return collection
 
 
@@ -1,81 +1,403 @@
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, Response, send_file, stream_with_context, url_for
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait as wait_futures
 from pathlib import Path
-import os, tempfile, base64, uuid
-
-from config import client  
+import io, re, base64, textwrap, threading, time, uuid
+from collections import Counter
+
+import audio
+import imaging
+from cache import DiskStore, FileCache, TTLCache, make_key
+from config import (
+    client,
+    STATIC_AUDIO_DIR,
+    TTS_MODEL,
+    TTS_DEFAULT_VOICE,
+    TTS_DEFAULT_FORMAT,
+    TTS_CACHE_MAX_BYTES,
+    TTS_CACHE_MAX_ITEM_BYTES,
+    TTS_STREAM_CHUNK,
+    TTS_CHUNK_CHARS,
+    TTS_WORKERS,
+    TTS_CHUNK_DB,
+    STT_SILENCE_DBFS,
+    STT_MIN_SPEECH_MS,
+    STT_PREPROCESS,
+    STT_SAMPLE_RATE,
+    STT_TRIM_PAD_MS,
+    IMG_MODEL,
+    IMG_DEFAULT_SIZE,
+    IMG_DEFAULT_QUALITY,
+    IMG_CACHE_MAX_BYTES,
+    IMG_CACHE_MAX_FILES,
+    IMG_WORKERS,
+    IMG_JOB_TTL,
+    IMG_JOB_MAX_WAIT_WSGI,
+    IMG_DERIVATIVE_WIDTHS,
+    IMG_WEBP_QUALITY,
+    IMG_DERIVATIVE_MAX_BYTES,
+)
 
 media_bp = Blueprint("media", __name__)
 
 # ---- error payload ----
-def error_json(message, *, code="bad_request", status=400, hint=None):
+def error_payload(message, *, code="bad_request", hint=None):
     payload = {"error": {"code": code, "message": message}}
     if hint:
         payload["error"]["hint"] = hint
-    return jsonify(payload), status
+    return payload
+
+
+def error_json(message, *, code="bad_request", status=400, hint=None):
+    return jsonify(error_payload(message, code=code, hint=hint)), status
+
+
+class MediaError(Exception):
+    """A request/upstream problem that maps onto an error_json payload."""
+
+    def __init__(self, message, *, code="bad_request", status=400):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+        self.status = status
 
 
 # ===================== TTS =====================
+TTS_FORMATS = {
+    "mp3": "audio/mpeg",
+    "opus": "audio/ogg",
+    "aac": "audio/aac",
+    "flac": "audio/flac",
+    "wav": "audio/wav",
+    "pcm": "audio/L16;rate=24000;channels=1",  # raw 24 kHz PCM: lowest latency to first sample
+}
+TTS_VOICES = {
+    "alloy", "ash", "ballad", "coral", "echo", "fable",
+    "nova", "onyx", "sage", "shimmer", "verse",
+}
+
+# content-addressed: <sha256(model, voice, format, text)>.<format> under static/audio
+tts_cache = FileCache(STATIC_AUDIO_DIR, max_bytes=TTS_CACHE_MAX_BYTES)
+
+
+def tts_params(data: dict):
+    """(text, voice, format) from a request payload; unknown voices/formats fall back to defaults."""
+    text = (data.get("text") or "").strip()
+    voice = (data.get("voice") or TTS_DEFAULT_VOICE).strip().lower()
+    fmt = (data.get("format") or TTS_DEFAULT_FORMAT).strip().lower()
+    if voice not in TTS_VOICES:
+        voice = TTS_DEFAULT_VOICE
+    if fmt not in TTS_FORMATS:
+        fmt = "mp3"
+    return text, voice, fmt
+
+
+def tts_key(text: str, voice: str, fmt: str) -> str:
+    return make_key("tts", TTS_MODEL, voice, fmt, text)
+
+
+def tts_headers(key: str) -> dict:
+    """The audio for a key never changes, so clients may cache it forever."""
+    return {
+        "ETag": f'"{key}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+
+
+# a streamed miss may still be cut short upstream: never let clients keep it
+TTS_STREAM_HEADERS = {"Cache-Control": "no-store"}
+
+
+class CappedBuffer:
+    """Collects streamed chunks for the cache until `limit` bytes, then gives up (memory stays bounded)."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+        self.overflow = False
+
+    def add(self, chunk: bytes) -> None:
+        if self.overflow:
+            return
+        self.size += len(chunk)
+        if self.size > self.limit:
+            self.overflow = True
+            self.parts = []
+        else:
+            self.parts.append(chunk)
+
+    def getvalue(self) -> bytes:
+        return b"".join(self.parts)
+
+
+def _synthesize(text: str, voice: str, fmt: str) -> bytes:
+    """Non-streaming synthesis (fallback when the streaming endpoint is unavailable)."""
+    try:
+        audio = client.audio.speech.create(
+            model=TTS_MODEL,
+            voice=voice,
+            input=text,
+            response_format=fmt,
+        )
+        data = getattr(audio, "content", None)
+        if data is None and hasattr(audio, "read"):
+            data = audio.read()
+    except Exception as e:
+        print("TTS fallback error:", repr(e))
+        raise MediaError("TTS service failed.", code="upstream_error", status=502)
+    if not data:
+        raise MediaError("TTS returned empty audio.", code="upstream_error", status=502)
+    return data
+
+
+def _open_speech_stream(text: str, voice: str, fmt: str):
+    """Enter the upstream streaming response; returns (context manager, response) or None."""
+    try:
+        cm = client.audio.speech.with_streaming_response.create(
+            model=TTS_MODEL,
+            voice=voice,
+            input=text,
+            response_format=fmt,
+        )
+        return cm, cm.__enter__()
+    except Exception as e:
+        print("TTS stream error:", repr(e))
+        return None
+
+
+def _passthrough(cm, resp, key: str, fmt: str):
+    """
+    Yield upstream audio chunks as they arrive; cache the result if it completes within the cap.
+    An upstream error is re-raised so the server aborts the response instead of ending it cleanly.
+    """
+    buf = CappedBuffer(TTS_CACHE_MAX_ITEM_BYTES)
+    completed = False
+    try:
+        for chunk in resp.iter_bytes(TTS_STREAM_CHUNK):
+            if chunk:
+                buf.add(chunk)
+                yield chunk
+        completed = True
+    except Exception as e:
+        print("TTS stream interrupted:", repr(e))
+        raise
+    finally:
+        try:
+            cm.__exit__(None, None, None)
+        except Exception:
+            pass
+    if completed and not buf.overflow and buf.size:
+        try:
+            tts_cache.put(key, f".{fmt}", buf.getvalue())
+        except OSError as e:
+            print("TTS cache write failed:", repr(e))
+
+
 @media_bp.post("/tts")
 def tts():
-    """Text-to-speech (gpt-4o-mini-tts) -> MP3 bytes."""
+    """
+    Text-to-speech (TTS_MODEL) -> audio bytes (MP3 unless 'format' says otherwise).
+    Audio is cached on disk by (text, model, voice, format); repeats are served from
+    static/audio and a matching If-None-Match gets 304 without touching upstream or disk.
+    A miss is streamed: upstream chunks are forwarded as they arrive (chunked response,
+    no-store and no ETag until the completed audio is served from the cache).
+    """
     try:
         data = request.get_json(force=True) or {}
-        text = (data.get("text") or "").strip()
+        text, voice, fmt = tts_params(data)
         if not text:
             return Response(status=204)
 
-        # streaming path
-        try:
-            with client.audio.speech.with_streaming_response.create(
-                model="gpt-4o-mini-tts",
-                voice="alloy",
-                input=text,
-            ) as resp:
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-                    tmp_path = tmp.name
-                try:
-                    resp.stream_to_file(tmp_path)
-                    with open(tmp_path, "rb") as f:
-                        mp3 = f.read()
-                finally:
-                    try:
-                        os.remove(tmp_path)
-                    except OSError:
-                        pass
-
-            r = Response(mp3, mimetype="audio/mpeg")
-            r.headers["Cache-Control"] = "no-store"
-            return r
+        key = tts_key(text, voice, fmt)
+        if request.if_none_match.contains(key):
+            return Response(status=304, headers=tts_headers(key))
 
-        except Exception:
-            # fallback (non-streaming)
-            try:
-                audio = client.audio.speech.create(
-                    model="gpt-4o-mini-tts",
-                    voice="alloy",
-                    input=text,
-                )
-                mp3 = getattr(audio, "content", None)
-                if mp3 is None and hasattr(audio, "read"):
-                    mp3 = audio.read()
-                if not mp3:
-                    return error_json("TTS returned empty audio.", code="upstream_error", status=502)
-
-                r = Response(mp3, mimetype="audio/mpeg")
-                r.headers["Cache-Control"] = "no-store"
+        path = tts_cache.get(key, f".{fmt}")
+        if path is None:
+            opened = _open_speech_stream(text, voice, fmt)
+            if opened is not None:
+                r = Response(stream_with_context(_passthrough(*opened, key, fmt)), mimetype=TTS_FORMATS[fmt])
+                r.headers.update(TTS_STREAM_HEADERS)
                 return r
-            except Exception as e:
-                print("TTS fallback error:", repr(e))
-                return error_json("TTS service failed.", code="upstream_error", status=502)
+            path = tts_cache.put(key, f".{fmt}", _synthesize(text, voice, fmt))
+
+        r = send_file(path, mimetype=TTS_FORMATS[fmt], conditional=False, etag=False, max_age=None)
+        r.headers.update(tts_headers(key))
+        return r
 
+    except MediaError as e:
+        return error_json(e.message, code=e.code, status=e.status)
     except Exception as e:
         print("TTS error:", repr(e))
         return error_json("Malformed request for TTS.", code="bad_request", status=400)
 
 
+# ---- long-form: chunked playlist ----
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+_MIN_CHUNK_CHARS = 80  # consecutive headings / one-liners are spoken as one chunk
+
+_tts_pool = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+_tts_inflight = {}  # key -> Future[Path]
+_tts_lock = threading.Lock()
+# key -> [text, voice, format], so a chunk URL can be (re)synthesized on demand by any worker
+tts_chunk_specs = TTLCache(maxsize=4096, ttl=24 * 3600, store=DiskStore(TTS_CHUNK_DB, table="tts_chunks"))
+
+
+def _pack_sentences(line: str, max_chars: int):
+    out, current = [], ""
+    for sentence in _SENTENCE_END.split(line):
+        pieces = [sentence] if len(sentence) <= max_chars else textwrap.wrap(sentence, max_chars)
+        for piece in pieces:
+            if current and len(current) + 1 + len(piece) > max_chars:
+                out.append(current)
+                current = piece
+            else:
+                current = f"{current} {piece}" if current else piece
+    if current:
+        out.append(current)
+    return out
+
+
+def split_for_tts(text: str, max_chars: int = TTS_CHUNK_CHARS):
+    """
+    Split a reply into speakable chunks of at most `max_chars`.
+    Chunks follow lines (clean_reply leaves no blank lines), so a book summary yields the same
+    chunk (and cache key) whichever reply it appears in. Runs of short lines (a title and its
+    reasons) share one chunk but never merge into a long line; long lines are packed by sentence.
+    """
+    chunks, pending = [], ""
+    for line in (text or "").splitlines():
+        line = " ".join(line.split())
+        if not line:
+            continue
+        if len(line) < _MIN_CHUNK_CHARS:
+            if pending and len(pending) + 1 + len(line) <= max_chars:
+                pending = f"{pending} {line}"
+            else:
+                if pending:
+                    chunks.append(pending)
+                pending = line
+            continue
+        if pending:
+            chunks.append(pending)
+            pending = ""
+        chunks.extend(_pack_sentences(line, max_chars))
+    if pending:
+        chunks.append(pending)
+    return chunks
+
+
+def _render_chunk(key: str, text: str, voice: str, fmt: str) -> Path:
+    path = tts_cache.path(key, f".{fmt}")
+    if path.exists():
+        return path
+    return tts_cache.put(key, f".{fmt}", _synthesize(text, voice, fmt))
+
+
+def _forget(key: str, fut: Future) -> None:
+    with _tts_lock:
+        if _tts_inflight.get(key) is fut:
+            del _tts_inflight[key]
+
+
+def submit_chunk(key: str, text: str, voice: str, fmt: str) -> Future:
+    """Synthesize one chunk on the bounded TTS pool; concurrent requests for a key share one job."""
+    with _tts_lock:
+        fut = _tts_inflight.get(key)
+        fresh = fut is None
+        if fresh:
+            fut = _tts_pool.submit(_render_chunk, key, text, voice, fmt)
+            _tts_inflight[key] = fut
+    if fresh:
+        fut.add_done_callback(lambda f: _forget(key, f))
+    return fut
+
+
+def tts_playlist(text: str, voice: str, fmt: str):
+    """Chunk keys for a reply, in playback order; missing chunks start synthesizing immediately."""
+    keys = []
+    for chunk in split_for_tts(text):
+        key = tts_key(chunk, voice, fmt)
+        tts_chunk_specs.set(key, [chunk, voice, fmt])
+        if not tts_cache.path(key, f".{fmt}").exists():
+            submit_chunk(key, chunk, voice, fmt)
+        keys.append(key)
+    return keys
+
+
+def parse_chunk_name(name: str):
+    """'<key>.<format>' -> (key, format), or None for anything else."""
+    key, _, fmt = name.partition(".")
+    if fmt not in TTS_FORMATS or not re.fullmatch(r"[0-9a-f]{64}", key):
+        return None
+    return key, fmt
+
+
+def chunk_job(key: str, fmt: str):
+    """The in-flight (or restarted) job for a chunk URL, or None when the key is unknown here."""
+    with _tts_lock:
+        fut = _tts_inflight.get(key)
+    if fut is None:
+        spec = tts_chunk_specs.get(key)
+        if spec is None or spec[2] != fmt:
+            return None
+        fut = submit_chunk(key, *spec)
+    return fut
+
+
+@media_bp.post("/tts/playlist")
+def tts_playlist_route():
+    """
+    Long-form TTS: {text, voice?, format?} -> {"format", "chunks": [{"url", "etag"}, ...]}.
+    Chunks are synthesized concurrently (TTS_WORKERS) and each is cached on its own;
+    the client plays the URLs in order, and a chunk URL waits for its synthesis if needed.
+    """
+    try:
+        data = request.get_json(force=True) or {}
+        text, voice, fmt = tts_params(data)
+        if not text:
+            return Response(status=204)
+        keys = tts_playlist(text, voice, fmt)
+        return jsonify({
+            "format": fmt,
+            "chunks": [
+                {"url": url_for(".tts_chunk", name=f"{k}.{fmt}"), "etag": f'"{k}"'} for k in keys
+            ],
+        })
+    except Exception as e:
+        print("TTS playlist error:", repr(e))
+        return error_json("Malformed request for TTS.", code="bad_request", status=400)
+
+
+@media_bp.get("/tts/chunk/<name>")
+def tts_chunk(name):
+    parsed = parse_chunk_name(name)
+    if parsed is None:
+        return error_json("Unknown audio chunk.", code="not_found", status=404)
+    key, fmt = parsed
+    if request.if_none_match.contains(key):
+        return Response(status=304, headers=tts_headers(key))
+
+    path = tts_cache.get(key, f".{fmt}")
+    if path is None:
+        fut = chunk_job(key, fmt)
+        if fut is None:
+            return error_json("Unknown audio chunk.", code="not_found", status=404)
+        try:
+            path = fut.result()
+        except MediaError as e:
+            return error_json(e.message, code=e.code, status=e.status)
+
+    r = send_file(path, mimetype=TTS_FORMATS[fmt], conditional=False, etag=False, max_age=None)
+    r.headers.update(tts_headers(key))
+    return r
+
+
 # ===================== STT =====================
 # limits and accepted types
 MAX_AUDIO_BYTES = 25 * 1024 * 1024  # 25 MB
+MIN_AUDIO_BYTES = 5000               # undecodable uploads smaller than this are treated as silence
+_UPLOAD_CHUNK = 64 * 1024
 ALLOWED_AUDIO_MIME = {
     "audio/webm", 
     "audio/ogg",
@@ -83,6 +405,21 @@ ALLOWED_AUDIO_MIME = {
     "audio/mp4",
     "audio/wav",
 }
+# aliases browsers / OSes send for the same containers
+_AUDIO_MIME_ALIASES = {
+    "video/webm": "audio/webm",
+    "audio/opus": "audio/ogg",
+    "application/ogg": "audio/ogg",
+    "audio/mp3": "audio/mpeg",
+    "video/mp4": "audio/mp4",
+    "audio/x-m4a": "audio/mp4",
+    "audio/m4a": "audio/mp4",
+    "audio/x-wav": "audio/wav",
+    "audio/wave": "audio/wav",
+    "audio/vnd.wave": "audio/wav",
+}
+_AUDIO_SUFFIX_MIME = {".webm": "audio/webm", ".ogg": "audio/ogg", ".oga": "audio/ogg", ".mp3": "audio/mpeg",
+                      ".m4a": "audio/mp4", ".mp4": "audio/mp4", ".wav": "audio/wav"}
 
 def _suffix_for_mime(m: str) -> str:
     m = (m or "").lower()
@@ -98,53 +435,113 @@ def _suffix_for_mime(m: str) -> str:
         return ".wav"
     return ".bin"
 
+
+def upload_mime(f) -> str:
+    """Canonical audio MIME for an upload (codec parameters dropped, aliases folded)."""
+    mime = (f.mimetype or "").lower()
+    mime = _AUDIO_MIME_ALIASES.get(mime, mime)
+    if mime in ("", "application/octet-stream"):
+        mime = _AUDIO_SUFFIX_MIME.get(Path(f.filename or "").suffix.lower(), "audio/webm")
+    if mime not in ALLOWED_AUDIO_MIME:
+        raise MediaError(f"Unsupported audio type: {mime}.", code="unsupported_media", status=415)
+    return mime
+
+
+def read_upload(f, limit: int = 0) -> bytes:
+    """Read an upload into memory in chunks, refusing anything over `limit` (default MAX_AUDIO_BYTES)."""
+    limit = limit or MAX_AUDIO_BYTES
+    buf = io.BytesIO()
+    while True:
+        chunk = f.stream.read(_UPLOAD_CHUNK)
+        if not chunk:
+            return buf.getvalue()
+        if buf.tell() + len(chunk) > limit:
+            raise MediaError("Audio file too large.", code="too_large", status=413)
+        buf.write(chunk)
+
+
+_stt_counts = Counter()
+_stt_lock = threading.Lock()
+
+
+def stt_stats() -> dict:
+    with _stt_lock:
+        c = dict(_stt_counts)
+    return {
+        "clips": c.get("clips", 0),
+        "silent_skipped": c.get("silent", 0),
+        "preprocessed": c.get("preprocessed", 0),
+        "bytes_in": c.get("bytes_in", 0),
+        "bytes_out": c.get("bytes_out", 0),
+        "bytes_saved": c.get("bytes_in", 0) - c.get("bytes_out", 0),
+    }
+
+
+def prepare_upload(data: bytes, mime: str) -> audio.Prepared:
+    """
+    Silence check plus (when STT_PREPROCESS is on) downmix/resample/trim/re-encode.
+    Undecodable clips are forwarded unchanged and judged silent by the size guard.
+    """
+    if STT_PREPROCESS:
+        prep = audio.preprocess(data, mime, threshold_dbfs=STT_SILENCE_DBFS, min_speech_ms=STT_MIN_SPEECH_MS,
+                                rate=STT_SAMPLE_RATE, pad_ms=STT_TRIM_PAD_MS)
+    else:
+        silent = audio.is_silent(data, mime, threshold_dbfs=STT_SILENCE_DBFS, min_speech_ms=STT_MIN_SPEECH_MS)
+        prep = audio.Prepared(data, mime, silent, 0)
+    if prep.silent is None:
+        prep = prep._replace(silent=len(data) < MIN_AUDIO_BYTES)
+
+    with _stt_lock:
+        _stt_counts["clips"] += 1
+        if prep.silent:
+            _stt_counts["silent"] += 1
+        else:
+            _stt_counts["bytes_in"] += len(data)
+            _stt_counts["bytes_out"] += len(prep.data)
+            if prep.saved_bytes:
+                _stt_counts["preprocessed"] += 1
+    return prep
+
+
+def stt_error(e: MediaError):
+    return jsonify({"text": "", **error_payload(e.message, code=e.code)}), e.status
+
+
 @media_bp.post("/stt")
 def stt():
     """
     Speech-to-Text:
-      - receives multipart/form-data with 'audio' (webm)
+      - receives multipart/form-data with 'audio' (webm, ogg, mp3, m4a or wav)
+      - buffers it in memory (nothing is written to disk)
+      - skips the upstream call when the clip is silent
+      - downmixes, resamples to 16 kHz, trims silence and re-encodes when that is smaller
       - transcribes with gpt-4o-transcribe (fallback whisper-1)
-      - returns {"text": "..."} or {"text": ""} when silent/too small
+      - returns {"text": "..."} or {"text": ""} when silent
     """
     try:
         f = request.files.get("audio")
         if not f:
             return jsonify({"text": ""}), 400
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as tmp:
-            temp_path = tmp.name
-            f.save(temp_path)
+        mime = upload_mime(f)
+        data = read_upload(f)
 
+        # === guard against silence/very short audio, then shrink what is sent upstream ===
+        prep = prepare_upload(data, mime)
+        if prep.silent:
+            return jsonify({"text": ""})
+
+        upload = (f"speech{_suffix_for_mime(prep.mime)}", prep.data, prep.mime)
         try:
-            # === guard against silence/very short audio ===
-            try:
-                if os.path.getsize(temp_path) < 5000:  
-                    return jsonify({"text": ""})
-            except Exception:
-                pass
-
-            with open(temp_path, "rb") as audio_file:
-                try:
-                    resp = client.audio.transcriptions.create(
-                        model="gpt-4o-transcribe",
-                        file=audio_file
-                    )
-                except Exception:
-                    audio_file.seek(0)
-                    resp = client.audio.transcriptions.create(
-                        model="whisper-1",
-                        file=audio_file
-                    )
-
-            text = getattr(resp, "text", "") or ""
-            return jsonify({"text": text})
-
-        finally:
-            try:
-                os.remove(temp_path)
-            except OSError:
-                pass
+            resp = client.audio.transcriptions.create(model="gpt-4o-transcribe", file=upload)
+        except Exception:
+            resp = client.audio.transcriptions.create(model="whisper-1", file=upload)
 
+        text = getattr(resp, "text", "") or ""
+        return jsonify({"text": text})
+
+    except MediaError as e:
+        return stt_error(e)
     except Exception as e:
         print("STT error:", repr(e))
         return jsonify({"text": ""}), 500
@@ -158,51 +555,343 @@ except Exception:
     GEN_DIR = Path("static") / "gen"
 GEN_DIR.mkdir(parents=True, exist_ok=True)
 
+IMAGE_SIZES = {"1024x1024", "1024x1536", "1536x1024", "auto"}
+IMAGE_QUALITIES = {"low", "medium", "high", "auto"}
+
+# content-addressed: <sha256(model, prompt, size, quality)>.png, LRU-evicted under the quota
+image_cache = FileCache(GEN_DIR, max_bytes=IMG_CACHE_MAX_BYTES, max_files=IMG_CACHE_MAX_FILES, pattern="*.png")
+
+
+def image_params(data: dict):
+    """Validated (prompt, size, quality) from a request payload."""
+    prompt  = (data.get("prompt")  or "").strip()
+    size    = (data.get("size")    or IMG_DEFAULT_SIZE).strip()
+    quality = (data.get("quality") or IMG_DEFAULT_QUALITY).strip()
+
+    if not prompt:
+        raise MediaError("Empty prompt.", code="bad_request", status=400)
+
+    if size not in IMAGE_SIZES:
+        size = "1024x1024"
+    if quality not in IMAGE_QUALITIES:
+        quality = "low"
+    return prompt, size, quality
+
+
+def image_key(prompt: str, size: str, quality: str) -> str:
+    """Case and whitespace differences in the prompt map to the same image."""
+    return make_key("image", IMG_MODEL, " ".join(prompt.split()).casefold(), size, quality)
+
+
+def image_url(path: Path) -> str:
+    return f"/static/gen/{path.name}"
+
+
+def cached_image_url(key: str):
+    """URL of an already generated image (marked as recently used), or None."""
+    path = image_cache.get(key, ".png")
+    return image_url(path) if path is not None else None
+
+
+# ---- WebP derivatives (<key>-<width>.webp), encoded on a background thread ----
+derivative_cache = FileCache(GEN_DIR, max_bytes=IMG_DERIVATIVE_MAX_BYTES, pattern="*.webp")
+_derivative_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="imgderiv")
+_derivative_jobs = {}  # image key -> Future
+_derivative_lock = threading.Lock()
+
+
+def _write_derivatives(key: str, data: bytes) -> None:
+    renditions = imaging.webp_derivatives(data, IMG_DERIVATIVE_WIDTHS, quality=IMG_WEBP_QUALITY)
+    for width, webp in renditions.items():
+        derivative_cache.put(f"{key}-{width}", ".webp", webp)
+
+
+def schedule_derivatives(key: str, data: bytes = b""):
+    """Encode the WebP renditions off the request thread; returns the job's Future (None without Pillow)."""
+    if not imaging.available() or not IMG_DERIVATIVE_WIDTHS:
+        return None
+    with _derivative_lock:
+        fut = _derivative_jobs.get(key)
+        if fut is not None and not fut.done():
+            return fut
+        if not data:
+            try:
+                data = image_cache.path(key, ".png").read_bytes()
+            except OSError:
+                return None
+        fut = _derivative_pool.submit(_write_derivatives, key, data)
+        _derivative_jobs[key] = fut
+    fut.add_done_callback(lambda f: _forget_derivatives(key, f))
+    return fut
+
+
+def _forget_derivatives(key: str, fut) -> None:
+    with _derivative_lock:
+        if _derivative_jobs.get(key) is fut:
+            del _derivative_jobs[key]
+
+
+def derivatives_pending(key: str) -> bool:
+    with _derivative_lock:
+        return key in _derivative_jobs
+
+
+def wait_derivatives(key: str, timeout: float = 30.0) -> None:
+    with _derivative_lock:
+        fut = _derivative_jobs.get(key)
+    if fut is not None:
+        wait_futures([fut], timeout=timeout)
+
+
+def image_manifest(key: str) -> dict:
+    """
+    {url, width, variants: [{url, width, type}], srcset} for a stored image.
+    Renditions missing on disk (evicted, or made before Pillow was installed) are re-queued.
+    """
+    png = image_cache.path(key, ".png")
+    manifest = {"url": image_url(png), "width": None, "variants": [], "srcset": ""}
+    if not imaging.available():
+        return manifest
+    try:
+        with open(png, "rb") as fh:
+            manifest["width"] = imaging.image_width(fh.read())
+    except OSError:
+        return manifest
+
+    missing = False
+    for width in sorted(IMG_DERIVATIVE_WIDTHS):
+        if manifest["width"] and width >= manifest["width"]:
+            continue
+        path = derivative_cache.get(f"{key}-{width}", ".webp")
+        if path is None:
+            missing = True
+            continue
+        manifest["variants"].append({"url": image_url(path), "width": width, "type": "image/webp"})
+    if missing:
+        schedule_derivatives(key)
+
+    if manifest["width"]:
+        entries = [f"{v['url']} {v['width']}w" for v in manifest["variants"]]
+        entries.append(f"{manifest['url']} {manifest['width']}w")
+        manifest["srcset"] = ", ".join(entries)
+    return manifest
+
+
+def save_generated_image(resp, key: str = "") -> str:
+    """
+    Decode the first image of an images.generate response into the image cache; returns its URL.
+    WebP renditions are queued in the background.
+    """
+    if not getattr(resp, "data", None):
+        raise MediaError("Empty image response.", code="upstream_error", status=502)
+
+    b64 = getattr(resp.data[0], "b64_json", None)
+    if not b64:
+        raise MediaError("No image payload.", code="upstream_error", status=502)
+
+    try:
+        img_bytes = base64.b64decode(b64)
+    except Exception:
+        raise MediaError("Invalid image payload.", code="upstream_error", status=502)
+
+    key = key or uuid.uuid4().hex
+    path = image_cache.put(key, ".png", img_bytes)
+    schedule_derivatives(key, img_bytes)
+    return image_url(path)
+
+
+def generate_image_file(prompt: str, size: str, quality: str, key: str) -> str:
+    """Upstream generation stored under `key`; returns the URL or raises MediaError."""
+    try:
+        resp = client.images.generate(
+            model=IMG_MODEL,
+            prompt=prompt,
+            size=size,
+            quality=quality,
+        )
+    except Exception as e:
+        print("OpenAI image error:", repr(e))
+        raise MediaError("Image API failed.", code="upstream_error", status=502)
+    return save_generated_image(resp, key)
+
+
 @media_bp.post("/image")
 def generate_image():
-    """Image generation (gpt-image-1) -> {'url': '/static/gen/<file>.png'}."""
+    """
+    Image generation (IMG_MODEL) -> {'url': '/static/gen/<key>.png', 'cached': bool, 'srcset', ...}.
+    The same (prompt, size, quality) returns the stored file without an upstream call.
+    WebP renditions are encoded in the background, so a fresh image may list none yet;
+    image jobs pick them up on later polls.
+    """
     try:
         data = request.get_json(force=True) or {}
-        prompt  = (data.get("prompt")  or "").strip()
-        size    = (data.get("size")    or "1024x1024").strip()
-        quality = (data.get("quality") or "low").strip()
+        prompt, size, quality = image_params(data)
 
-        if not prompt:
-            return error_json("Empty prompt.", code="bad_request", status=400)
+        key = image_key(prompt, size, quality)
+        if cached_image_url(key):
+            return jsonify({**image_manifest(key), "cached": True})
 
-        if size not in {"1024x1024", "1024x1536", "1536x1024", "auto"}:
-            size = "1024x1024"
-        if quality not in {"low", "medium", "high", "auto"}:
-            quality = "low"
+        generate_image_file(prompt, size, quality, key)
+        return jsonify({**image_manifest(key), "cached": False})
 
-        try:
-            resp = client.images.generate(
-                model="gpt-image-1",
-                prompt=prompt,
-                size=size,
-                quality=quality,
-            )
-        except Exception as e:
-            print("OpenAI image error:", repr(e))
-            return error_json("Image API failed.", code="upstream_error", status=502)
-
-        if not getattr(resp, "data", None):
-            return error_json("Empty image response.", code="upstream_error", status=502)
-
-        b64 = getattr(resp.data[0], "b64_json", None)
-        if not b64:
-            return error_json("No image payload.", code="upstream_error", status=502)
+    except MediaError as e:
+        return error_json(e.message, code=e.code, status=e.status)
+    except Exception as e:
+        print("IMAGE error:", repr(e))
+        return error_json("Image generation failed.", code="server_error", status=500)
 
-        try:
-            img_bytes = base64.b64decode(b64)
-        except Exception:
-            return error_json("Invalid image payload.", code="upstream_error", status=502)
 
-        fname = f"{uuid.uuid4().hex}.png"
-        (GEN_DIR / fname).write_bytes(img_bytes)
+@media_bp.get("/image/usage")
+def image_usage():
+    """Generated-image storage: file count, bytes, quotas and hit/miss counters."""
+    return jsonify(image_cache.usage())
+
+
+# ---- image jobs: submit now, poll for the result ----
+MAX_JOBS_PER_REQUEST = 16
+MAX_JOB_WAIT = 30.0  # seconds a poll may block waiting for completion (ASGI; see IMG_JOB_MAX_WAIT_WSGI)
+
+_image_pool = ThreadPoolExecutor(max_workers=IMG_WORKERS, thread_name_prefix="image")
+_image_jobs = {}  # job id (= image key) -> job dict
+_image_jobs_lock = threading.Lock()
+
 
-        return jsonify({"url": f"/static/gen/{fname}"})
+def _refresh_manifest(job: dict) -> None:
+    """Re-read a done job's manifest; it stays 'derivatives_pending' until its renditions are encoded."""
+    pending = derivatives_pending(job["id"])
+    job.update(image_manifest(job["id"]))
+    job["derivatives_pending"] = pending or derivatives_pending(job["id"])
 
+
+def job_view(job: dict) -> dict:
+    if job["status"] == "done" and job.get("derivatives_pending"):
+        _refresh_manifest(job)
+    view = {"id": job["id"], "status": job["status"]}
+    for field in ("url", "width", "srcset", "variants", "cached", "error"):
+        if job.get(field) is not None:
+            view[field] = job[field]
+    return view
+
+
+def _run_image_job(job: dict, prompt: str, size: str, quality: str) -> None:
+    job["status"] = "running"
+    try:
+        generate_image_file(prompt, size, quality, job["id"])
+        _refresh_manifest(job)  # renditions may still be encoding; job_view picks them up later
+        job["status"] = "done"
+    except MediaError as e:
+        job["error"] = e.message
+        job["status"] = "error"
     except Exception as e:
-        print("IMAGE error:", repr(e))
-        return error_json("Image generation failed.", code="server_error", status=500)
+        print("IMAGE job error:", repr(e))
+        job["error"] = "Image generation failed."
+        job["status"] = "error"
+    finally:
+        job["finished"] = time.time()
+
+
+def _expire_jobs(now: float) -> None:
+    stale = [k for k, j in _image_jobs.items() if j.get("finished") and now - j["finished"] > IMG_JOB_TTL]
+    for k in stale:
+        del _image_jobs[k]
+
+
+def submit_image_job(prompt: str, size: str, quality: str) -> dict:
+    """
+    Queue one generation on the bounded image pool. The job id is the image key, so
+    identical requests share a job and cached images come back already 'done'.
+    """
+    key = image_key(prompt, size, quality)
+    now = time.time()
+    with _image_jobs_lock:
+        _expire_jobs(now)
+        job = _image_jobs.get(key)
+        if job is not None and job["status"] != "error":
+            return job
+        if cached_image_url(key):
+            job = {"id": key, "status": "done", "cached": True, "finished": now, "future": None}
+            _refresh_manifest(job)
+        else:
+            job = {"id": key, "status": "queued", "cached": False, "future": None}
+            job["future"] = _image_pool.submit(_run_image_job, job, prompt, size, quality)
+        _image_jobs[key] = job
+        return job
+
+
+def image_job_requests(data: dict):
+    """(prompt, size, quality) triples from {prompt, ...} or {prompts: [str | {prompt, ...}]}."""
+    items = data.get("prompts")
+    if items is None:
+        items = [data]
+    if not isinstance(items, list) or not items:
+        raise MediaError("Expected 'prompt' or a non-empty 'prompts' list.", code="bad_request", status=400)
+    if len(items) > MAX_JOBS_PER_REQUEST:
+        raise MediaError(f"At most {MAX_JOBS_PER_REQUEST} prompts per request.", code="bad_request", status=400)
+    defaults = {"size": data.get("size"), "quality": data.get("quality")}
+    return [image_params({**defaults, "prompt": it} if isinstance(it, str) else {**defaults, **it}) for it in items]
+
+
+def find_image_jobs(ids):
+    with _image_jobs_lock:
+        return [_image_jobs.get(i) for i in ids]
+
+
+def job_ids_arg(arg: str):
+    return [i for i in (arg or "").split(",") if i][:MAX_JOBS_PER_REQUEST]
+
+
+def wait_seconds_arg(arg, cap: float = MAX_JOB_WAIT) -> float:
+    try:
+        return max(0.0, min(float(arg or 0), cap))
+    except ValueError:
+        return 0.0
+
+
+def jobs_manifest(jobs) -> dict:
+    known = [j for j in jobs if j is not None]
+    return {
+        "jobs": [job_view(j) for j in known],
+        "pending": sum(j["status"] in ("queued", "running") for j in known),
+        "unknown": len(jobs) - len(known),
+    }
+
+
+@media_bp.post("/image/jobs")
+def create_image_jobs():
+    """
+    Queue image generations without holding the request:
+    {prompt, size?, quality?} or {prompts: [...], size?, quality?} -> 202 {"jobs": [{id, status, url?}]}.
+    """
+    try:
+        data = request.get_json(force=True) or {}
+        jobs = [submit_image_job(*params) for params in image_job_requests(data)]
+        return jsonify(jobs_manifest(jobs)), 202
+    except MediaError as e:
+        return error_json(e.message, code=e.code, status=e.status)
+
+
+@media_bp.get("/image/jobs")
+def image_jobs_manifest():
+    """
+    Status manifest for ?ids=a,b,c. With ?wait=<seconds> the call returns as soon as
+    one more listed job finishes (or the wait runs out), so clients can long-poll and
+    show each result as it lands. The wait is capped at IMG_JOB_MAX_WAIT_WSGI here, since it
+    holds a sync worker; the ASGI blueprint serves long waits.
+    """
+    jobs = find_image_jobs(job_ids_arg(request.args.get("ids")))
+    timeout = wait_seconds_arg(request.args.get("wait"), IMG_JOB_MAX_WAIT_WSGI)
+    pending = [j["future"] for j in jobs if j is not None and j.get("future") is not None and not j["future"].done()]
+    if timeout and pending:
+        wait_futures(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+    return jsonify(jobs_manifest(jobs))
+
+
+@media_bp.get("/image/jobs/<job_id>")
+def image_job(job_id):
+    job = find_image_jobs([job_id])[0]
+    if job is None:
+        return error_json("Unknown image job.", code="not_found", status=404)
+    timeout = wait_seconds_arg(request.args.get("wait"), IMG_JOB_MAX_WAIT_WSGI)
+    if timeout and job.get("future") is not None:
+        wait_futures([job["future"]], timeout=timeout)
+    return jsonify(job_view(job))
@@ -0,0 +1,280 @@
+"""Async twins of the media routes for the ASGI serving mode (see asgi.py)."""
+
+import asyncio
+
+from quart import Blueprint, request, jsonify, Response, send_file, url_for
+
+import config
+import routes_media
+from config import IMG_MODEL, TTS_MODEL, TTS_CACHE_MAX_ITEM_BYTES, TTS_STREAM_CHUNK
+from routes_media import (
+    CappedBuffer,
+    MediaError,
+    TTS_FORMATS,
+    TTS_STREAM_HEADERS,
+    _suffix_for_mime,
+    cached_image_url,
+    chunk_job,
+    error_payload,
+    find_image_jobs,
+    image_job_requests,
+    image_key,
+    image_manifest,
+    image_params,
+    job_ids_arg,
+    job_view,
+    jobs_manifest,
+    parse_chunk_name,
+    prepare_upload,
+    read_upload,
+    save_generated_image,
+    stt_error,
+    submit_image_job,
+    tts_headers,
+    tts_key,
+    tts_params,
+    tts_playlist,
+    upload_mime,
+    wait_seconds_arg,
+)
+
+media_async_bp = Blueprint("media_async", __name__)
+
+
+def error_json(message, *, code="bad_request", status=400, hint=None):
+    return jsonify(error_payload(message, code=code, hint=hint)), status
+
+
+# ===================== TTS =====================
+async def _open_speech_stream(text: str, voice: str, fmt: str):
+    """Async twin of routes_media._open_speech_stream."""
+    try:
+        cm = config.aclient.audio.speech.with_streaming_response.create(
+            model=TTS_MODEL,
+            voice=voice,
+            input=text,
+            response_format=fmt,
+        )
+        return cm, await cm.__aenter__()
+    except Exception as e:
+        print("TTS stream error:", repr(e))
+        return None
+
+
+async def _passthrough(cm, resp, key: str, fmt: str):
+    """Async twin of routes_media._passthrough."""
+    buf = CappedBuffer(TTS_CACHE_MAX_ITEM_BYTES)
+    completed = False
+    try:
+        async for chunk in resp.iter_bytes(TTS_STREAM_CHUNK):
+            if chunk:
+                buf.add(chunk)
+                yield chunk
+        completed = True
+    except Exception as e:
+        print("TTS stream interrupted:", repr(e))
+        raise
+    finally:
+        try:
+            await cm.__aexit__(None, None, None)
+        except Exception:
+            pass
+    if completed and not buf.overflow and buf.size:
+        try:
+            await asyncio.to_thread(routes_media.tts_cache.put, key, f".{fmt}", buf.getvalue())
+        except OSError as e:
+            print("TTS cache write failed:", repr(e))
+
+
+@media_async_bp.post("/tts")
+async def tts():
+    """Async twin of routes_media.tts (same disk cache, ETag handling and streamed misses)."""
+    try:
+        data = await request.get_json(force=True) or {}
+        text, voice, fmt = tts_params(data)
+        if not text:
+            return Response(status=204)
+
+        key = tts_key(text, voice, fmt)
+        if request.if_none_match.contains(key):
+            return Response(status=304, headers=tts_headers(key))
+
+        path = routes_media.tts_cache.get(key, f".{fmt}")
+        if path is None:
+            opened = await _open_speech_stream(text, voice, fmt)
+            if opened is not None:
+                r = Response(_passthrough(*opened, key, fmt), mimetype=TTS_FORMATS[fmt])
+                r.headers.update(TTS_STREAM_HEADERS)
+                return r
+            try:
+                audio = await config.aclient.audio.speech.create(
+                    model=TTS_MODEL,
+                    voice=voice,
+                    input=text,
+                    response_format=fmt,
+                )
+                payload = getattr(audio, "content", None)
+            except Exception as e:
+                print("TTS error:", repr(e))
+                return error_json("TTS service failed.", code="upstream_error", status=502)
+            if not payload:
+                return error_json("TTS returned empty audio.", code="upstream_error", status=502)
+            path = await asyncio.to_thread(routes_media.tts_cache.put, key, f".{fmt}", payload)
+
+        r = await send_file(path, mimetype=TTS_FORMATS[fmt])
+        r.headers.update(tts_headers(key))
+        return r
+
+    except Exception as e:
+        print("TTS error:", repr(e))
+        return error_json("Malformed request for TTS.", code="bad_request", status=400)
+
+
+@media_async_bp.post("/tts/playlist")
+async def tts_playlist_route():
+    """Async twin of routes_media.tts_playlist_route (same TTS pool and chunk cache)."""
+    try:
+        data = await request.get_json(force=True) or {}
+        text, voice, fmt = tts_params(data)
+        if not text:
+            return Response(status=204)
+        keys = tts_playlist(text, voice, fmt)
+        return jsonify({
+            "format": fmt,
+            "chunks": [
+                {"url": url_for(".tts_chunk", name=f"{k}.{fmt}"), "etag": f'"{k}"'} for k in keys
+            ],
+        })
+    except Exception as e:
+        print("TTS playlist error:", repr(e))
+        return error_json("Malformed request for TTS.", code="bad_request", status=400)
+
+
+@media_async_bp.get("/tts/chunk/<name>")
+async def tts_chunk(name):
+    parsed = parse_chunk_name(name)
+    if parsed is None:
+        return error_json("Unknown audio chunk.", code="not_found", status=404)
+    key, fmt = parsed
+    if request.if_none_match.contains(key):
+        return Response(status=304, headers=tts_headers(key))
+
+    path = routes_media.tts_cache.get(key, f".{fmt}")
+    if path is None:
+        fut = chunk_job(key, fmt)
+        if fut is None:
+            return error_json("Unknown audio chunk.", code="not_found", status=404)
+        try:
+            path = await asyncio.wrap_future(fut)
+        except MediaError as e:
+            return error_json(e.message, code=e.code, status=e.status)
+
+    r = await send_file(path, mimetype=TTS_FORMATS[fmt])
+    r.headers.update(tts_headers(key))
+    return r
+
+
+# ===================== STT =====================
+@media_async_bp.post("/stt")
+async def stt():
+    """Speech-to-Text: same contract as routes_media.stt, audio kept in memory."""
+    try:
+        files = await request.files
+        f = files.get("audio")
+        if not f:
+            return jsonify({"text": ""}), 400
+
+        mime = upload_mime(f)
+        data = read_upload(f)
+
+        # === silence guard + preprocessing (decoding is CPU work: off the loop) ===
+        prep = await asyncio.to_thread(prepare_upload, data, mime)
+        if prep.silent:
+            return jsonify({"text": ""})
+
+        upload = (f"speech{_suffix_for_mime(prep.mime)}", prep.data, prep.mime)
+        try:
+            resp = await config.aclient.audio.transcriptions.create(model="gpt-4o-transcribe", file=upload)
+        except Exception:
+            resp = await config.aclient.audio.transcriptions.create(model="whisper-1", file=upload)
+
+        text = getattr(resp, "text", "") or ""
+        return jsonify({"text": text})
+
+    except MediaError as e:
+        return stt_error(e)
+    except Exception as e:
+        print("STT error:", repr(e))
+        return jsonify({"text": ""}), 500
+
+
+# ===================== Image generation =====================
+@media_async_bp.post("/image")
+async def generate_image():
+    """Async twin of routes_media.generate_image (same image cache)."""
+    try:
+        data = await request.get_json(force=True) or {}
+        prompt, size, quality = image_params(data)
+
+        key = image_key(prompt, size, quality)
+        if cached_image_url(key):
+            return jsonify({**await asyncio.to_thread(image_manifest, key), "cached": True})
+
+        try:
+            resp = await config.aclient.images.generate(
+                model=IMG_MODEL,
+                prompt=prompt,
+                size=size,
+                quality=quality,
+            )
+        except Exception as e:
+            print("OpenAI image error:", repr(e))
+            return error_json("Image API failed.", code="upstream_error", status=502)
+
+        await asyncio.to_thread(save_generated_image, resp, key)
+        return jsonify({**await asyncio.to_thread(image_manifest, key), "cached": False})
+
+    except MediaError as e:
+        return error_json(e.message, code=e.code, status=e.status)
+    except Exception as e:
+        print("IMAGE error:", repr(e))
+        return error_json("Image generation failed.", code="server_error", status=500)
+
+
+@media_async_bp.get("/image/usage")
+async def image_usage():
+    return jsonify(routes_media.image_cache.usage())
+
+
+# ---- image jobs (same queue and pool as routes_media) ----
+async def _wait_jobs(jobs, timeout: float) -> None:
+    pending = [asyncio.wrap_future(j["future"]) for j in jobs
+               if j is not None and j.get("future") is not None and not j["future"].done()]
+    if timeout and pending:
+        await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+
+@media_async_bp.post("/image/jobs")
+async def create_image_jobs():
+    try:
+        data = await request.get_json(force=True) or {}
+        jobs = [submit_image_job(*params) for params in image_job_requests(data)]
+        return jsonify(jobs_manifest(jobs)), 202
+    except MediaError as e:
+        return error_json(e.message, code=e.code, status=e.status)
+
+
+@media_async_bp.get("/image/jobs")
+async def image_jobs_manifest():
+    jobs = find_image_jobs(job_ids_arg(request.args.get("ids")))
+    await _wait_jobs(jobs, wait_seconds_arg(request.args.get("wait")))
+    return jsonify(jobs_manifest(jobs))
+
+
+@media_async_bp.get("/image/jobs/<job_id>")
+async def image_job(job_id):
+    job = find_image_jobs([job_id])[0]
+    if job is None:
+        return error_json("Unknown image job.", code="not_found", status=404)
+    await _wait_jobs([job], wait_seconds_arg(request.args.get("wait")))
+    return jsonify(job_view(job))
@@ -0,0 +1,96 @@
+"""
+Adaptive candidate selection: how many retrieved books go into the chat prompt.
+
+Candidates arrive best-first with a cosine distance in `score` (None for books found only
+by the lexical index). The list is cut by
+  - a relative cutoff: distance <= best * (1 + rel_cutoff),
+  - an elbow: the first jump of at least `gap` between consecutive distances past min_k,
+  - min_k / max_k bounds, and
+  - a token budget for the candidate block, as prompts.encode_candidates writes it.
+Lexical-only books have no distance to cut on, so once min_k books are chosen they are
+dropped (unless nothing has a distance at all).
+"All/more" requests (or an explicit count above max_k) get a looser cutoff, no elbow and
+wide_max_k instead of max_k, so they stay bounded however large the catalog grows.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Dict, List, Optional
+
+from prompts import candidate_line, count_tokens
+from rag import normalize_text
+
+_UNBOUNDED = re.compile(
+    r"\b(all|every|everything|more|as many|toate|toti|tot|mai multe|mai mult|orice)\b"
+)
+_NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+    "nine": 9, "ten": 10, "o": 1, "una": 1, "doua": 2, "trei": 3, "patru": 4, "cinci": 5,
+    "sase": 6, "sapte": 7, "opt": 8, "noua": 9, "zece": 10,
+}
+_COUNT = re.compile(
+    r"\b(\d{1,2}|" + "|".join(_NUMBER_WORDS) + r")\s+(?:\w+\s+){0,2}?(books?|titles?|novels?|carti|titluri|romane)\b"
+)
+
+
+def candidate_tokens(cand: Dict) -> int:
+    """Prompt cost of one candidate, measured on its compact encoding."""
+    return count_tokens(candidate_line(cand)) + 1
+
+
+def requested_count(text: str) -> Optional[int]:
+    """N from 'recommend 5 books' / 'trei carti', or None."""
+    m = _COUNT.search(normalize_text(text))
+    if not m:
+        return None
+    word = m.group(1)
+    return int(word) if word.isdigit() else _NUMBER_WORDS[word]
+
+
+def wants_many(text: str) -> bool:
+    return bool(_UNBOUNDED.search(normalize_text(text)))
+
+
+def _elbow(distances: List[float], min_k: int, gap: float) -> Optional[float]:
+    """Distance just before the first jump >= gap (after the first min_k), or None."""
+    ordered = sorted(distances)
+    for i in range(max(min_k, 1), len(ordered)):
+        if ordered[i] - ordered[i - 1] >= gap:
+            return ordered[i - 1]
+    return None
+
+
+def select_candidates(candidates: List[Dict], *, min_k: int, max_k: int, wide: bool = False,
+                      wide_max_k: int = 0, rel_cutoff: float = 0.25, gap: float = 0.08,
+                      token_budget: int = 0) -> List[Dict]:
+    """Subset of `candidates` (order kept) to send to the model; never empty when candidates exist."""
+    if not candidates:
+        return []
+    limit = max(1, max(wide_max_k, max_k) if wide else max_k)
+    min_k = max(1, min(min_k, limit))
+
+    distances = [c["score"] for c in candidates if c.get("score") is not None]
+    threshold = None
+    if distances:
+        best = min(distances)
+        threshold = best * (1 + rel_cutoff * (2 if wide else 1))
+        if not wide:
+            elbow = _elbow(distances, min_k, gap)
+            if elbow is not None:
+                threshold = min(threshold, elbow)
+
+    chosen: List[Dict] = []
+    used = 0
+    for cand in candidates:
+        if len(chosen) >= limit:
+            break
+        score = cand.get("score")
+        if len(chosen) >= min_k and threshold is not None and (score is None or score > threshold):
+            continue
+        cost = candidate_tokens(cand)
+        if token_budget and chosen and used + cost > token_budget:
+            break
+        chosen.append(cand)
+        used += cost
+    return chosen
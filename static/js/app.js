@@ -34,20 +34,138 @@ function anyTTSPlaying() {
   return false;
 }
 
-async function fetchTTSBlob(text) {
-  const clean = (text || "")
+// text -> {etag, blob}: replays revalidate with If-None-Match and reuse the blob on 304
+const ttsBlobCache = new Map();
+
+function canStreamMP3() {
+  return !!(window.MediaSource && MediaSource.isTypeSupported && MediaSource.isTypeSupported('audio/mpeg'));
+}
+
+// play /api/tts while it is still streaming: chunks are appended to a MediaSource as they arrive
+function streamTTSToURL(resp, onComplete) {
+  const ms = new MediaSource();
+  const url = URL.createObjectURL(ms);
+  ms.addEventListener('sourceopen', async () => {
+    const sb = ms.addSourceBuffer('audio/mpeg');
+    const reader = resp.body.getReader();
+    const parts = [];
+    const append = (chunk) => new Promise((resolve, reject) => {
+      sb.addEventListener('updateend', resolve, { once: true });
+      sb.addEventListener('error', reject, { once: true });
+      sb.appendBuffer(chunk);
+    });
+    try {
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        parts.push(value);
+        await append(value);
+      }
+      if (ms.readyState === 'open') ms.endOfStream();
+      onComplete(new Blob(parts, { type: 'audio/mpeg' }));
+    } catch (e) {
+      try { if (ms.readyState === 'open') ms.endOfStream('decode'); } catch (_) {}
+    }
+  }, { once: true });
+  return url;
+}
+
+// object URL for the reply's audio (streamed when the browser supports it), or null
+function cleanTTSText(text) {
+  return (text || "")
     .replace(/\*\*/g, "")
     .replace(/`+/g, "")
     .replace(/_/g, "");
+}
+
+async function fetchTTSSource(text) {
+  const clean = cleanTTSText(text);
   if (!clean.trim()) return null;
 
+  const known = ttsBlobCache.get(clean);
+  const headers = { 'Content-Type': 'application/json' };
+  if (known && known.etag) headers['If-None-Match'] = known.etag;
+
   const resp = await fetch('/api/tts', {
+    method: 'POST',
+    headers,
+    body: JSON.stringify({ text: clean })
+  });
+  if (resp.status === 304 && known) return URL.createObjectURL(known.blob);
+  if (!resp.ok) return null;
+
+  const etag = resp.headers.get('ETag');
+  const type = resp.headers.get('Content-Type') || '';
+  if (resp.body && type.startsWith('audio/mpeg') && canStreamMP3()) {
+    return streamTTSToURL(resp, (blob) => ttsBlobCache.set(clean, { etag, blob }));
+  }
+
+  const blob = await resp.blob();
+  ttsBlobCache.set(clean, { etag, blob });
+  return URL.createObjectURL(blob);
+}
+
+// replies longer than this are spoken as a playlist of line chunks (first audio arrives sooner)
+const TTS_PLAYLIST_MIN_CHARS = 600;
+
+// plays chunk URLs back to back, preloading the next one; mimics the bits of <audio> attachTTS uses
+class TTSPlaylist extends EventTarget {
+  constructor(urls) {
+    super();
+    this.urls = urls;
+    this.index = 0;
+    this.ended = false;
+    this.current = this._make(0);
+    this.next = this._make(1);
+  }
+  _make(i) {
+    if (i >= this.urls.length) return null;
+    const a = new Audio(this.urls[i]);
+    a.preload = 'auto';
+    a.addEventListener('play', () => this.dispatchEvent(new Event('play')));
+    a.addEventListener('pause', () => { if (!a.ended) this.dispatchEvent(new Event('pause')); });
+    a.addEventListener('ended', () => this._advance());
+    a.addEventListener('error', () => this.dispatchEvent(new Event('error')));
+    return a;
+  }
+  _advance() {
+    this.index += 1;
+    this.current = this.next;
+    if (!this.current) {
+      this.ended = true;
+      this.dispatchEvent(new Event('ended'));
+      return;
+    }
+    this.next = this._make(this.index + 1);
+    this.current.play().catch(() => {});
+  }
+  get currentTime() { return this.current ? this.current.currentTime : 0; }
+  set currentTime(t) { if (this.current) this.current.currentTime = t; }
+  play() { return this.current ? this.current.play() : Promise.resolve(); }
+  pause() { if (this.current) this.current.pause(); }
+}
+
+async function fetchTTSPlaylist(text) {
+  const clean = cleanTTSText(text);
+  const resp = await fetch('/api/tts/playlist', {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
     body: JSON.stringify({ text: clean })
   });
   if (!resp.ok) return null;
-  return await resp.blob();
+  const data = await resp.json().catch(() => null);
+  const urls = ((data && data.chunks) || []).map(c => c.url);
+  return urls.length ? new TTSPlaylist(urls) : null;
+}
+
+// {audio, url} for a reply: a chunk playlist for long text, otherwise a single (streamed) source
+async function createTTSPlayer(text) {
+  if (cleanTTSText(text).trim().length > TTS_PLAYLIST_MIN_CHARS) {
+    const playlist = await fetchTTSPlaylist(text);
+    if (playlist) return { audio: playlist, url: null };
+  }
+  const url = await fetchTTSSource(text);
+  return url ? { audio: new Audio(url), url } : null;
 }
 
 function stopAllOtherPlayers(exceptBtn) {
@@ -84,15 +202,14 @@ function attachTTS(btn, text) {
     btn.disabled = true;
     btn.textContent = '…';
 
-    const blob = await fetchTTSBlob(text);
-    if (!blob) {
+    const player = await createTTSPlayer(text);
+    if (!player) {
       btn.textContent = '🔊';
       btn.disabled = false;
       return;
     }
 
-    const url = URL.createObjectURL(blob);
-    const audio = new Audio(url);
+    const { audio, url } = player;
 
     audio.addEventListener('play', () => {
       btn.textContent = '⏸';
@@ -115,7 +232,7 @@ function attachTTS(btn, text) {
       btn.textContent = '🔊';
       const it = ttsPlayers.get(btn);
       if (it) it.state = 'ended';
-      try { URL.revokeObjectURL(url); } catch (e) {}
+      try { if (url) URL.revokeObjectURL(url); } catch (e) {}
       ttsPlayers.delete(btn);
     });
 
@@ -123,7 +240,7 @@ function attachTTS(btn, text) {
       btn.textContent = '🔊';
       const it = ttsPlayers.get(btn);
       if (it) it.state = 'idle';
-      try { URL.revokeObjectURL(url); } catch (e) {}
+      try { if (url) URL.revokeObjectURL(url); } catch (e) {}
       ttsPlayers.delete(btn);
     });
 
@@ -340,29 +457,82 @@ function getOrCreateCoverImg(messageEl, title) {
   img.setAttribute("data-title-norm", wanted);
   img.alt = "Generated cover";
   img.style.cursor = "pointer";
-  img.addEventListener("click", () => img.classList.toggle("full"));
+  img.addEventListener("click", () => {
+    img.classList.toggle("full");
+    img.sizes = coverSizes(img);
+  });
   card.appendChild(img);
   return img;
 }
 
-async function fetchImageURL(prompt, size = "1024x1024", quality = "low") {
-  const r = await fetch("/api/image", {
+// queue image jobs and long-poll the manifest; onDone(job, index) fires as each one finishes.
+// resolves to the final job objects ({url, srcset, ...} when done), in prompt order
+async function runImageJobs(prompts, { size = "1024x1024", quality = "low", onDone } = {}) {
+  const r = await fetch("/api/image/jobs", {
     method: "POST",
     headers: {"Content-Type": "application/json"},
-    body: JSON.stringify({ prompt, size, quality })
+    body: JSON.stringify({ prompts, size, quality })
   });
-  if (!r.ok) return null;
-  const j = await r.json().catch(() => ({}));
-  return j && j.url ? j.url : null;
+  if (!r.ok) return [];
+  let manifest = await r.json().catch(() => null);
+  if (!manifest || !manifest.jobs) return [];
+
+  const ids = manifest.jobs.map(j => j.id);
+  const reported = new Set();
+  const report = (jobs) => jobs.forEach(j => {
+    if ((j.status === "done" || j.status === "error") && !reported.has(j.id)) {
+      reported.add(j.id);
+      if (onDone) ids.forEach((id, i) => { if (id === j.id) onDone(j, i); });
+    }
+  });
+  report(manifest.jobs);
+
+  while (manifest.pending > 0) {
+    const p = await fetch(`/api/image/jobs?ids=${encodeURIComponent(ids.join(","))}&wait=20`);
+    if (!p.ok) break;
+    const next = await p.json().catch(() => null);
+    if (!next || !next.jobs) break;
+    manifest = next;
+    report(manifest.jobs);
+  }
+  const byId = new Map(manifest.jobs.map(j => [j.id, j]));
+  return ids.map(id => byId.get(id) || null);
 }
 
-// generate (or update) a cover for a specific title in this message
-async function generateOrUpdateCoverForTitle({ messageEl, title, imagePrompt }) {
-  const url = await fetchImageURL(imagePrompt);
-  if (url) {
-    const img = getOrCreateCoverImg(messageEl, title);
-    img.src = url + "?t=" + Date.now(); 
+function coverPrompt(title) {
+  return `Design a simple, minimalist book cover for "${title}". ` +
+         `Use a clean layout, readable title, and one symbolic illustration.`;
+}
+
+// rendered width of .gen-img / .gen-img.full (see style.css)
+function coverSizes(img) {
+  return img.classList.contains("full") ? "640px" : "240px";
+}
+
+// inline covers are small: the browser picks a WebP rendition from srcset when one exists
+function showCover(messageEl, title, job) {
+  const img = getOrCreateCoverImg(messageEl, title);
+  if (job.srcset) {
+    img.sizes = coverSizes(img);
+    img.srcset = job.srcset;
+  } else {
+    img.removeAttribute("srcset");
   }
+  if (img.getAttribute("src") !== job.url) img.src = job.url;
+}
+
+// generate (or update) a cover for a specific title in this message;
+// URLs are content-addressed, so a repeat prompt returns the stored image (and the browser's copy)
+async function generateOrUpdateCoverForTitle({ messageEl, title, imagePrompt }) {
+  const [job] = await runImageJobs([imagePrompt]);
+  if (job && job.url) showCover(messageEl, title, job);
+}
+
+// one request for every title in the reply; covers appear as their jobs finish
+async function generateCoversForTitles(messageEl, titles) {
+  await runImageJobs(titles.map(coverPrompt), {
+    onDone: (job, i) => { if (job.url) showCover(messageEl, titles[i], job); }
+  });
 }
 
 /* ===================== Extract titles from markdown ===================== */
@@ -455,14 +625,10 @@ function addImageButtonsForTitles(messageEl, replyMarkdown) {
       btn.disabled = true;
       btn.innerHTML = '…';
       try {
-        const promptText =
-          `Design a simple, minimalist book cover for "${title}". ` +
-          `Use a clean layout, readable title, and one symbolic illustration.`;
-
         await generateOrUpdateCoverForTitle({
         messageEl,
         title,
-        imagePrompt: promptText
+        imagePrompt: coverPrompt(title)
         });
       } finally {
         btn.disabled = false;
@@ -473,6 +639,26 @@ function addImageButtonsForTitles(messageEl, replyMarkdown) {
     box.appendChild(btn);
   });
 
+  if (titles.length > 1) {
+    const all = document.createElement('button');
+    all.type = 'button';
+    all.className = 'btn btn-sm btn-outline-secondary icon-btn';
+    all.title = 'Generate covers for every title';
+    all.innerHTML = '🖼️ <span>All covers</span>';
+    all.onclick = async () => {
+      const old = all.innerHTML;
+      all.disabled = true;
+      all.innerHTML = '…';
+      try {
+        await generateCoversForTitles(messageEl, titles);
+      } finally {
+        all.disabled = false;
+        all.innerHTML = old;
+      }
+    };
+    box.appendChild(all);
+  }
+
   messageEl.appendChild(box);
 }
 
@@ -494,6 +680,62 @@ function addMsg(text, who) {
 
 addMsg("Hello! I can recommend books from our small library and include a full summary for the top pick. How can I help?", "bot");
 
+function setBotText(el, text) {
+  el.innerHTML = "<strong>Bot</strong><br>" + renderBot(text);
+  chat.scrollTop = chat.scrollHeight;
+}
+
+/* ===================== Streaming chat (SSE over fetch) ===================== */
+// POST /chat/stream and call onDelta(text) for every 'delta' event; resolves with the 'done' payload.
+async function streamChat(message, onDelta) {
+  const res = await fetch("/chat/stream", {
+    method: "POST",
+    headers: { "Content-Type": "application/json", "Accept": "text/event-stream" },
+    body: JSON.stringify({ message }),
+  });
+  if (!res.ok || !res.body) throw new Error(`stream failed: ${res.status}`);
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = "";
+  let done = null;
+
+  while (true) {
+    const { value, done: eof } = await reader.read();
+    if (eof) break;
+    buf += decoder.decode(value, { stream: true });
+
+    let sep;
+    while ((sep = buf.indexOf("\n\n")) !== -1) {
+      const block = buf.slice(0, sep);
+      buf = buf.slice(sep + 2);
+
+      let event = "message";
+      let data = "";
+      for (const line of block.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      }
+      if (!data) continue;
+
+      const payload = JSON.parse(data);
+      if (event === "delta") onDelta(payload.text || "");
+      else if (event === "done") done = payload;
+      else if (event === "error") throw new Error(payload.error || "stream error");
+    }
+  }
+  return done;
+}
+
+async function fetchChatJSON(message) {
+  const res = await fetch("/chat", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ message }),
+  });
+  return await res.json();
+}
+
 /* ===================== Submit handler ===================== */
 form.addEventListener("submit", async (e) => {
   e.preventDefault();
@@ -511,17 +753,31 @@ form.addEventListener("submit", async (e) => {
   chat.appendChild(thinking);
   chat.scrollTop = chat.scrollHeight;
 
+  let el = null;
   try {
-    const res = await fetch("/chat", {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ message: msg }),
-    });
-    const data = await res.json();
-    chat.removeChild(thinking);
+    // render tokens as they arrive; fall back to the blocking endpoint if streaming fails early
+    let streamed = "";
+    let data = null;
+    try {
+      data = await streamChat(msg, (delta) => {
+        streamed += delta;
+        if (!el) {
+          thinking.remove();
+          el = addMsg(streamed, "bot");
+        } else {
+          setBotText(el, streamed);
+        }
+      });
+    } catch (streamErr) {
+      if (el) throw streamErr;
+      console.warn("Streaming unavailable, using /chat:", streamErr);
+      data = await fetchChatJSON(msg);
+    }
+    thinking.remove();
 
-    const replyText = data.reply || "(no reply)";
-    const el = addMsg(replyText, "bot");
+    const replyText = (data && data.reply) || streamed || "(no reply)";
+    if (el) setBotText(el, replyText);
+    else el = addMsg(replyText, "bot");
 
     beautifyBookBlocks(el);
     addSpeakButtonToMessage(el, replyText);
@@ -531,7 +787,7 @@ form.addEventListener("submit", async (e) => {
       await ensureSingleTTSPlay(el, replyText);
     }
   } catch (err) {
-    chat.removeChild(thinking);
+    thinking.remove();
     addMsg("Error contacting server.", "bot");
     console.error(err);
   } finally {
@@ -13,6 +13,12 @@ fake_chromadb_utils = types.SimpleNamespace(
 sys.modules.setdefault("chromadb.utils", fake_chromadb_utils)
 sys.modules.setdefault("chromadb", types.SimpleNamespace(PersistentClient=lambda path: None))
 
+@pytest.fixture(autouse=True)
+def fresh_moderation_cache(monkeypatch):
+    """safety_check verdicts are cached module-wide; no test may see another test's verdicts."""
+    import helpers
+    monkeypatch.setattr(helpers, "moderation_cache", helpers.TTLCache(maxsize=64))
+
 @pytest.fixture
 def app(monkeypatch, tmp_path):
     import rag
@@ -70,12 +76,25 @@ def app(monkeypatch, tmp_path):
         return Resp("**A**\n\nWhy this book?\n- because\nSummary:\nEXT A\n")
     monkeypatch.setattr(config.client.chat.completions, "create", staticmethod(fake_chat_create))
 
+    class FakeModeration:
+        results = [types.SimpleNamespace(categories={})]
+    monkeypatch.setattr(config.client.moderations, "create", staticmethod(lambda **k: FakeModeration()))
+
     class FakeAudioResp: content = b"ID3\x03\x00demo"
     class FakeStreaming:
         def create(self, **k): raise RuntimeError("no stream in tests")
     monkeypatch.setattr(config.client.audio.speech, "with_streaming_response", FakeStreaming())
     monkeypatch.setattr(config.client.audio.speech, "create", staticmethod(lambda **k: FakeAudioResp()))
 
+    import routes_media
+    from cache import FileCache
+    monkeypatch.setattr(routes_media, "tts_cache", FileCache(tmp_path / "audio", max_bytes=1 << 20))
+    monkeypatch.setattr(routes_media, "image_cache", FileCache(tmp_path / "gen", max_bytes=1 << 20, pattern="*.png"))
+    monkeypatch.setattr(routes_media, "derivative_cache", FileCache(tmp_path / "gen", max_bytes=1 << 20, pattern="*.webp"))
+    monkeypatch.setattr(routes_media, "_image_jobs", {})
+    monkeypatch.setattr(routes_media, "tts_chunk_specs",
+                        routes_media.TTLCache(maxsize=64, store=routes_media.DiskStore(tmp_path / "chunks.sqlite3")))
+
     class FakeTransc:
         def __init__(self, t): self.text = t
     monkeypatch.setattr(config.client.audio.transcriptions, "create",
@@ -97,3 +116,52 @@ def app(monkeypatch, tmp_path):
 @pytest.fixture
 def client(app):
     return app.test_client()
+
+
+class _AsyncIter:
+    def __init__(self, it): self._it = it
+    def __aiter__(self): return self
+    async def __anext__(self):
+        try:
+            return next(self._it)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class _AsyncStreamed:
+    """Async view of a sync streamed response (iter_bytes -> async iterator)."""
+    def __init__(self, resp): self._resp = resp
+    def iter_bytes(self, chunk_size=None): return _AsyncIter(iter(self._resp.iter_bytes(chunk_size)))
+
+
+class _AsyncCall:
+    """Like the SDK's create(): awaitable, or usable as an async context manager (streaming responses)."""
+    def __init__(self, fn, a, k): self._fn, self._a, self._k = fn, a, k
+    def __await__(self): return self._run().__await__()
+    async def _run(self):
+        out = self._fn(*self._a, **self._k)
+        return _AsyncIter(out) if hasattr(out, "__next__") else out
+    async def __aenter__(self):
+        self._cm = self._fn(*self._a, **self._k)
+        return _AsyncStreamed(self._cm.__enter__())
+    async def __aexit__(self, *exc): return self._cm.__exit__(*exc)
+
+
+class AsyncFacade:
+    """Awaitable view over the stubbed sync client: `await aclient.x.y(**k)` runs `client.x.y(**k)`."""
+    def __init__(self, target): self._target = target
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return AsyncFacade(attr)
+        return lambda *a, **k: _AsyncCall(attr, a, k)
+
+
+@pytest.fixture
+def asgi_app(app, monkeypatch):
+    pytest.importorskip("quart")
+    import config
+    monkeypatch.setattr(config, "aclient", AsyncFacade(config.client))
+    asgi = importlib.import_module("asgi")
+    asgi.app.config.update(TESTING=True)
+    return asgi.app
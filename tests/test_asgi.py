@@ -0,0 +1,126 @@
+"""ASGI mode: same routes and payloads as web.py, driven through the async client stubs."""
+
+import asyncio
+import importlib
+import io
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_asgi_chat_proceed_ok(asgi_app):
+    async def go():
+        r = await asgi_app.test_client().post("/chat", json={"message": "carti despre dragoste"})
+        return r.status_code, await r.get_json()
+    status, j = run(go())
+    assert status == 200 and "A" in j["reply"] and j["cached"] is False
+
+def test_asgi_chat_blocked(asgi_app, monkeypatch):
+    asgi = importlib.import_module("asgi")
+    async def blocked(text, context_hint="", prefetched=None):
+        return False, "blocked"
+    monkeypatch.setattr(asgi, "safety_check_async", blocked)
+    async def go():
+        r = await asgi_app.test_client().post("/chat", json={"message": "injurii"})
+        return await r.get_json()
+    assert run(go())["reply"].lower().startswith("please rephrase")
+
+def test_asgi_chat_offtopic_short_circuit(asgi_app, monkeypatch):
+    asgi = importlib.import_module("asgi")
+    async def offtopic(t):
+        return {"action": "offtopic", "reply": "OFFTOPIC"}
+    async def allow(text, context_hint="", prefetched=None):
+        return True, "ok"
+    monkeypatch.setattr(asgi, "intent_gate_async", offtopic)
+    monkeypatch.setattr(asgi, "safety_check_async", allow)
+    async def go():
+        r = await asgi_app.test_client().post("/chat", json={"message": "care e vremea maine"})
+        return await r.get_json()
+    assert run(go())["reply"] == "OFFTOPIC"
+
+def test_asgi_chat_server_rendered_reply(asgi_app, monkeypatch):
+    import types
+    config = importlib.import_module("config")
+    calls = []
+    tool_call = types.SimpleNamespace(
+        id="t1", type="function",
+        function=types.SimpleNamespace(name="recommend_books",
+                                       arguments='{"books": [{"title": "A", "reasons": ["tender"]}]}'),
+    )
+    def fake_create(**kwargs):
+        calls.append(kwargs)
+        msg = types.SimpleNamespace(content="", tool_calls=[tool_call])
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=msg)])
+    monkeypatch.setattr(config.client.chat.completions, "create", staticmethod(fake_create))
+    async def go():
+        r = await asgi_app.test_client().post("/chat", json={"message": "carti despre dragoste"})
+        return await r.get_json()
+    assert run(go())["reply"] == "**A**\nWhy this book?\n- tender\nEXT A"
+    assert len([c for c in calls if "tools" in c]) == 1
+    assert not any(m.get("role") == "tool" for c in calls for m in c.get("messages", []))
+
+def test_asgi_chat_title_about_fast_path(asgi_app, monkeypatch):
+    from titles import PhraseMatcher, mention_keys
+    web = importlib.import_module("web")
+    asgi = importlib.import_module("asgi")
+    monkeypatch.setattr(web, "title_matcher", PhraseMatcher({k: "The Hobbit" for k in mention_keys("The Hobbit")}))
+    monkeypatch.setattr(web, "get_summary_by_title_local", lambda t: "EXT HOBBIT")
+    async def no_expansion(q, max_terms=10):
+        raise AssertionError("expansion on a title mention")
+    monkeypatch.setattr(asgi, "llm_expand_query_async", no_expansion)
+    async def go():
+        r = await asgi_app.test_client().post("/chat", json={"message": "tell me about The Hobbit"})
+        return await r.get_json()
+    assert run(go())["reply"] == "**The Hobbit**\nEXT HOBBIT"
+
+def test_asgi_media_routes(asgi_app):
+    async def go():
+        c = asgi_app.test_client()
+        tts = await c.post("/api/tts", json={"text": "hello"})
+        img = await c.post("/api/image", json={"prompt": "cover for A"})
+        stt = await c.post("/api/stt", files={"audio": _upload(b"\x00" * 8000)})
+        return tts, await tts.get_data(), await img.get_json(), await stt.get_json()
+    tts, audio, img, stt = run(go())
+    assert tts.status_code == 200 and tts.mimetype == "audio/mpeg" and audio
+    assert img["url"].startswith("/static/gen/")
+    assert stt["text"] == "hello world"
+
+def _upload(payload):
+    from werkzeug.datastructures import FileStorage
+    return FileStorage(io.BytesIO(payload), filename="voice.webm", content_type="audio/webm")
+
+def test_asgi_tts_streams_chunks(asgi_app, monkeypatch):
+    import config, contextlib
+    class Streamed:
+        def iter_bytes(self, chunk_size=None): yield from (b"ID3", b"async")
+    class Streaming:
+        @contextlib.contextmanager
+        def create(self, **k): yield Streamed()
+    monkeypatch.setattr(config.client.audio.speech, "with_streaming_response", Streaming())
+    async def go():
+        r = await asgi_app.test_client().post("/api/tts", json={"text": "stream me async"})
+        return r, await r.get_data()
+    r, audio = run(go())
+    assert r.status_code == 200 and audio == b"ID3async"
+    assert r.headers["Cache-Control"] == "no-store" and "ETag" not in r.headers
+
+def test_asgi_tts_playlist(asgi_app):
+    async def go():
+        c = asgi_app.test_client()
+        r = await c.post("/api/tts/playlist", json={"text": "Paragraph one is long enough to be spoken on its own, really, with a few more words.\n\nAnd here is a second paragraph of a similar length, with a few more words too."})
+        chunks = (await r.get_json())["chunks"]
+        bodies = [await (await c.get(ch["url"])).get_data() for ch in chunks]
+        return chunks, bodies
+    chunks, bodies = run(go())
+    assert len(chunks) == 2 and all(b.startswith(b"ID3") for b in bodies)
+
+def test_asgi_image_jobs(asgi_app):
+    async def go():
+        c = asgi_app.test_client()
+        r = await c.post("/api/image/jobs", json={"prompts": ["async cover 1", "async cover 2"]})
+        ids = [j["id"] for j in (await r.get_json())["jobs"]]
+        manifest = await (await c.get(f"/api/image/jobs?ids={','.join(ids)}&wait=5")).get_json()
+        while manifest["pending"]:
+            manifest = await (await c.get(f"/api/image/jobs?ids={','.join(ids)}&wait=5")).get_json()
+        return r.status_code, manifest
+    status, manifest = run(go())
+    assert status == 202 and [j["status"] for j in manifest["jobs"]] == ["done", "done"]
@@ -0,0 +1,73 @@
+import io, math, struct, wave
+
+import numpy as np
+
+import audio
+
+
+def make_wav(seconds=1.0, rate=16000, channels=1, amplitude=0, freq=440, width=2):
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(width)
+        w.setframerate(rate)
+        frames = bytearray()
+        for i in range(int(seconds * rate)):
+            v = int(amplitude * math.sin(2 * math.pi * freq * i / rate))
+            sample = struct.pack("<h", v) if width == 2 else bytes([(v >> 8) + 128])
+            frames += sample * channels
+        w.writeframes(bytes(frames))
+    return buf.getvalue()
+
+
+def test_decode_wav_downmixes_stereo():
+    pcm = audio.decode(make_wav(seconds=0.1, channels=2, amplitude=8000), "audio/wav")
+    assert pcm.rate == 16000 and len(pcm.samples) == 1600
+    assert max(pcm.samples) > 7000
+
+
+def test_decode_8bit_wav():
+    pcm = audio.decode(make_wav(seconds=0.1, amplitude=8000, width=1), "audio/wav")
+    assert pcm is not None and max(pcm.samples) > 6000
+
+
+def test_is_silent_by_energy_not_size():
+    quiet = make_wav(seconds=2.0, amplitude=20)       # large file, ~ -64 dBFS
+    speech = make_wav(seconds=0.5, amplitude=6000)    # small file, ~ -18 dBFS
+    assert len(quiet) > len(speech)
+    kw = dict(threshold_dbfs=-45, min_speech_ms=250)
+    assert audio.is_silent(quiet, "audio/wav", **kw) is True
+    assert audio.is_silent(speech, "audio/wav", **kw) is False
+
+
+def test_undecodable_returns_none(monkeypatch):
+    monkeypatch.setattr(audio, "av", None)
+    assert audio.is_silent(b"\x1a\x45\xdf\xa3" + b"\0" * 100, "audio/webm",
+                           threshold_dbfs=-45, min_speech_ms=250) is None
+
+
+def test_resample_length_and_level():
+    pcm = audio.decode(make_wav(seconds=0.5, rate=48000, amplitude=8000, freq=200), "audio/wav")
+    out = audio.resample(pcm, 16000)
+    assert out.rate == 16000 and len(out.samples) == 8000
+    assert 6000 < max(out.samples) <= 8000
+
+
+def test_preprocess_downmixes_resamples_and_trims():
+    silence = make_wav(seconds=1.0, rate=44100, channels=2)
+    tone = make_wav(seconds=0.5, rate=44100, channels=2, amplitude=8000, freq=300)
+    pcm = [audio.decode(b, "audio/wav").samples for b in (silence, tone, silence)]
+    clip = audio.encode_wav(audio.PCM(np.concatenate(pcm), 44100))
+
+    prep = audio.preprocess(clip, "audio/wav", threshold_dbfs=-45, min_speech_ms=250, pad_ms=100)
+    assert prep.silent is False and prep.mime == "audio/wav"
+    out = audio.decode(prep.data, prep.mime)
+    assert out.rate == 16000
+    assert 500 <= out.duration_ms <= 800          # 0.5 s of tone + ~2 x 100 ms padding
+    assert prep.saved_bytes == len(clip) - len(prep.data) > 0
+
+
+def test_preprocess_keeps_upload_when_not_smaller():
+    clip = make_wav(seconds=0.5, rate=16000, amplitude=8000)
+    prep = audio.preprocess(clip, "audio/wav", threshold_dbfs=-45, min_speech_ms=250)
+    assert prep.data == clip and prep.saved_bytes == 0 and prep.silent is False
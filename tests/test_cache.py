@@ -0,0 +1,63 @@
+import cache
+
+def test_ttl_cache_lru_and_counters():
+    c = cache.TTLCache(maxsize=2)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1
+    c.set("c", 3)
+    assert c.get("b") is None
+    assert c.get("a") == 1 and c.get("c") == 3
+    st = c.stats()
+    assert st["hits"] == 3 and st["misses"] == 1 and st["size"] == 2
+
+def test_ttl_cache_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    c = cache.TTLCache(maxsize=10, ttl=5)
+    c.set("k", "v")
+    now[0] += 4
+    assert c.get("k") == "v"
+    now[0] += 2
+    assert c.get("k") is None
+
+def test_ttl_cache_shared_disk_store(tmp_path):
+    store_path = tmp_path / "shared.sqlite3"
+    w1 = cache.TTLCache(maxsize=10, ttl=60, store=cache.DiskStore(store_path))
+    w2 = cache.TTLCache(maxsize=10, ttl=60, store=cache.DiskStore(store_path))
+    w1.set("q", ["fantasy", "magic"])
+    assert w2.get("q") == ["fantasy", "magic"]
+    assert w2.stats()["hits"] == 1
+
+def test_file_cache_lru_eviction(tmp_path):
+    import os
+    fc = cache.FileCache(tmp_path, max_bytes=25, pattern="*.bin")
+    for i, key in enumerate(("a", "b", "c")):
+        p = fc.put(key, ".bin", b"x" * 10)
+        os.utime(p, (1000 + i, 1000 + i))
+    assert fc.get("a", ".bin") is None          # oldest evicted once over 25 bytes
+    assert fc.get("b", ".bin") is not None      # hit refreshes recency
+    fc.put("d", ".bin", b"y" * 10)
+    assert fc.get("c", ".bin") is None and fc.get("b", ".bin") is not None
+    u = fc.usage()
+    assert u["files"] == 2 and u["bytes"] == 20
+
+def test_caching_embedding_function_batches_misses_and_shares_disk(tmp_path):
+    from embeddings import CachingEmbeddingFunction, EmbeddingCache
+    calls = []
+    def inner(texts):
+        calls.append(list(texts))
+        return [[float(len(t)), 0.5] for t in texts]
+
+    store = cache.DiskStore(tmp_path / "emb.sqlite3", table="embeddings")
+    ef = CachingEmbeddingFunction(inner, "m", EmbeddingCache(maxsize=10, store=store))
+    assert ef(["ab", "abc", "ab"]) == [[2.0, 0.5], [3.0, 0.5], [2.0, 0.5]]
+    assert calls == [["ab", "abc"]]
+    assert ef(["ab ", " abc"]) == [[2.0, 0.5], [3.0, 0.5]]  # whitespace-only variants hit
+    assert len(calls) == 1
+    assert ef.cache.stats()["memory_hits"] == 2
+
+    other = CachingEmbeddingFunction(inner, "m", EmbeddingCache(maxsize=10, store=store))
+    assert other(["abc"]) == [[3.0, 0.5]] and len(calls) == 1
+    assert other.cache.stats()["disk_hits"] == 1
+    assert CachingEmbeddingFunction(inner, "m2", EmbeddingCache(maxsize=10))(["abc"]) and len(calls) == 2
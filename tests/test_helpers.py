@@ -23,8 +23,98 @@ def test_get_summary_by_title_local_factory():
     assert fn("a") == "EXT A"
     assert fn("missing") == "NOT_FOUND"
 
+def test_get_summary_by_title_local_tolerates_variants():
+    ext = [{"title": "The Fellowship of the Ring", "summary": "EXT F"}, {"title": "Dune: Part One", "summary": "EXT D"}]
+    fn = helpers.get_summary_by_title_local_factory(ext, [])
+    assert fn("Fellowship of the Ring") == "EXT F"
+    assert fn("The Felowship of the Rings") == "EXT F"
+    assert fn("Dune") == "EXT D"
+    assert fn("The Silmarillion") == "NOT_FOUND"
+
 def test_safety_check_balanced(monkeypatch):
     monkeypatch.setattr(helpers, "is_offensive", lambda t: True)
     monkeypatch.setattr(helpers, "insult_gate_llm", lambda t, context_hint="": True)
     allow, reason = helpers.safety_check("query", context_hint="informational")
     assert allow is True
+
+def test_safety_check_joins_prefetched_moderation(monkeypatch):
+    calls = {"api": 0, "llm": 0}
+    def fake_api(t):
+        calls["api"] += 1
+        return True
+    def fake_llm(t, context_hint=""):
+        calls["llm"] += 1
+        return True
+    monkeypatch.setattr(helpers, "is_offensive", fake_api)
+    monkeypatch.setattr(helpers, "insult_gate_llm", fake_llm)
+    monkeypatch.setattr(helpers, "moderation_cache", helpers.TTLCache(maxsize=8))
+    with helpers.prefetched_moderation("query"):
+        allow, reason = helpers.safety_check("query")
+    assert (allow, reason) == (False, "strict_or_block")
+    assert calls == {"api": 1, "llm": 1}
+
+def test_local_intent_fast_path():
+    books = [
+        {"title": "The Hobbit", "summary": "s", "themes": ["fantasy", "adventure"]},
+        {"title": "A", "summary": "s", "themes": ["love"]},
+    ]
+    fn = helpers.local_intent_factory(books)
+    before = helpers.intent_path_stats()
+    assert fn("Hi there!")["action"] == "greet"
+    assert fn("Bună ziua")["reply"] == helpers.GREET_REPLY
+    assert fn("what is the hobbit about?") == {"action": "proceed", "reply": ""}
+    assert fn("recommend a fantasy book")["action"] == "proceed"
+    assert fn("I love pizza") is None          # theme without a book cue
+    assert fn("give me a book") is None        # 1-char title "A" is never matched
+    after = helpers.intent_path_stats()
+    assert after["gate_calls_saved"] - before["gate_calls_saved"] == 4
+    assert after["llm"] - before.get("llm", 0) == 2
+
+def test_safety_check_caches_verdicts(monkeypatch):
+    calls = []
+    monkeypatch.setattr(helpers, "is_offensive", lambda t: calls.append("api") or False)
+    monkeypatch.setattr(helpers, "insult_gate_llm", lambda t, context_hint="": calls.append("llm") or True)
+    monkeypatch.setattr(helpers, "moderation_cache", helpers.TTLCache(maxsize=8))
+    assert helpers.safety_check("same text") == (True, "strict_pass")
+    with helpers.prefetched_moderation("same text"):
+        assert helpers.safety_check("same text") == (True, "strict_pass")
+    assert sorted(calls) == ["api", "llm"]
+    assert helpers.moderation_cache.stats()["hits"] == 1
+
+def test_prefetch_only_skipped_for_the_hint_safety_check_uses(monkeypatch):
+    calls = []
+    monkeypatch.setattr(helpers, "is_offensive", lambda t: calls.append("api") or False)
+    monkeypatch.setattr(helpers, "insult_gate_llm", lambda t, context_hint="": calls.append("llm") or True)
+    helpers.safety_check("text", context_hint="")
+    assert helpers.has_cached_verdict("text", "") and not helpers.has_cached_verdict("text")
+    assert not helpers.has_cached_verdict("text", "informational")
+    with helpers.prefetched_moderation("text", ""):
+        assert helpers._prefetched_moderation.get() is None      # verdict cached: nothing started
+    with helpers.prefetched_moderation("text", "informational"):
+        assert helpers._prefetched_moderation.get() is not None  # other hint: still prefetched
+        helpers.safety_check("text", context_hint="informational")
+    assert len(calls) == 4
+
+def test_failed_moderation_calls_are_not_cached(monkeypatch):
+    import config
+    def down(**k): raise RuntimeError("upstream down")
+    monkeypatch.setattr(config.client.moderations, "create", staticmethod(down))
+    monkeypatch.setattr(config.client.chat.completions, "create", staticmethod(down))
+    assert helpers.is_offensive("text") is None and helpers.insult_gate_llm("text") is None
+    assert helpers.safety_check("text") == (True, "strict_pass")           # fails open for this request
+    assert helpers.safety_check("text", context_hint="informational")[0] is True
+    assert helpers.moderation_cache.stats()["size"] == 0
+
+def test_reply_cleaner_matches_clean_reply_for_any_chunking():
+    import random
+    text = ("**Dune**\n\n  Why this book?\n- epic  \nExtended summary: Paul goes to Arrakis.  \n"
+            "\n**Emma**\nSummary:\n  A summary of matchmaking; summary: done\n\n")
+    rnd = random.Random(7)
+    for _ in range(200):
+        cleaner, out, i = helpers.ReplyCleaner(), [], 0
+        while i < len(text):
+            n = rnd.randint(1, 6)
+            out.append(cleaner.feed(text[i:i + n]))
+            i += n
+        out.append(cleaner.flush())
+        assert "".join(out) == helpers.clean_reply(text)
@@ -0,0 +1,59 @@
+import importlib
+
+from lexical import BM25Index, rrf_fuse, tokenize
+
+BOOKS = [
+    {"title": "The Hobbit", "summary": "Bilbo joins dwarves on a quest for treasure and a dragon.",
+     "themes": ["fantasy", "adventure", "friendship"]},
+    {"title": "1984", "summary": "A totalitarian regime watches everyone; Winston rebels.",
+     "themes": ["dystopia", "surveillance", "freedom"]},
+    {"title": "Pride and Prejudice", "summary": "Elizabeth and Darcy overcome pride in love.",
+     "themes": ["romance", "society"]},
+]
+
+
+def test_tokenize_drops_stopwords_and_diacritics():
+    assert tokenize("Vreau o carte despre prietenie și curaj") == ["prietenie", "curaj"]
+    assert tokenize("A book about friendship") == ["friendship"]
+
+
+def test_bm25_ranks_theme_and_synonym_matches():
+    idx = BM25Index(BOOKS, synonyms={"dystopia": ["authoritarian"], "romance": ["love story"]})
+    assert idx.titles[idx.search("fantasy friendship")[0][0]] == "The Hobbit"
+    assert idx.titles[idx.search("authoritarian government")[0][0]] == "1984"
+    assert idx.search("quantum physics") == []
+
+
+def test_confidence_from_catalog_coverage():
+    idx = BM25Index(BOOKS)
+    assert idx.is_confident("Recommend a fantasy book about friendship", 0.8)
+    assert not idx.is_confident("carti despre dragoste", 0.8)       # needs the LLM rewrite
+    assert idx.stats() == {"documents": 3, "queries": 2, "expansion_skipped": 1}
+
+
+def test_rrf_promotes_lexical_agreement_and_adds_missing_titles():
+    idx = BM25Index(BOOKS)
+    vector = [
+        {"title": "Pride and Prejudice", "summary": "s", "score": 0.30},
+        {"title": "The Hobbit", "summary": "s", "score": 0.31},
+    ]
+    fused = rrf_fuse(vector, idx, "dragon treasure quest", k=3)
+    assert [c["title"] for c in fused][:2] == ["The Hobbit", "Pride and Prejudice"]
+    assert fused[0]["score"] == 0.31                                # vector distance kept
+
+    fused = rrf_fuse(vector, idx, "surveillance", k=3)
+    assert "1984" in [c["title"] for c in fused]
+    assert next(c for c in fused if c["title"] == "1984")["score"] is None
+
+
+def test_chat_skips_expansion_when_lexically_confident(client, monkeypatch):
+    web = importlib.import_module("web")
+    calls = []
+    monkeypatch.setattr(web, "llm_expand_query", lambda q, max_terms=10: calls.append(q) or [])
+    monkeypatch.setattr(web, "lexical_index", BM25Index(web.books_small))
+
+    client.post("/chat", json={"message": "something about love"})
+    assert calls == []
+    client.post("/chat", json={"message": "carti despre dragoste"})
+    assert calls == ["carti despre dragoste"]
+    assert client.get("/stats").get_json()["lexical"]["expansion_skipped"] == 1
@@ -6,3 +6,32 @@ def test_build_messages_and_tools_shape():
     assert isinstance(messages, list) and len(messages) >= 2
     assert isinstance(tools, list) and tools[0]["function"]["name"] == "get_summaries_by_titles"
     assert "Candidates" in messages[1]["content"]
+
+def test_server_render_mode_asks_for_structured_selection():
+    messages, tools = prompts.build_messages_and_tools("dragoste", [{"title": "A", "summary": "aaa"}], render="server")
+    assert [t["function"]["name"] for t in tools] == ["recommend_books"]
+    item = tools[0]["function"]["parameters"]["properties"]["books"]["items"]
+    assert item["required"] == ["title", "reasons"]
+    assert "get_summaries_by_titles" not in messages[0]["content"] and "Candidates" in messages[1]["content"]
+
+def test_candidates_are_compact_and_truncated():
+    import json
+    long_summary = " ".join(f"word{i}" for i in range(400))
+    cands = [{"title": "Dune", "summary": long_summary, "score": 0.123456},
+             {"title": "Emma", "summary": "A matchmaker.", "score": 0.5}]
+    before = prompts.prompt_stats()["requests"]
+    messages, tools = prompts.build_messages_and_tools("sci-fi", cands)
+    content = messages[1]["content"]
+
+    lines = [l for l in content.splitlines() if l.startswith('{"t":')]
+    assert [json.loads(l)["t"] for l in lines] == ["Dune", "Emma"]
+    assert "score" not in content and "0.123456" not in content and "\n  " not in content
+    dune = json.loads(lines[0])["s"]
+    assert dune.endswith("…") and prompts.count_tokens(dune) <= prompts.CANDIDATE_SUMMARY_TOKENS + 1
+    assert json.loads(lines[1])["s"] == "A matchmaker."
+
+    old_block = json.dumps(cands, ensure_ascii=False, indent=2)
+    assert prompts.count_tokens(prompts.encode_candidates(cands)) < prompts.count_tokens(old_block) / 3
+    stats = prompts.prompt_stats()
+    assert stats["requests"] == before + 1
+    assert stats["tokens_last"] == prompts.messages_tokens(messages, tools)
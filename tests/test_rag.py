@@ -27,3 +27,158 @@ def test_retrieve_candidates_mapping():
     assert out[0]["title"] == "T1"
     assert out[0]["summary"] == "S1"
     assert isinstance(out[0]["score"], float)
+
+class FakeChromaCollection:
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.rows = {}
+        self.upserted = []
+        self.deleted = []
+
+    def get(self, include=None):
+        ids = list(self.rows)
+        return {"ids": ids, "metadatas": [self.rows[i][1] for i in ids]}
+
+    def upsert(self, documents, metadatas, ids):
+        self.upserted.extend(ids)
+        for i, d, m in zip(ids, documents, metadatas):
+            self.rows[i] = (d, m)
+
+    def delete(self, ids):
+        self.deleted.extend(ids)
+        for i in ids:
+            self.rows.pop(i, None)
+
+class FakeChromaClient:
+    def __init__(self):
+        self.collection = None
+
+    def get_or_create_collection(self, name, embedding_function=None, metadata=None):
+        if self.collection is None:
+            self.collection = FakeChromaCollection(metadata)
+        return self.collection
+
+    def create_collection(self, name, embedding_function=None, metadata=None):
+        self.collection = FakeChromaCollection(metadata)
+        return self.collection
+
+    def delete_collection(self, name):
+        self.collection = None
+
+def test_build_vector_store_incremental(monkeypatch, tmp_path):
+    import types
+    fake = FakeChromaClient()
+    monkeypatch.setattr(rag, "PERSIST_DIR", tmp_path)
+    monkeypatch.setattr(rag, "chromadb", types.SimpleNamespace(PersistentClient=lambda path: fake))
+    vocab_calls = []
+    def fake_vocab(themes, per_theme_max=3):
+        vocab_calls.append(list(themes))
+        return {t: [t + "-syn"] for t in themes}
+    monkeypatch.setattr(rag, "llm_expand_theme_vocab", fake_vocab)
+
+    books = [
+        {"title": "A", "summary": "aaa", "themes": ["love"]},
+        {"title": "B", "summary": "bbb", "themes": ["war"]},
+    ]
+    coll = rag.build_vector_store(books)
+    assert len(coll.upserted) == 2 and vocab_calls == [["love", "war"]]
+
+    coll.upserted.clear()
+    coll = rag.build_vector_store(books)
+    assert coll.upserted == [] and coll.deleted == [] and len(vocab_calls) == 1
+
+    edited = [{"title": "A", "summary": "aaa v2", "themes": ["love"]}]
+    coll = rag.build_vector_store(edited)
+    assert coll.upserted == [rag._book_id("A")]
+    assert coll.deleted == [rag._book_id("B")]
+    assert len(vocab_calls) == 1
+
+def test_build_vector_store_retries_failed_theme_expansion(monkeypatch, tmp_path):
+    import types
+    fake = FakeChromaClient()
+    monkeypatch.setattr(rag, "PERSIST_DIR", tmp_path)
+    monkeypatch.setattr(rag, "chromadb", types.SimpleNamespace(PersistentClient=lambda path: fake))
+    vocab_calls = []
+    def flaky_vocab(themes, per_theme_max=3):
+        vocab_calls.append(list(themes))
+        if len(vocab_calls) == 1:
+            return {t: [] for t in themes}      # upstream failed: no synonyms this time
+        return {t: [t + "-syn"] for t in themes}
+    monkeypatch.setattr(rag, "llm_expand_theme_vocab", flaky_vocab)
+
+    books = [{"title": "A", "summary": "aaa", "themes": ["love"]}]
+    coll = rag.build_vector_store(books)
+    assert vocab_calls == [["love"]]
+
+    coll.upserted.clear()
+    coll = rag.build_vector_store(books)
+    assert vocab_calls == [["love"], ["love"]]
+    assert coll.upserted == [rag._book_id("A")]           # re-embedded with the synonyms
+
+    coll.upserted.clear()
+    coll = rag.build_vector_store(books)
+    assert len(vocab_calls) == 2 and coll.upserted == []
+
+def test_theme_vocab_only_expands_new_themes(monkeypatch, tmp_path):
+    import types, json
+    from cache import DiskStore
+    monkeypatch.setattr(rag, "_theme_vocab_store", DiskStore(tmp_path / "vocab.sqlite3"))
+    monkeypatch.setattr(rag, "THEME_VOCAB_BATCH", 1)
+    calls = []
+    def fake_create(**kwargs):
+        themes = json.loads(kwargs["messages"][1]["content"])["themes"]
+        calls.append(themes)
+        content = json.dumps({t: [t + "-syn"] for t in themes})
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))])
+    monkeypatch.setattr(rag.client.chat.completions, "create", fake_create)
+
+    out = rag.llm_expand_theme_vocab(["love", "war"])
+    assert out == {"love": ["love-syn"], "war": ["war-syn"]}
+    assert sorted(c[0] for c in calls) == ["love", "war"]
+
+    calls.clear()
+    out = rag.llm_expand_theme_vocab(["love", "war", "hope"])
+    assert calls == [["hope"]]
+    assert out["love"] == ["love-syn"] and out["hope"] == ["hope-syn"]
+
+def test_llm_expand_query_cached_on_normalized_text(monkeypatch):
+    import types
+    monkeypatch.setattr(rag, "query_expansion_cache", rag.TTLCache(maxsize=8))
+    calls = []
+    def fake_create(**kwargs):
+        calls.append(kwargs)
+        content = '{"english_keywords": ["fantasy", "books"]}'
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))])
+    monkeypatch.setattr(rag.client.chat.completions, "create", fake_create)
+
+    assert rag.llm_expand_query("Fantasy books") == ["fantasy", "books"]
+    assert rag.llm_expand_query("  fantasy BOOKS!! ") == ["fantasy", "books"]
+    assert len(calls) == 1
+    assert rag.query_expansion_cache.stats()["hits"] == 1
+
+def test_llm_expand_query_keeps_non_latin_queries_apart(monkeypatch):
+    import json, types
+    monkeypatch.setattr(rag, "query_expansion_cache", rag.TTLCache(maxsize=8))
+    def fake_create(**kwargs):
+        query = json.loads(kwargs["messages"][-1]["content"])["query"]
+        content = json.dumps({"english_keywords": [query.split()[-1]]})
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))])
+    monkeypatch.setattr(rag.client.chat.completions, "create", fake_create)
+
+    first = rag.llm_expand_query("книги о любви")
+    second = rag.llm_expand_query("книги о войне")
+    assert first != second
+    assert rag.query_expansion_cache.stats()["hits"] == 0
+    assert rag.llm_expand_query("Книги  о любви") == first
+
+    # mixed scripts: the Latin/digit part alone must not decide the key
+    assert rag._query_expansion_key("фэнтези books", 10) != rag._query_expansion_key("детективы books", 10)
+    assert rag._query_expansion_key("книги про любовь 1984", 10) != rag._query_expansion_key("книги про войну 1984", 10)
+
+def test_catalog_version_tracks_content(tmp_path):
+    books = tmp_path / "books.json"
+    books.write_text("[]", encoding="utf-8")
+    v1 = rag.catalog_version(books, tmp_path / "missing.json")
+    assert v1 == rag.catalog_version(books, tmp_path / "missing.json")
+    books.write_text('[{"title": "A"}]', encoding="utf-8")
+    assert rag.catalog_version(books, tmp_path / "missing.json") != v1
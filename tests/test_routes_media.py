@@ -1,4 +1,7 @@
-import io, os
+import io, os, threading, time
+import contextlib
+
+import pytest
 
 def test_stt_silence_guard(client):
     data = {"audio": (io.BytesIO(b"\x00"*1024), "s.webm")}
@@ -13,9 +16,327 @@ def test_tts_returns_audio(client):
     assert len(r.data) > 0
 
 def test_image_generation_saves_file(client, app):
+    import routes_media
     r = client.post("/api/image", json={"prompt": "cover for A"})
     assert r.status_code == 200
     url = r.get_json()["url"]
     assert url.startswith("/static/gen/")
-    path = os.path.join(app.static_folder, "gen", os.path.basename(url))
+    path = os.path.join(routes_media.image_cache.dir, os.path.basename(url))
     assert os.path.exists(path)
+
+def test_tts_cached_with_etag(client, monkeypatch):
+    import config
+    calls = []
+    class Audio: content = b"ID3\x03\x00cached"
+    monkeypatch.setattr(config.client.audio.speech, "create", staticmethod(lambda **k: calls.append(k) or Audio()))
+
+    r1 = client.post("/api/tts", json={"text": "same reply"})
+    etag = r1.headers["ETag"]
+    r2 = client.post("/api/tts", json={"text": "same reply"})
+    assert r2.data == r1.data == Audio.content and len(calls) == 1
+    assert "immutable" in r2.headers["Cache-Control"]
+
+    r3 = client.post("/api/tts", json={"text": "same reply"}, headers={"If-None-Match": etag})
+    assert r3.status_code == 304 and len(calls) == 1
+
+class FakeStreamed:
+    def __init__(self, chunks): self.chunks, self.closed, self.opened = chunks, False, 0
+    def iter_bytes(self, chunk_size=None): yield from self.chunks
+
+def fake_streaming(streamed):
+    class Streaming:
+        @contextlib.contextmanager
+        def create(self, **k):
+            streamed.opened += 1
+            try:
+                yield streamed
+            finally:
+                streamed.closed = True
+    return Streaming()
+
+def test_tts_streams_chunks_and_fills_cache(client, monkeypatch):
+    import config, routes_media
+    streamed = FakeStreamed([b"ID3", b"\x03\x00", b"chunked"])
+    monkeypatch.setattr(config.client.audio.speech, "with_streaming_response", fake_streaming(streamed))
+
+    r = client.post("/api/tts", json={"text": "stream me"})
+    assert r.status_code == 200 and r.is_streamed and r.mimetype == "audio/mpeg"
+    assert r.data == b"ID3\x03\x00chunked" and streamed.closed
+    assert "Content-Length" not in r.headers
+    assert r.headers["Cache-Control"] == "no-store" and "ETag" not in r.headers
+
+    # completed stream landed in the disk cache: the replay never reaches upstream
+    r2 = client.post("/api/tts", json={"text": "stream me"})
+    assert r2.data == r.data and streamed.opened == 1
+    assert "immutable" in r2.headers["Cache-Control"] and r2.headers["ETag"]
+    assert routes_media.tts_cache.usage()["files"] == 1
+
+def test_tts_stream_interrupted_aborts_and_is_not_cached(client, monkeypatch):
+    import config, routes_media
+    class Broken(FakeStreamed):
+        def iter_bytes(self, chunk_size=None):
+            yield b"ID3"
+            raise RuntimeError("upstream reset")
+    streamed = Broken([])
+    monkeypatch.setattr(config.client.audio.speech, "with_streaming_response", fake_streaming(streamed))
+
+    r = client.post("/api/tts", json={"text": "cut short"}, buffered=False)
+    assert r.headers["Cache-Control"] == "no-store"
+    with pytest.raises(RuntimeError):
+        r.get_data()
+    assert streamed.closed and routes_media.tts_cache.usage()["files"] == 0
+
+def test_tts_stream_over_cap_is_not_cached(client, monkeypatch):
+    import config, routes_media
+    monkeypatch.setattr(routes_media, "TTS_CACHE_MAX_ITEM_BYTES", 4)
+    streamed = FakeStreamed([b"abc", b"def"])
+    monkeypatch.setattr(config.client.audio.speech, "with_streaming_response", fake_streaming(streamed))
+
+    r = client.post("/api/tts", json={"text": "long reply"})
+    assert r.data == b"abcdef"
+    assert routes_media.tts_cache.usage()["files"] == 0
+
+def test_capped_buffer_bounds_memory():
+    from routes_media import CappedBuffer
+    buf = CappedBuffer(5)
+    buf.add(b"abc"); buf.add(b"de")
+    assert buf.getvalue() == b"abcde" and not buf.overflow
+    buf.add(b"f")
+    assert buf.overflow and buf.parts == []
+
+def test_split_for_tts_keeps_lines_stable():
+    from routes_media import split_for_tts
+    summary = "A long summary sentence about the book. " * 5
+    reply = f"**Title A**\nWhy this book?\n{summary}\nAnother line that is long enough to stand alone as its own chunk here."
+    chunks = split_for_tts(reply, max_chars=300)
+    # short lines share a chunk but never swallow the summary line that follows them
+    assert chunks[:2] == ["**Title A** Why this book?", " ".join(summary.split())]
+    assert split_for_tts(summary, max_chars=300) == [" ".join(summary.split())]
+
+    long_para = "Sentence number one is here. " * 40
+    parts = split_for_tts(long_para, max_chars=200)
+    assert all(len(p) <= 200 for p in parts) and len(parts) > 1
+    assert " ".join(parts) == " ".join(long_para.split())
+
+def test_split_for_tts_shares_summary_chunk_across_clean_replies():
+    from helpers import clean_reply
+    from routes_media import split_for_tts, tts_key
+    hobbit = ("Bilbo Baggins, a comfortable hobbit, is swept into a quest with thirteen dwarves "
+              "to reclaim their mountain home from the dragon Smaug.")
+    first = clean_reply(f"**The Hobbit**\n\nWhy this book?\n- cosy adventure\n\n{hobbit}\n\n"
+                        "**Dune**\n\nA desert planet, a prophecy and a war over the most valuable substance in the universe.")
+    second = clean_reply(f"**1984**\n\nA grim look at total surveillance and the rewriting of history by the Party.\n\n"
+                         f"**The Hobbit**\n\n{hobbit}")
+    keys = lambda reply: {tts_key(c, "alloy", "mp3") for c in split_for_tts(reply)}
+    assert tts_key(hobbit, "alloy", "mp3") in keys(first) & keys(second)
+
+def test_tts_chunk_url_works_on_another_worker(client, monkeypatch):
+    import routes_media
+    # the playlist is built here, but its synthesis never starts in this process
+    submit = routes_media.submit_chunk
+    monkeypatch.setattr(routes_media, "submit_chunk", lambda *a: None)
+    text = "A chunk that another worker process will be asked to synthesize, long enough."
+    url = client.post("/api/tts/playlist", json={"text": text}).get_json()["chunks"][0]["url"]
+    monkeypatch.setattr(routes_media, "submit_chunk", submit)
+
+    # a different worker: empty in-process state, same spec store on disk
+    monkeypatch.setattr(routes_media, "tts_chunk_specs",
+                        routes_media.TTLCache(maxsize=64, store=routes_media.tts_chunk_specs.store))
+    monkeypatch.setattr(routes_media, "_tts_inflight", {})
+    r = client.get(url)
+    assert r.status_code == 200 and r.data.startswith(b"ID3")
+
+def test_tts_playlist_chunks_cached_individually(client, monkeypatch):
+    import config
+    calls = []
+    class Audio: content = b"ID3\x03\x00chunk"
+    monkeypatch.setattr(config.client.audio.speech, "create",
+                        staticmethod(lambda **k: calls.append(k["input"]) or Audio()))
+    shared = "This shared summary paragraph appears in more than one reply and is long enough. " * 2
+    r = client.post("/api/tts/playlist", json={"text": f"{shared}\n\nFirst reply closing paragraph, long enough to be its own chunk."})
+    chunks = r.get_json()["chunks"]
+    assert len(chunks) == 2
+    bodies = [client.get(c["url"]) for c in chunks]
+    assert all(b.status_code == 200 and b.data == Audio.content for b in bodies)
+    assert bodies[0].headers["ETag"] == chunks[0]["etag"]
+
+    r2 = client.post("/api/tts/playlist", json={"text": f"{shared}\n\nA different closing paragraph that is also long enough."})
+    chunks2 = r2.get_json()["chunks"]
+    assert chunks2[0]["url"] == chunks[0]["url"]
+    for c in chunks2:
+        client.get(c["url"])
+    assert calls.count(" ".join(shared.split())) == 1 and len(calls) == 3
+
+def test_tts_chunk_unknown_key(client):
+    assert client.get("/api/tts/chunk/" + "0" * 64 + ".mp3").status_code == 404
+    assert client.get("/api/tts/chunk/nope.exe").status_code == 404
+
+def _wav_upload(amplitude, seconds=1.0):
+    from test_audio import make_wav
+    return {"audio": (io.BytesIO(make_wav(seconds=seconds, amplitude=amplitude)), "rec.wav", "audio/wav")}
+
+def test_stt_silence_by_energy_skips_upstream(client, monkeypatch):
+    import config
+    calls = []
+    monkeypatch.setattr(config.client.audio.transcriptions, "create",
+                        staticmethod(lambda **k: calls.append(k) or type("T", (), {"text": "hi"})()))
+    r = client.post("/api/stt", data=_wav_upload(amplitude=10), content_type="multipart/form-data")
+    assert r.get_json()["text"] == "" and not calls
+
+    r = client.post("/api/stt", data=_wav_upload(amplitude=6000), content_type="multipart/form-data")
+    assert r.get_json()["text"] == "hi"
+    name, payload, mime = calls[0]["file"]
+    assert name == "speech.wav" and mime == "audio/wav" and payload[:4] == b"RIFF"
+
+def test_stt_rejects_oversize_and_unknown_types(client, monkeypatch):
+    import routes_media
+    r = client.post("/api/stt", data={"audio": (io.BytesIO(b"x" * 6000), "notes.txt", "text/plain")},
+                    content_type="multipart/form-data")
+    assert r.status_code == 415 and r.get_json()["text"] == ""
+
+    monkeypatch.setattr(routes_media, "MAX_AUDIO_BYTES", 1000)
+    monkeypatch.setattr(routes_media, "_UPLOAD_CHUNK", 256)
+    r = client.post("/api/stt", data={"audio": (io.BytesIO(b"\0" * 4000), "a.webm", "audio/webm;codecs=opus")},
+                    content_type="multipart/form-data")
+    assert r.status_code == 413 and r.get_json()["error"]["code"] == "too_large"
+
+def test_stt_sends_preprocessed_audio(client, monkeypatch):
+    import config, routes_media
+    from test_audio import make_wav
+    calls = []
+    monkeypatch.setattr(config.client.audio.transcriptions, "create",
+                        staticmethod(lambda **k: calls.append(k) or type("T", (), {"text": "hi"})()))
+    loud = make_wav(seconds=0.6, rate=48000, channels=2, amplitude=7000)
+    before = routes_media.stt_stats()["bytes_saved"]
+    r = client.post("/api/stt", data={"audio": (io.BytesIO(loud), "rec.wav", "audio/wav")},
+                    content_type="multipart/form-data")
+    assert r.get_json()["text"] == "hi"
+    _, payload, mime = calls[0]["file"]
+    assert mime == "audio/wav" and len(payload) < len(loud) // 4
+    assert routes_media.stt_stats()["bytes_saved"] - before == len(loud) - len(payload)
+
+def test_image_cache_dedupes_normalized_prompts(client, monkeypatch):
+    import config, routes_media
+    calls = []
+    real = config.client.images.generate
+    monkeypatch.setattr(config.client.images, "generate", staticmethod(lambda **k: calls.append(k) or real(**k)))
+
+    r1 = client.post("/api/image", json={"prompt": "Cover for  A"}).get_json()
+    r2 = client.post("/api/image", json={"prompt": "cover for a "}).get_json()
+    r3 = client.post("/api/image", json={"prompt": "cover for a", "quality": "high"}).get_json()
+    assert r1["url"] == r2["url"] and r1["cached"] is False and r2["cached"] is True
+    assert r3["url"] != r1["url"] and len(calls) == 2
+
+    usage = client.get("/api/image/usage").get_json()
+    assert usage["files"] == 2 and usage["hits"] == 1
+
+def test_image_cache_quota_evicts_lru(client, monkeypatch, tmp_path):
+    import routes_media
+    from cache import FileCache
+    monkeypatch.setattr(routes_media, "image_cache", FileCache(tmp_path / "q", max_bytes=1 << 20, max_files=2, pattern="*.png"))
+    urls = []
+    for i in range(3):
+        urls.append(client.post("/api/image", json={"prompt": f"cover {i}"}).get_json()["url"])
+        time.sleep(0.01)  # distinct mtimes for LRU order
+    names = {p.name for p in (tmp_path / "q").glob("*.png")}
+    assert names == {os.path.basename(u) for u in urls[1:]}
+
+def test_image_jobs_batch_and_poll(client, monkeypatch):
+    import config, threading
+    gate = threading.Event()
+    real = config.client.images.generate
+    def slow(**k):
+        gate.wait(5)
+        return real(**k)
+    monkeypatch.setattr(config.client.images, "generate", staticmethod(slow))
+
+    r = client.post("/api/image/jobs", json={"prompts": ["cover A", {"prompt": "cover B", "quality": "high"}, "cover A"]})
+    assert r.status_code == 202
+    body = r.get_json()
+    ids = [j["id"] for j in body["jobs"]]
+    assert ids[0] == ids[2] and len(set(ids)) == 2       # identical prompts share one job
+    assert all(j["status"] in ("queued", "running") for j in body["jobs"])
+
+    gate.set()
+    manifest = client.get(f"/api/image/jobs?ids={ids[0]},{ids[1]}&wait=5").get_json()
+    while manifest["pending"]:
+        manifest = client.get(f"/api/image/jobs?ids={ids[0]},{ids[1]}&wait=5").get_json()
+    assert all(j["status"] == "done" and j["url"].startswith("/static/gen/") for j in manifest["jobs"])
+
+    one = client.get(f"/api/image/jobs/{ids[1]}").get_json()
+    assert one["url"] == manifest["jobs"][1]["url"]
+
+    # a later job for a cached image is done immediately
+    again = client.post("/api/image/jobs", json={"prompt": "cover A"}).get_json()["jobs"][0]
+    assert again["status"] == "done" and again["url"] == manifest["jobs"][0]["url"]
+
+def test_image_job_poll_wait_capped_for_wsgi(client, monkeypatch):
+    import config, routes_media, threading, time
+    gate = threading.Event()
+    monkeypatch.setattr(config.client.images, "generate", staticmethod(lambda **k: gate.wait(5)))
+    monkeypatch.setattr(routes_media, "IMG_JOB_MAX_WAIT_WSGI", 0.05)
+    job = client.post("/api/image/jobs", json={"prompt": "slow cover"}).get_json()["jobs"][0]
+    t0 = time.monotonic()
+    assert client.get(f"/api/image/jobs?ids={job['id']}&wait=30").get_json()["pending"] == 1
+    assert time.monotonic() - t0 < 2
+    gate.set()
+
+def test_image_jobs_errors(client, monkeypatch):
+    import config, routes_media
+    assert client.get("/api/image/jobs/nope").status_code == 404
+    too_many = {"prompts": [f"p{i}" for i in range(routes_media.MAX_JOBS_PER_REQUEST + 1)]}
+    assert client.post("/api/image/jobs", json=too_many).status_code == 400
+
+    def boom(**k): raise RuntimeError("upstream down")
+    monkeypatch.setattr(config.client.images, "generate", staticmethod(boom))
+    job = client.post("/api/image/jobs", json={"prompt": "broken"}).get_json()["jobs"][0]
+    job = client.get(f"/api/image/jobs/{job['id']}?wait=5").get_json()
+    assert job["status"] == "error" and job["error"] == "Image API failed."
+
+def _png(width, height=None):
+    import pytest
+    Image = pytest.importorskip("PIL.Image")
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height or width), (120, 40, 200)).save(buf, "PNG")
+    return buf.getvalue()
+
+def test_webp_derivatives_sizes():
+    import imaging
+    png = _png(600, 900)
+    out = imaging.webp_derivatives(png, [256, 512, 1024])
+    assert sorted(out) == [256, 512]             # never upscale
+    assert all(b[:4] == b"RIFF" and b[8:12] == b"WEBP" for b in out.values())
+    assert imaging.image_width(out[256]) == 256
+
+def test_image_job_returns_srcset_manifest(client, monkeypatch):
+    import base64, types, config, routes_media
+    b64 = base64.b64encode(_png(600)).decode()
+    monkeypatch.setattr(config.client.images, "generate",
+                        staticmethod(lambda **k: types.SimpleNamespace(data=[types.SimpleNamespace(b64_json=b64)])))
+
+    # the job is done once the PNG is stored, without waiting for its renditions
+    release = threading.Event()
+    write = routes_media._write_derivatives
+    monkeypatch.setattr(routes_media, "_write_derivatives", lambda key, data: release.wait(5) and write(key, data))
+    job = client.post("/api/image/jobs", json={"prompt": "big cover"}).get_json()["jobs"][0]
+    job = client.get(f"/api/image/jobs/{job['id']}?wait=5").get_json()
+    assert job["status"] == "done" and job["width"] == 600 and job["variants"] == []
+
+    # later polls list the renditions once they are encoded
+    release.set()
+    routes_media.wait_derivatives(job["id"])
+    job = client.get(f"/api/image/jobs/{job['id']}").get_json()
+    assert [v["width"] for v in job["variants"]] == [256, 512]
+    assert all(v["url"].endswith(".webp") and v["type"] == "image/webp" for v in job["variants"])
+    assert job["srcset"].endswith(f"{job['url']} 600w") and "256w" in job["srcset"]
+
+    # the synchronous route reports the same manifest on a cache hit
+    hit = client.post("/api/image", json={"prompt": "big cover"}).get_json()
+    assert hit["cached"] is True and hit["srcset"] == job["srcset"]
+
+    # evicted renditions are re-encoded in the background
+    for p in routes_media.derivative_cache.dir.glob("*.webp"):
+        p.unlink()
+    routes_media.image_manifest(job["id"])
+    routes_media.wait_derivatives(job["id"])
+    assert len(list(routes_media.derivative_cache.dir.glob("*.webp"))) == 2
@@ -0,0 +1,63 @@
+import importlib
+
+import selection
+
+
+def cands(*scores):
+    return [{"title": f"T{i}", "summary": "s" * 40, "score": s} for i, s in enumerate(scores)]
+
+def titles(out):
+    return [c["title"] for c in out]
+
+def test_relative_cutoff_and_elbow():
+    # 0.30 * 1.25 = 0.375 cuts T4; the jump after T2 (0.33 -> 0.45) is the elbow once min_k is met
+    out = selection.select_candidates(cands(0.30, 0.31, 0.33, 0.45, 0.50), min_k=2, max_k=8)
+    assert titles(out) == ["T0", "T1", "T2"]
+
+def test_min_and_max_k_bounds():
+    assert len(selection.select_candidates(cands(0.1, 0.9, 0.95), min_k=2, max_k=8)) == 2
+    assert len(selection.select_candidates(cands(*[0.5] * 30), min_k=1, max_k=5)) == 5
+
+def test_wide_requests_are_wider_but_bounded():
+    scores = [0.40 + 0.01 * i for i in range(40)]
+    narrow = selection.select_candidates(cands(*scores), min_k=3, max_k=8)
+    wide = selection.select_candidates(cands(*scores), min_k=3, max_k=8, wide=True, wide_max_k=20)
+    assert len(narrow) == 8 and len(wide) == 20
+
+def test_token_budget_and_lexical_only_hits():
+    many = cands(None, 0.2, 0.2, 0.2)
+    assert titles(selection.select_candidates(many, min_k=1, max_k=8)) == ["T0", "T1", "T2", "T3"]
+    per = selection.candidate_tokens(many[0])
+    assert len(selection.select_candidates(many, min_k=1, max_k=8, token_budget=2 * per)) == 2
+    assert len(selection.select_candidates(many, min_k=1, max_k=8, token_budget=1)) == 1
+
+def test_lexical_only_hits_capped_after_min_k():
+    mixed = cands(0.30, None, 0.31, None, None, 0.32)
+    assert titles(selection.select_candidates(mixed, min_k=2, max_k=8)) == ["T0", "T1", "T2", "T5"]
+    assert titles(selection.select_candidates(cands(None, None, None), min_k=1, max_k=8)) == ["T0", "T1", "T2"]
+
+def test_request_parsing():
+    assert selection.requested_count("Recommend 5 fantasy books") == 5
+    assert selection.requested_count("vreau trei cărți despre război") == 3
+    assert selection.requested_count("a book about war") is None
+    assert selection.wants_many("dă-mi toate cărțile despre dragoste")
+    assert selection.wants_many("show me more") and not selection.wants_many("a war novel")
+
+def test_prompt_candidates_do_not_scale_with_catalog(client, monkeypatch):
+    web = importlib.import_module("web")
+    seen = {}
+    def fake_retrieve(coll, q, k=10):
+        seen["k"] = k
+        return cands(*[0.3 + 0.001 * i for i in range(500)])
+    def fake_build(query, candidates):
+        seen["n"] = len(candidates)
+        return [{"role": "system", "content": "x"}, {"role": "user", "content": "y"}], []
+    monkeypatch.setattr(web, "collection", object())
+    monkeypatch.setattr(web, "lexical_index", None)
+    monkeypatch.setattr(web, "retrieve_candidates", fake_retrieve)
+    monkeypatch.setattr(web, "build_messages_and_tools", fake_build)
+
+    client.post("/chat", json={"message": "a sad war novel"})
+    assert seen["k"] == 2 * web.CANDIDATES_MAX_K and seen["n"] <= web.CANDIDATES_MAX_K
+    client.post("/chat", json={"message": "all war novels"})
+    assert seen["n"] == web.CANDIDATES_WIDE_MAX_K
@@ -0,0 +1,56 @@
+import random
+import string
+
+from titles import TitleIndex, title_keys
+
+CATALOG = ["1984", "The Hobbit", "Harry Potter and the Philosopher's Stone", "Pride and Prejudice",
+           "To Kill a Mockingbird", "Moby-Dick", "War and Peace", "Dune: Part One"]
+
+def test_title_keys_cover_article_and_subtitle():
+    assert title_keys("The Great Gatsby: A Novel") == ["the great gatsby a novel", "great gatsby a novel",
+                                                       "the great gatsby", "great gatsby"]
+
+def test_exact_prefix_and_fuzzy_lookups():
+    ix = TitleIndex(CATALOG)
+    assert ix.lookup("moby dick") == ("Moby-Dick", 1.0)
+    assert ix.resolve("Hobbit") == "The Hobbit"
+    assert ix.resolve("Dune") == "Dune: Part One"                     # dropped subtitle
+    assert ix.resolve("Harry Potter") == "Harry Potter and the Philosopher's Stone"
+    assert ix.resolve("the hobit") == "The Hobbit"                    # typo
+    assert ix.resolve("To Kill a Mocking bird") == "To Kill a Mockingbird"
+    assert ix.resolve("Lord of the Flies") is None
+    assert ix.resolve("") is None
+
+def test_threshold_controls_confidence():
+    ix = TitleIndex(CATALOG)
+    title, score = ix.lookup("War & Peace")
+    assert title == "War and Peace" and score < 1.0
+    assert ix.lookup("War & Peace", threshold=0.95) is None
+
+def test_fuzzy_lookup_among_many_titles():
+    rng = random.Random(7)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 8))) for _ in range(3000)]
+    noise = [" ".join(rng.choices(words, k=rng.randint(2, 5))).title() for _ in range(5000)]
+    ix = TitleIndex(noise + CATALOG)
+    assert len(ix) == len(noise) + len(CATALOG)
+    assert ix.resolve("Prid and Prejudise") == "Pride and Prejudice"
+    assert ix.resolve(noise[123][:-1]) == noise[123]
+
+def test_phrase_matcher_finds_mentions_on_word_boundaries():
+    from titles import PhraseMatcher, mention_keys
+    titles = CATALOG + ["The Road", "Peace"]
+    m = PhraseMatcher({k: t for t in titles for k in mention_keys(t)})
+    assert m.find("What is 1984 about?") == ["1984"]
+    assert m.find("the hobbit and War and Peace, then the hobbit again") == ["The Hobbit", "War and Peace"]
+    assert ("Peace" in [p for _, _, p in m.spans("war and peace")])     # suffix matches are reported too
+    assert m.find("harry potter and the philosophers stone") == ["Harry Potter and the Philosopher's Stone"]
+    assert m.find("on the road again") == ["The Road"] and m.find("a road trip") == []
+    assert m.find("warning: peaceful dunes") == []
+
+def test_title_mentions_need_cue_for_everyday_words():
+    from titles import TitleMentions
+    m = TitleMentions(CATALOG + ["Emma"], cues={"book", "novel"})
+    assert m.find("born in 1984, what is the weather") == []
+    assert m.find("is the book 1984 any good") == ["1984"]
+    assert m.find("emma wants the hobbit") == ["The Hobbit"]
+    assert m.find("the novel emma and the hobbit") == ["Emma", "The Hobbit"]
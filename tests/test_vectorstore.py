@@ -0,0 +1,89 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import rag
+import vectorstore
+
+
+AXES = {"love": [1.0, 0.0, 0.0], "war": [0.0, 1.0, 0.0], "sea": [0.0, 0.0, 1.0]}
+
+def fake_ef(texts):
+    """Each text is the sum of the axes of the words it mentions."""
+    out = []
+    for t in texts:
+        v = np.zeros(3)
+        for word, axis in AXES.items():
+            if word in t:
+                v += axis
+        out.append((v + 0.01).tolist())
+    return out
+
+def test_numpy_collection_query_persist_and_delete(tmp_path):
+    client = vectorstore.NumpyClient(tmp_path, dtype="float32")
+    coll = client.get_or_create_collection("books", embedding_function=fake_ef, metadata={"emb_model": "m"})
+    coll.upsert(ids=["a", "b", "c"], documents=["love", "war", "love war"],
+                metadatas=[{"title": "A"}, {"title": "B"}, {"title": "C"}])
+
+    res = coll.query(query_texts=["love", "sea war"], n_results=2)
+    assert res["ids"] == [["a", "c"], ["b", "c"]]
+    assert res["distances"][0][0] == pytest.approx(0.0, abs=1e-3)
+
+    again = vectorstore.NumpyClient(tmp_path).get_or_create_collection("books", embedding_function=fake_ef)
+    assert again.metadata == {"emb_model": "m"}
+    assert isinstance(again._vectors, np.memmap)
+    assert again.get(include=["metadatas"])["metadatas"][2] == {"title": "C"}
+
+    again.upsert(ids=["a"], documents=["sea"], metadatas=[{"title": "A2"}])
+    again.delete(ids=["b"])
+    res = again.query(query_texts=["sea"], n_results=5)
+    assert res["ids"] == [["a", "c"]] and res["metadatas"][0][0] == {"title": "A2"}
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_deferred_upserts_write_once(tmp_path, monkeypatch, dtype):
+    coll = vectorstore.NumpyClient(tmp_path, dtype=dtype).get_or_create_collection("books", embedding_function=fake_ef)
+    writes = []
+    real_save = vectorstore._save
+    monkeypatch.setattr(vectorstore, "_save", lambda path, arr: writes.append(path.name) or real_save(path, arr))
+
+    with coll.deferred():
+        coll.upsert(ids=["a", "b"], documents=["love", "war"])
+        coll.upsert(ids=["c", "a"], documents=["sea", "sea war"])
+        assert coll.query(query_texts=["sea"], n_results=1)["ids"] == [["c"]]
+        coll.delete(ids=["b"])
+        assert not any(name == "vectors.npy" for name in writes)
+    assert writes.count("vectors.npy") == 1
+
+    again = vectorstore.NumpyClient(tmp_path, dtype=dtype).get_or_create_collection("books", embedding_function=fake_ef)
+    assert again.get()["ids"] == ["a", "c"]
+    assert again.query(query_texts=["war"], n_results=1)["ids"] == [["a"]]
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_quantized_rows_keep_ranking(tmp_path, dtype):
+    rng = np.random.default_rng(0)
+    vecs = {f"d{i}": rng.standard_normal(64).tolist() for i in range(200)}
+    ef = lambda texts: [vecs.get(t, vecs["d7"]) for t in texts]
+    exact = vectorstore.NumpyClient(tmp_path / "f32").get_or_create_collection("x", embedding_function=ef)
+    small = vectorstore.NumpyClient(tmp_path / dtype, dtype=dtype).get_or_create_collection("x", embedding_function=ef)
+    for coll in (exact, small):
+        coll.upsert(ids=list(vecs), documents=list(vecs))
+
+    a = exact.query(query_texts=["d7"], n_results=5)
+    b = small.query(query_texts=["d7"], n_results=5)
+    assert b["ids"][0][0] == "d7" == a["ids"][0][0]
+    assert b["distances"][0] == pytest.approx(a["distances"][0], abs=0.02)
+
+def test_build_vector_store_on_numpy_backend(monkeypatch, tmp_path):
+    monkeypatch.setattr(rag, "VECTOR_BACKEND", "numpy")
+    monkeypatch.setattr(rag, "VECTOR_INDEX_DIR", tmp_path)
+    monkeypatch.setattr(rag, "llm_expand_theme_vocab", lambda themes, per_theme_max=3: {})
+    monkeypatch.setattr(rag.embedding_functions, "OpenAIEmbeddingFunction", lambda **k: fake_ef)
+    rag.embedding_cache.clear()
+
+    books = [
+        {"title": "Love Story", "summary": "love", "themes": ["romance"]},
+        {"title": "War Story", "summary": "war", "themes": ["history"]},
+    ]
+    coll = rag.build_vector_store(books)
+    assert [c["title"] for c in rag.retrieve_candidates(coll, "war", k=2)] == ["War Story", "Love Story"]
+    assert rag.build_vector_store(books).count() == 2
@@ -20,3 +20,179 @@ def test_chat_blocked_by_safety(client, monkeypatch):
     r = client.post("/chat", json={"message": "injurii"})
     assert r.status_code == 200
     assert r.get_json()["reply"].lower().startswith("please rephrase")
+
+def test_stats_reports_cache_counters(client):
+    r = client.get("/stats")
+    assert r.status_code == 200
+    assert {"hits", "misses", "hit_rate"} <= set(r.get_json()["query_expansion_cache"])
+
+def test_chat_block_discards_expansion(client, monkeypatch):
+    web = importlib.import_module("web")
+    monkeypatch.setattr(web, "llm_expand_query", lambda q, max_terms=10: ["kw"])
+    monkeypatch.setattr(web, "retrieve_candidates",
+        lambda coll, q, k=10: (_ for _ in ()).throw(AssertionError("retrieval after block")))
+    monkeypatch.setattr(web, "safety_check", lambda text, context_hint="": (False, "blocked"))
+    r = client.post("/chat", json={"message": "injurii"})
+    assert r.get_json()["reply"].lower().startswith("please rephrase")
+
+def test_chat_local_greeting_skips_gate(client, monkeypatch):
+    web = importlib.import_module("web")
+    monkeypatch.setattr(web, "intent_gate",
+        lambda t: (_ for _ in ()).throw(AssertionError("gate model called")))
+    r = client.post("/chat", json={"message": "hello"})
+    assert r.get_json()["reply"] == importlib.import_module("helpers").GREET_REPLY
+
+def test_chat_response_cache_hit(client, monkeypatch):
+    web = importlib.import_module("web")
+    monkeypatch.setattr(web, "response_cache", web.TTLCache(maxsize=8))
+    r1 = client.post("/chat", json={"message": "Books about love"})
+    assert r1.get_json()["cached"] is False
+
+    monkeypatch.setattr(web, "retrieve_candidates",
+        lambda coll, q, k=10: (_ for _ in ()).throw(AssertionError("pipeline re-run")))
+    r2 = client.post("/chat", json={"message": "books about LOVE!"})
+    j = r2.get_json()
+    assert j["cached"] is True and j["reply"] == r1.get_json()["reply"]
+
+def test_chat_response_cache_skips_blocked(client, monkeypatch):
+    web = importlib.import_module("web")
+    monkeypatch.setattr(web, "response_cache", web.TTLCache(maxsize=8))
+    monkeypatch.setattr(web, "safety_check", lambda text, context_hint="": (False, "blocked"))
+    client.post("/chat", json={"message": "injurii"})
+    assert web.response_cache.stats()["size"] == 0
+
+def test_chat_response_cache_keeps_non_latin_and_emoji_apart(client, monkeypatch):
+    web = importlib.import_module("web")
+    monkeypatch.setattr(web, "response_cache", web.TTLCache(maxsize=8))
+    assert client.post("/chat", json={"message": "книги о любви"}).get_json()["cached"] is False
+    assert client.post("/chat", json={"message": "ты идиот"}).get_json().get("cached") is not True
+    client.post("/chat", json={"message": "books about love"})
+    assert client.post("/chat", json={"message": "books about love 🖕"}).get_json().get("cached") is not True
+
+def test_chat_response_cache_hit_still_checked(client, monkeypatch):
+    web = importlib.import_module("web")
+    monkeypatch.setattr(web, "response_cache", web.TTLCache(maxsize=8))
+    client.post("/chat", json={"message": "Books about love"})
+    monkeypatch.setattr(web, "safety_check", lambda text, context_hint="": (False, "blocked"))
+    j = client.post("/chat", json={"message": "Books about love"}).get_json()
+    assert "cached" not in j and j["reply"].lower().startswith("please rephrase")
+
+def _sse_events(body):
+    import json
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+def test_chat_stream_emits_deltas_then_done(client, monkeypatch):
+    import types
+    config = importlib.import_module("config")
+    tool_call = types.SimpleNamespace(
+        id="t1", type="function",
+        function=types.SimpleNamespace(name="get_summaries_by_titles", arguments='{"titles": ["A"]}'),
+    )
+    def fake_create(**kwargs):
+        if kwargs.get("stream"):
+            pieces = ["**A**\nSumm", "ary:\nEXT", " A\n"]
+            return iter(types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=p))])
+                        for p in pieces)
+        msg = types.SimpleNamespace(content="", tool_calls=[tool_call])
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=msg)])
+    monkeypatch.setattr(config.client.chat.completions, "create", staticmethod(fake_create))
+
+    r = client.post("/chat/stream", json={"message": "carti despre dragoste"})
+    assert r.status_code == 200 and r.mimetype == "text/event-stream"
+    events = _sse_events(r.get_data(as_text=True))
+    deltas = "".join(d["text"] for e, d in events if e == "delta")
+    assert events[-1] == ("done", {"reply": "**A**\nEXT A", "cached": False})
+    assert deltas == "**A**\nEXT A" and len(events) > 2
+
+def test_chat_stream_short_circuit(client, monkeypatch):
+    web = importlib.import_module("web")
+    monkeypatch.setattr(web, "safety_check", lambda text, context_hint="": (False, "blocked"))
+    events = _sse_events(client.post("/chat/stream", json={"message": "injurii"}).get_data(as_text=True))
+    assert events[-1][0] == "done"
+    assert events[-1][1]["reply"].lower().startswith("please rephrase")
+
+def test_chat_server_rendered_reply_uses_one_call(client, monkeypatch):
+    import json, types
+    config = importlib.import_module("config")
+    calls = []
+    args = {"books": [{"title": "a", "reasons": ["tender", "short"]},
+                      {"title": "Nope", "reasons": ["invented"]},
+                      {"title": "B", "reasons": []}]}
+    tool_call = types.SimpleNamespace(
+        id="t1", type="function",
+        function=types.SimpleNamespace(name="recommend_books", arguments=json.dumps(args)),
+    )
+    def fake_create(**kwargs):
+        calls.append(kwargs)
+        msg = types.SimpleNamespace(content="", tool_calls=[tool_call])
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=msg)])
+    monkeypatch.setattr(config.client.chat.completions, "create", staticmethod(fake_create))
+
+    r = client.post("/chat", json={"message": "carti despre dragoste"})
+    assert len(calls) == 1
+    assert r.get_json()["reply"] == "**A**\nWhy this book?\n- tender\n- short\nEXT A\n**B**\nEXT B"
+
+def _title_catalog(monkeypatch, web):
+    helpers = importlib.import_module("helpers")
+    catalog = [{"title": "The Hobbit"}, {"title": "1984"}]
+    monkeypatch.setattr(web, "title_matcher", helpers.title_mentions_factory(catalog))
+    monkeypatch.setattr(web, "small_summaries", {"The Hobbit": "short", "1984": "short"})
+    ext = {"The Hobbit": "EXT HOBBIT", "1984": "EXT 1984"}
+    monkeypatch.setattr(web, "get_summary_by_title_local", lambda t: ext.get(t, "NOT_FOUND"))
+    monkeypatch.setattr(web, "retrieve_candidates",
+        lambda coll, q, k=10: (_ for _ in ()).throw(AssertionError("vector retrieval on a title mention")))
+    monkeypatch.setattr(web, "llm_expand_query",
+        lambda q, max_terms=10: (_ for _ in ()).throw(AssertionError("expansion on a title mention")))
+
+def test_chat_title_about_answered_without_model(client, monkeypatch):
+    config = importlib.import_module("config")
+    web = importlib.import_module("web")
+    _title_catalog(monkeypatch, web)
+    monkeypatch.setattr(config.client.chat.completions, "create",
+        staticmethod(lambda **k: (_ for _ in ()).throw(AssertionError("chat model called"))))
+    r = client.post("/chat", json={"message": "What is the Hobbit about?"})
+    assert r.get_json()["reply"] == "**The Hobbit**\nEXT HOBBIT"
+    assert web.title_fast_path_stats()["direct"] >= 1
+
+def test_chat_blocked_title_mention_not_counted(client, monkeypatch):
+    web = importlib.import_module("web")
+    _title_catalog(monkeypatch, web)
+    monkeypatch.setattr(web, "safety_check", lambda text, context_hint="": (False, "blocked"))
+    before = web.title_fast_path_stats()
+    r = client.post("/chat", json={"message": "What is the Hobbit about, idiot?"})
+    assert r.get_json()["reply"].lower().startswith("please rephrase")
+    assert web.title_fast_path_stats() == before
+
+def test_numeric_title_needs_a_book_cue(client, monkeypatch):
+    web = importlib.import_module("web")
+    _title_catalog(monkeypatch, web)
+    assert web._title_fast_path("I was born in 1984, what is the weather") is None
+    assert web._title_fast_path("what is the novel 1984 about?")[0] == {"reply": "**1984**\nEXT 1984"}
+    local = importlib.import_module("helpers").local_intent_factory([{"title": "1984", "themes": []}])
+    assert local("I was born in 1984, what is the weather") is None
+
+def test_chat_title_mention_uses_tiny_candidate_set(client, monkeypatch):
+    web = importlib.import_module("web")
+    _title_catalog(monkeypatch, web)
+    seen = {}
+    def fake_build(query, candidates):
+        seen["titles"] = [c["title"] for c in candidates]
+        return [{"role": "system", "content": "x"}, {"role": "user", "content": "y"}], []
+    monkeypatch.setattr(web, "build_messages_and_tools", fake_build)
+    client.post("/chat", json={"message": "should I read The Hobbit next?"})
+    assert seen["titles"] == ["The Hobbit"]
+
+def test_chat_books_like_title_takes_full_retrieval(client, monkeypatch):
+    web = importlib.import_module("web")
+    _title_catalog(monkeypatch, web)
+    monkeypatch.setattr(web, "llm_expand_query", lambda q, max_terms=10: [])
+    monkeypatch.setattr(web, "collection", object())
+    calls = []
+    monkeypatch.setattr(web, "retrieve_candidates",
+        lambda coll, q, k=10: calls.append(q) or [{"title": "A", "summary": "aaa", "score": 0.1}])
+    client.post("/chat", json={"message": "books similar to the hobbit"})
+    assert calls
@@ -0,0 +1,270 @@
+"""
+Title lookup that tolerates the small variations models produce: a dropped subtitle,
+a missing leading article, casing/diacritics, or a typo.
+
+TitleIndex resolves a string to a catalog title in three steps:
+  1. exact match on precomputed normalized keys (full title, title without a leading
+     article, main title without its subtitle),
+  2. prefix match at word boundaries in either direction,
+  3. character-trigram Dice similarity over an inverted trigram index: a prefix filter on
+     the query's rarest trigrams picks a few candidates, which are then scored exactly.
+A match is returned only when its score reaches the threshold.
+
+PhraseMatcher finds explicit title (or theme) mentions in a user message in one pass;
+TitleMentions builds on it and ignores titles that are also everyday words ("1984", "Emma")
+unless the message talks about books.
+"""
+
+from __future__ import annotations
+
+import bisect
+import math
+import re
+from collections import Counter, deque
+from operator import itemgetter
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from rag import normalize_text
+
+_ARTICLES = ("the ", "a ", "an ")
+_SUBTITLE = re.compile(r"\s*(?::|\s-\s|\s—\s|\(|\[).*$")
+_MIN_MENTION_CHARS = 4
+_FUZZY_VERIFY = 32  # candidates (most hits on the rarest query trigrams) scored exactly
+
+
+def title_keys(title: str) -> List[str]:
+    """Normalized lookup keys for a title: full form, without leading article, without subtitle."""
+    keys = []
+    for form in (title, _SUBTITLE.sub("", title)):
+        key = normalize_text(form)
+        if not key:
+            continue
+        keys.append(key)
+        for art in _ARTICLES:
+            if key.startswith(art) and len(key) > len(art):
+                keys.append(key[len(art):])
+    return list(dict.fromkeys(keys))
+
+
+def trigrams(key: str) -> FrozenSet[str]:
+    padded = f"  {key} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class TitleIndex:
+    """Immutable after construction, so lookups are safe from any thread."""
+
+    def __init__(self, titles: List[str], threshold: float = 0.6):
+        self.threshold = threshold
+        self.titles: List[str] = []
+        self._by_key: Dict[str, int] = {}
+        self._grams: List[FrozenSet[str]] = []
+        self._postings: Dict[str, List[int]] = {}
+
+        for title in titles:
+            keys = title_keys(title)
+            if not keys:
+                continue
+            i = len(self.titles)
+            self.titles.append(title)
+            for key in keys:
+                self._by_key.setdefault(key, i)
+            grams = trigrams(keys[0])
+            self._grams.append(grams)
+            for g in grams:
+                self._postings.setdefault(g, []).append(i)
+
+        self._sorted_keys: List[str] = sorted(self._by_key)
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def _exact(self, keys: List[str]) -> Optional[int]:
+        for key in keys:
+            i = self._by_key.get(key)
+            if i is not None:
+                return i
+        return None
+
+    def _prefix(self, key: str) -> Optional[Tuple[int, float]]:
+        """A title that is a word-boundary prefix of `key`, or the single title that extends it."""
+        words = key.split()
+        for n in range(len(words) - 1, 0, -1):  # longest known title the query starts with
+            head = " ".join(words[:n])
+            i = self._by_key.get(head)
+            if i is not None:
+                return i, 0.5 + 0.5 * len(head) / len(key)
+
+        lo = bisect.bisect_left(self._sorted_keys, key + " ")
+        hi = bisect.bisect_left(self._sorted_keys, key + "!")  # '!' sorts right after ' '
+        if not 0 < hi - lo <= 4:  # a title has at most 4 keys; more means several titles
+            return None
+        owners = {self._by_key[k] for k in self._sorted_keys[lo:hi]}
+        if len(owners) == 1:
+            i = owners.pop()
+            longest = max(len(k) for k in self._sorted_keys[lo:hi])
+            return i, 0.5 + 0.5 * len(key) / longest
+        return None
+
+    def _fuzzy(self, key: str, threshold: float) -> Optional[Tuple[int, float]]:
+        q = trigrams(key)
+        if not q or threshold <= 0:
+            return None
+        # Dice >= t needs at least t*|q|/(2-t) shared grams, so every match contains one of
+        # the (|q| - that + 1) rarest query grams. Counting hits over those postings happens
+        # in C; only the titles with the most hits are then scored exactly.
+        postings = sorted((self._postings[g] for g in q if g in self._postings), key=len)
+        min_overlap = threshold * len(q) / (2 - threshold)
+        if len(postings) < min_overlap:
+            return None
+        shared: Counter = Counter()
+        for posting in postings[: len(q) - math.ceil(min_overlap) + 1]:
+            shared.update(posting)
+        top = sorted(shared.items(), key=itemgetter(1), reverse=True)[:_FUZZY_VERIFY]
+
+        best: Optional[Tuple[int, float]] = None
+        for i, _hits in top:
+            grams = self._grams[i]
+            score = 2 * len(q & grams) / (len(q) + len(grams))
+            if score >= threshold and (best is None or score > best[1]):
+                best = (i, score)
+        return best
+
+    def lookup(self, text: str, threshold: Optional[float] = None) -> Optional[Tuple[str, float]]:
+        """(catalog title, confidence in 0..1) or None when nothing reaches the threshold."""
+        threshold = self.threshold if threshold is None else threshold
+        keys = title_keys(text or "")
+        if not keys:
+            return None
+        i = self._exact(keys)
+        if i is not None:
+            return self.titles[i], 1.0
+
+        hits = [h for h in (self._prefix(keys[0]), self._fuzzy(keys[0], threshold)) if h]
+        if not hits:
+            return None
+        i, score = max(hits, key=lambda h: h[1])
+        return (self.titles[i], round(score, 4)) if score >= threshold else None
+
+    def resolve(self, text: str, threshold: Optional[float] = None) -> Optional[str]:
+        hit = self.lookup(text, threshold)
+        return hit[0] if hit else None
+
+
+def mention_keys(title: str) -> List[str]:
+    """
+    Keys that count as an explicit mention of `title` in free text. Article-less forms must
+    still look like a title (several words or 6+ characters), so "The Road" is not matched by "road".
+    """
+    full = title_keys(title)
+    out = []
+    for key in full:
+        if len(key) < _MIN_MENTION_CHARS:
+            continue
+        stripped = any(f"{art}{key}" in full for art in _ARTICLES)
+        if stripped and " " not in key and len(key) < 6:
+            continue
+        out.append(key)
+        possessive = re.sub(r"(\w) s\b", r"\1s", key)  # "philosopher s stone" -> "philosophers stone"
+        if possessive != key:
+            out.append(possessive)
+    return out
+
+
+class PhraseMatcher:
+    """
+    Aho-Corasick automaton over token sequences: finds every known phrase in one pass over
+    the normalized text, whatever the number of phrases. Phrases match whole words only.
+    """
+
+    def __init__(self, phrases: Dict[str, Any]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Optional[Tuple[int, Any]]] = [None]  # (phrase length in tokens, payload)
+        self._link: List[int] = [0]  # nearest proper suffix state with an output
+        for phrase, payload in phrases.items():
+            tokens = normalize_text(phrase).split()
+            if not tokens:
+                continue
+            state = 0
+            for tok in tokens:
+                nxt = self._goto[state].get(tok)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][tok] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(None)
+                    self._link.append(0)
+                state = nxt
+            if self._out[state] is None:
+                self._out[state] = (len(tokens), payload)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for tok, nxt in self._goto[state].items():
+                f = self._fail[state]
+                while f and tok not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(tok, 0)
+                fs = self._fail[nxt]
+                self._link[nxt] = fs if self._out[fs] is not None else self._link[fs]
+                queue.append(nxt)
+
+    def __bool__(self) -> bool:
+        return len(self._goto) > 1
+
+    def spans(self, text: str) -> List[Tuple[int, int, Any]]:
+        """Every (start token, end token, payload) occurrence, overlapping ones included."""
+        found = []
+        state = 0
+        for j, tok in enumerate(normalize_text(text or "").split()):
+            while state and tok not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(tok, 0)
+            s = state if self._out[state] is not None else self._link[state]
+            while s:
+                n, payload = self._out[s]
+                found.append((j - n + 1, j + 1, payload))
+                s = self._link[s]
+        return found
+
+    def find(self, text: str) -> List[Any]:
+        """Payloads of the leftmost-longest non-overlapping matches, in order, without repeats."""
+        out, end = [], 0
+        for start, stop, payload in sorted(self.spans(text), key=lambda m: (m[0], m[0] - m[1])):
+            if start < end:
+                continue
+            end = stop
+            if payload not in out:
+                out.append(payload)
+        return out
+
+
+def is_weak_mention(key: str) -> bool:
+    """A one-word key that is numeric or short ("1984", "emma") also occurs as an ordinary word."""
+    return " " not in key and (key.isdigit() or len(key) < 6)
+
+
+class TitleMentions:
+    """
+    Catalog titles named in a message, leftmost first. Matches on weak keys (see is_weak_mention)
+    count only when the message also contains one of `cues` ("book", "novel", ...), so
+    "I was born in 1984" is not a question about the novel.
+    """
+
+    def __init__(self, titles: Iterable[str], cues: Iterable[str] = ()):
+        self._cues = frozenset(cues)
+        self._matcher = PhraseMatcher({
+            key: (title, is_weak_mention(key)) for title in titles for key in mention_keys(title)
+        })
+
+    def __bool__(self) -> bool:
+        return bool(self._matcher)
+
+    def find(self, text: str) -> List[str]:
+        hits = self._matcher.find(text)
+        if any(weak for _t, weak in hits) and not self._cues.intersection(normalize_text(text or "").split()):
+            hits = [h for h in hits if not h[1]]
+        return list(dict.fromkeys(title for title, _weak in hits))
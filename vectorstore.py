@@ -0,0 +1,285 @@
+"""
+In-process vector index: a drop-in for the slice of the Chroma client/collection API that
+rag.build_vector_store and rag.retrieve_candidates use (get_or_create_collection,
+get/upsert/delete/query).
+
+Each collection is a directory holding the L2-normalized embedding matrix as `.npy`
+(opened memory-mapped) plus a JSON sidecar with ids, documents and metadata. Queries are
+one cosine matmul for the whole batch of query texts and an argpartition top-k; distances
+are reported as cosine distances (1 - similarity), like Chroma's "hnsw:space": "cosine".
+
+Rows can be stored as float32, float16, or int8 with one scale per row. Every upsert/delete
+rewrites the files; wrap a bulk sync in `with collection.deferred():` to write them once.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np  # optional unless VECTOR_BACKEND=numpy
+except ImportError:
+    np = None
+
+DTYPES = ("float32", "float16", "int8")
+_BLOCK = 8192  # rows de-quantized at a time while scoring
+
+
+def _normalize(m):
+    m = np.asarray(m, dtype=np.float32)
+    if m.ndim == 1:
+        m = m[None, :]
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    return m / np.where(norms == 0, 1.0, norms)
+
+
+def quantize(m, dtype: str):
+    """(stored rows, per-row scales or None) for normalized float32 rows."""
+    if dtype == "int8":
+        scales = np.abs(m).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(m / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return m.astype(dtype), None
+
+
+def _save(path: Path, arr) -> None:
+    tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
+class NumpyCollection:
+    def __init__(self, directory: Path, embedding_function, metadata: Optional[Dict], dtype: str):
+        self.dir = Path(directory)
+        self._ef = embedding_function
+        self.dtype = dtype
+        self.metadata = dict(metadata or {})
+        self._ids: List[str] = []
+        self._documents: List[str] = []
+        self._metadatas: List[Dict] = []
+        self._vectors = None  # (n, dim) in self.dtype, memory-mapped once persisted
+        self._scales = None   # (n,) float32 for int8 rows
+        self._pending: List[tuple] = []  # (rows, scales) appended since the matrix was last built
+        self._defer = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    # ---- persistence ----
+    @property
+    def _sidecar(self) -> Path:
+        return self.dir / "collection.json"
+
+    @classmethod
+    def load(cls, directory: Path, embedding_function) -> Optional["NumpyCollection"]:
+        try:
+            info = json.loads((Path(directory) / "collection.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        coll = cls(directory, embedding_function, info.get("metadata"), info.get("dtype", "float32"))
+        coll._ids = list(info.get("ids") or [])
+        coll._documents = list(info.get("documents") or [])
+        coll._metadatas = list(info.get("metadatas") or [])
+        if coll._ids:
+            coll._vectors = np.load(coll.dir / "vectors.npy", mmap_mode="r")
+            if coll.dtype == "int8":
+                coll._scales = np.load(coll.dir / "scales.npy")
+        return coll
+
+    def _flush_pending(self) -> None:
+        """Fold appended rows into the matrix with one concatenate."""
+        if not self._pending:
+            return
+        parts = ([] if self._vectors is None else [self._vectors]) + [rows for rows, _ in self._pending]
+        self._vectors = np.concatenate(parts)
+        if self.dtype == "int8":
+            parts = ([] if self._scales is None else [self._scales]) + [sc for _, sc in self._pending]
+            self._scales = np.concatenate(parts)
+        self._pending = []
+
+    def _writable(self) -> None:
+        self._flush_pending()
+        if isinstance(self._vectors, np.memmap):
+            self._vectors = np.array(self._vectors)
+
+    def _changed(self) -> None:
+        if self._defer:
+            self._dirty = True
+        else:
+            self._persist()
+
+    @contextmanager
+    def deferred(self):
+        """Hold back writes from upsert/delete inside the block and persist once at the end."""
+        with self._lock:
+            self._defer += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._defer -= 1
+                if not self._defer and self._dirty:
+                    self._persist()
+
+    def _persist(self) -> None:
+        self._flush_pending()
+        self._dirty = False
+        self.dir.mkdir(parents=True, exist_ok=True)
+        if self._ids:
+            _save(self.dir / "vectors.npy", self._vectors)
+            if self._scales is not None:
+                _save(self.dir / "scales.npy", self._scales)
+            self._vectors = np.load(self.dir / "vectors.npy", mmap_mode="r")
+        else:
+            self._vectors = self._scales = None
+        info = {
+            "metadata": self.metadata,
+            "dtype": self.dtype,
+            "ids": self._ids,
+            "documents": self._documents,
+            "metadatas": self._metadatas,
+        }
+        tmp = self._sidecar.with_name(f".{self._sidecar.name}.tmp")
+        tmp.write_text(json.dumps(info, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self._sidecar)
+
+    # ---- Chroma-compatible surface ----
+    def count(self) -> int:
+        return len(self._ids)
+
+    def get(self, ids: Optional[List[str]] = None, include: Optional[List[str]] = None) -> Dict:
+        include = include or ["documents", "metadatas"]
+        wanted = None if ids is None else set(ids)
+        rows = [i for i, x in enumerate(self._ids) if wanted is None or x in wanted]
+        out: Dict = {"ids": [self._ids[i] for i in rows]}
+        if "documents" in include:
+            out["documents"] = [self._documents[i] for i in rows]
+        if "metadatas" in include:
+            out["metadatas"] = [self._metadatas[i] for i in rows]
+        return out
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: Optional[List[Dict]] = None) -> None:
+        if not ids:
+            return
+        metadatas = metadatas or [{} for _ in ids]
+        stored, scales = quantize(_normalize(self._ef(list(documents))), self.dtype)
+        with self._lock:
+            pos = {x: i for i, x in enumerate(self._ids)}
+            fresh, updates = [], []
+            for j, (id_, doc, meta) in enumerate(zip(ids, documents, metadatas)):
+                i = pos.get(id_)
+                if i is None:
+                    pos[id_] = len(self._ids)
+                    fresh.append(j)
+                    self._ids.append(id_)
+                    self._documents.append(doc)
+                    self._metadatas.append(meta)
+                    continue
+                updates.append((i, j))
+                self._documents[i] = doc
+                self._metadatas[i] = meta
+            if fresh:
+                self._pending.append((stored[fresh], None if scales is None else scales[fresh]))
+            if updates:
+                self._writable()
+                rows, src = zip(*updates)
+                self._vectors[list(rows)] = stored[list(src)]
+                if scales is not None:
+                    self._scales[list(rows)] = scales[list(src)]
+            self._changed()
+
+    def delete(self, ids: List[str]) -> None:
+        drop = set(ids or [])
+        with self._lock:
+            keep = [i for i, x in enumerate(self._ids) if x not in drop]
+            if len(keep) == len(self._ids):
+                return
+            self._flush_pending()
+            self._ids = [self._ids[i] for i in keep]
+            self._documents = [self._documents[i] for i in keep]
+            self._metadatas = [self._metadatas[i] for i in keep]
+            if keep:
+                self._vectors = np.array(self._vectors[keep])
+                if self._scales is not None:
+                    self._scales = self._scales[keep]
+            else:
+                self._vectors = self._scales = None
+            self._changed()
+
+    def _similarities(self, queries):
+        """(n_queries, n_rows) cosine similarities; quantized rows are widened a block at a time."""
+        if self._pending:  # rows upserted inside a deferred() block
+            with self._lock:
+                self._flush_pending()
+        vectors, scales = self._vectors, self._scales
+        if vectors.dtype == np.float32:
+            return queries @ vectors.T
+        sims = np.empty((len(queries), len(vectors)), dtype=np.float32)
+        for start in range(0, len(vectors), _BLOCK):
+            block = vectors[start:start + _BLOCK].astype(np.float32)
+            sims[:, start:start + _BLOCK] = queries @ block.T
+        if scales is not None:
+            sims *= scales[None, :]
+        return sims
+
+    def query(self, query_texts: List[str], n_results: int = 10,
+              include: Optional[List[str]] = None, **_ignored) -> Dict:
+        include = include or ["documents", "metadatas", "distances"]
+        n_q = len(query_texts)
+        n = len(self._ids)
+        k = min(max(0, int(n_results)), n)
+        out: Dict = {"ids": [[] for _ in range(n_q)]}
+        for field in ("documents", "metadatas", "distances"):
+            if field in include:
+                out[field] = [[] for _ in range(n_q)]
+        if not k or not n_q:
+            return out
+
+        sims = self._similarities(_normalize(self._ef(list(query_texts))))
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k] if k < n else np.tile(np.arange(n), (n_q, 1))
+        order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+
+        for q, rows in enumerate(top.tolist()):
+            out["ids"][q] = [self._ids[i] for i in rows]
+            if "documents" in out:
+                out["documents"][q] = [self._documents[i] for i in rows]
+            if "metadatas" in out:
+                out["metadatas"][q] = [self._metadatas[i] for i in rows]
+            if "distances" in out:
+                out["distances"][q] = [float(1.0 - sims[q, i]) for i in rows]
+        return out
+
+
+class NumpyClient:
+    """Stands in for chromadb.PersistentClient; one sub-directory per collection under `path`."""
+
+    def __init__(self, path: str | os.PathLike, dtype: str = "float32"):
+        if np is None:
+            raise RuntimeError("VECTOR_BACKEND=numpy needs numpy (`pip install numpy`).")
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported vector dtype {dtype!r}; expected one of {DTYPES}.")
+        self.path = Path(path)
+        self.dtype = dtype
+
+    def get_or_create_collection(self, name: str, embedding_function=None, metadata: Optional[Dict] = None):
+        coll = NumpyCollection.load(self.path / name, embedding_function)
+        if coll is not None and coll.dtype == self.dtype:
+            return coll
+        # a different storage dtype cannot be converted losslessly: start over
+        return self.create_collection(name, embedding_function, metadata)
+
+    def create_collection(self, name: str, embedding_function=None, metadata: Optional[Dict] = None):
+        self.delete_collection(name)
+        coll = NumpyCollection(self.path / name, embedding_function, metadata, self.dtype)
+        coll._persist()
+        return coll
+
+    def delete_collection(self, name: str) -> None:
+        shutil.rmtree(self.path / name, ignore_errors=True)
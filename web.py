@@ -1,24 +1,66 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 import json
 import logging
+import threading
+from collections import Counter
+from typing import Optional
 
-from config import CHAT_MODEL, BOOKS_PATH, BOOKS_EXT_PATH, client
+from config import (
+    CHAT_MODEL,
+    GATE_MODEL,
+    EMB_MODEL,
+    BOOKS_PATH,
+    BOOKS_EXT_PATH,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_DB,
+    RETRIEVAL_MODE,
+    LEXICAL_SKIP_EXPANSION,
+    CANDIDATES_MIN_K,
+    CANDIDATES_MAX_K,
+    CANDIDATES_WIDE_MAX_K,
+    CANDIDATES_REL_CUTOFF,
+    CANDIDATES_GAP,
+    CANDIDATES_TOKEN_BUDGET,
+    TITLE_MATCH_THRESHOLD,
+    client,
+)
+from cache import DiskStore, TTLCache, make_key
 from rag import (
     load_books,
     load_books_ext,
     build_vector_store,
     llm_expand_query,
     retrieve_candidates,
+    query_expansion_cache,
+    embedding_cache,
+    catalog_version,
+    cache_text,
+    normalize_text,
+    stored_theme_vocab,
 )
-from prompts import build_messages_and_tools
+from lexical import BM25Index, rrf_fuse
+from selection import requested_count, select_candidates, wants_many
+from titles import TitleIndex
+from prompts import build_messages_and_tools, prompt_stats
 from helpers import (
     get_summary_by_title_local_factory,
+    local_intent_factory,
+    intent_path_stats,
+    moderation_cache,
     intent_gate,
     clean_reply,
+    ReplyCleaner,
     parse_json_loose,
-    safety_check,   
+    render_recommendations,
+    safety_check,
+    title_question_kind,
+    title_mentions_factory,
+    prefetched_moderation,
+    submit_upstream,
 )
-from routes_media import media_bp
+import routes_media
+from routes_media import media_bp, stt_stats
 
 # ---------- logging ----------
 logging.basicConfig(level=logging.INFO)
@@ -47,57 +89,292 @@ print("Loading databases…")
 books_small = load_books(BOOKS_PATH)
 books_ext = load_books_ext(BOOKS_EXT_PATH)
 
-print("Building Chroma vector store…")
+print("Building vector store…")
 try:
     collection = build_vector_store(books_small)
 except Exception:
-    logger.exception("Chroma vector store build failed")
+    logger.exception("Vector store build failed")
     collection = None  
 
 get_summary_by_title_local = get_summary_by_title_local_factory(books_ext, books_small)
+title_index = TitleIndex([b["title"] for b in books_small], threshold=TITLE_MATCH_THRESHOLD)
+# explicit title mentions (Aho-Corasick over normalized titles) skip expansion and vector retrieval
+title_matcher = title_mentions_factory(books_small)
+small_summaries = {b["title"]: b.get("summary", "") for b in books_small}
+local_intent = local_intent_factory(books_small)
+
+# BM25 over title/themes/synonyms/summary; synonyms come from the theme vocab store filled by the build
+lexical_index = None
+if RETRIEVAL_MODE == "hybrid":
+    lexical_index = BM25Index(
+        books_small,
+        stored_theme_vocab(sorted({str(t) for b in books_small for t in b.get("themes", [])})),
+    )
+
+# ---------- response cache ----------
+# Keys carry the catalog version, so entries from an older books.json/books_ext.json
+# (including ones in a shared RESPONSE_CACHE_DB) are never served after the catalog changes.
+CATALOG_VERSION = catalog_version(BOOKS_PATH, BOOKS_EXT_PATH)
+response_cache = TTLCache(
+    maxsize=RESPONSE_CACHE_SIZE,
+    ttl=RESPONSE_CACHE_TTL,
+    store=DiskStore(RESPONSE_CACHE_DB, table="responses") if RESPONSE_CACHE_DB else None,
+)
+
+def _response_key(user_text: str) -> str:
+    return make_key("chat", cache_text(user_text), CHAT_MODEL, GATE_MODEL, EMB_MODEL, CATALOG_VERSION)
+
+def _cache_enabled() -> bool:
+    return response_cache.maxsize > 0 or response_cache.store is not None
+
+def _remember_reply(user_text: str, reply: str) -> None:
+    """Store a proceed-path answer in the response cache when enabled."""
+    if _cache_enabled() and reply and not reply.lower().startswith("please rephrase"):
+        response_cache.set(_response_key(user_text), reply)
 
 # ---------- routes ----------
 @app.get("/")
 def index():
     return render_template("index.html")
 
-OFFTOPIC_MSG = "I can only help with books from this small library. Please mention a title or themes."
+def _stats_payload() -> dict:
+    return {
+        "query_expansion_cache": query_expansion_cache.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "intent_paths": intent_path_stats(),
+        "prompt": prompt_stats(),
+        "moderation_cache": moderation_cache.stats(),
+        "response_cache": {**response_cache.stats(), "enabled": _cache_enabled(),
+                           "catalog_version": CATALOG_VERSION},
+        "stt": stt_stats(),
+        "image_cache": routes_media.image_cache.usage(),
+        "lexical": lexical_index.stats() if lexical_index is not None else None,
+        "title_fast_path": title_fast_path_stats(),
+    }
 
-@app.post("/chat")
-def chat():
-    data = request.get_json(force=True) or {}
-    user_text = (data.get("message") or data.get("text") or "").strip()
-    if not user_text:
-        return jsonify({"reply": "Please ask about books — a theme, mood, or a specific title from our small library."})
+@app.get("/stats")
+def stats():
+    return jsonify(_stats_payload())
+
+EMPTY_MSG = "Please ask about books — a theme, mood, or a specific title from our small library."
+OFFTOPIC_MSG = "I can only help with books from this small library. Please mention a title or themes."
 
-    # 1) Intent as hint 
-    gate_hint = intent_gate(user_text)
-    context_hint = "informational" if gate_hint.get("action") == "proceed" else ""
+# ---------- chat pipeline (shared by /chat, /chat/stream and asgi.py) ----------
+def _cached_reply(user_text: str):
+    """Response-cache hit for this exact message, or None. Only proceed-path replies are stored."""
+    if _cache_enabled():
+        return response_cache.get(_response_key(user_text))
+    return None
 
-    # 2) Balanced/strict safety
-    allow, _reason = safety_check(user_text, context_hint=context_hint)
+def _cached_payload(hit, allow: bool) -> dict:
+    """A cache hit is served only if the message itself still passes safety_check."""
     if not allow:
-        return jsonify({"reply": "Please rephrase respectfully."})
+        return {"reply": "Please rephrase respectfully."}
+    return {"reply": hit, "cached": True}
 
-    # 3) Short-circuit for greet/clarify/offtopic
+def _gate_payload(allow: bool, gate_hint: dict):
+    """Reply for blocked or non-proceed messages, or None when retrieval should run."""
+    if not allow:
+        return {"reply": "Please rephrase respectfully."}
     if gate_hint["action"] in {"greet", "clarify", "offtopic"}:
-        return jsonify({"reply": gate_hint["reply"]})
+        return {"reply": gate_hint["reply"]}
+    return None
 
-    # 4) Retrieval (bring many so 'all/more' can return everything relevant)
-    expanded_terms = llm_expand_query(user_text, max_terms=10)
+def _needs_expansion(user_text: str) -> bool:
+    """False when the catalog vocabulary already covers the query (hybrid mode only)."""
+    return lexical_index is None or not lexical_index.is_confident(user_text, LEXICAL_SKIP_EXPANSION)
+
+_fast_path_counts: Counter = Counter()
+_fast_path_lock = threading.Lock()
+
+def title_fast_path_stats() -> dict:
+    """direct: answered from books_ext without the chat model; candidates: mentioned titles only."""
+    with _fast_path_lock:
+        return {"direct": _fast_path_counts["direct"], "candidates": _fast_path_counts["candidates"]}
+
+def _count_fast_path(fast) -> None:
+    """Counted only once the message passed the gates, so blocked messages never show up."""
+    with _fast_path_lock:
+        _fast_path_counts["direct" if fast[0] is not None else "candidates"] += 1
+
+def _title_fast_path(user_text: str):
+    """
+    Route for messages that name catalog titles, or None for full retrieval.
+    "What is <title> about?" is answered straight from books_ext: (payload, None).
+    Other mentions send just the named books to the model: (None, candidates).
+    "Books like <title>" needs similar books, so it takes the normal path.
+    """
+    titles = title_matcher.find(user_text)
+    if not titles:
+        return None
+    kind = title_question_kind(user_text)
+    if kind == "similar":
+        return None
+    if kind == "about" and len(titles) == 1:
+        summary = get_summary_by_title_local(titles[0])
+        if summary != "NOT_FOUND":
+            reply = render_recommendations([{"title": titles[0], "reasons": []}], lambda _t: summary)
+            return {"reply": clean_reply(reply)}, None
+    return None, [{"title": t, "summary": small_summaries.get(t, ""), "score": None} for t in titles]
+
+def _retrieve(user_text: str, expanded_terms: list):
+    """Returns (payload, None) when nothing matched, else (None, candidates)."""
     retrieval_query = user_text if not expanded_terms else f"{user_text}\nKeywords: {', '.join(expanded_terms)}"
-    candidates = retrieve_candidates(
-        collection, retrieval_query,
-        k=(len(books_small) if collection else 0)
+    # 'all/more' (or a count above CANDIDATES_MAX_K) widens the set, but it stays bounded
+    count = requested_count(user_text) or 0
+    wide = wants_many(user_text) or count > CANDIDATES_MAX_K
+    k = 2 * (CANDIDATES_WIDE_MAX_K if wide else CANDIDATES_MAX_K)
+    candidates = retrieve_candidates(collection, retrieval_query, k=k) if collection else []
+    if lexical_index is not None:
+        candidates = rrf_fuse(candidates, lexical_index, retrieval_query, k=k)
+    candidates = select_candidates(
+        candidates,
+        min_k=max(CANDIDATES_MIN_K, count),
+        max_k=CANDIDATES_MAX_K,
+        wide=wide,
+        wide_max_k=CANDIDATES_WIDE_MAX_K,
+        rel_cutoff=CANDIDATES_REL_CUTOFF,
+        gap=CANDIDATES_GAP,
+        token_budget=CANDIDATES_TOKEN_BUDGET,
     )
 
     if not candidates:
-        return jsonify({"reply": OFFTOPIC_MSG})
+        return {"reply": OFFTOPIC_MSG}, None
+    return None, candidates
 
-    # 5) Prompt + tools
-    messages, tools = build_messages_and_tools(user_text, candidates)
+def _known_hint(local_hint) -> Optional[str]:
+    """safety_check's context hint when the local classifier already decided, else None."""
+    if local_hint is None:
+        return None
+    return "informational" if local_hint["action"] == "proceed" else ""
+
+def _pre_chat(user_text: str):
+    """
+    Cache lookup, gates and retrieval.
+    Returns (payload, None) when the request is answered without the chat model,
+    or (None, candidates) when it should proceed.
+    """
+    # 0) Response cache
+    hit = _cached_reply(user_text)
+    if hit is not None:
+        allow, _reason = safety_check(user_text, context_hint="informational")
+        return _cached_payload(hit, allow), None
+
+    # 1) Intent gate, moderation and query expansion run concurrently;
+    #    safety_check joins the prefetched moderation calls once the intent hint is known.
+    #    Obvious greetings / title mentions are classified locally without GATE_MODEL,
+    #    and queries the catalog vocabulary already covers (or that name a title) skip the expansion call.
+    local_hint = local_intent(user_text)
+    proceed = local_hint is None or local_hint["action"] == "proceed"
+    fast = _title_fast_path(user_text) if proceed else None
+    with prefetched_moderation(user_text, _known_hint(local_hint)):
+        expansion = None
+        if proceed and fast is None and _needs_expansion(user_text):
+            expansion = submit_upstream(llm_expand_query, user_text, max_terms=10)
+
+        # Intent as hint
+        gate_hint = local_hint or intent_gate(user_text)
+        context_hint = "informational" if gate_hint.get("action") == "proceed" else ""
+
+        # 2) Balanced/strict safety
+        allow, _reason = safety_check(user_text, context_hint=context_hint)
+
+    # 3) Blocked or greet/clarify/offtopic short-circuit (expansion result is discarded)
+    payload = _gate_payload(allow, gate_hint)
+    if payload is not None:
+        if expansion is not None:
+            expansion.cancel()
+        return payload, None
+
+    # 4) Named titles: direct answer or tiny candidate set, no retrieval
+    if fast is not None:
+        _count_fast_path(fast)
+        return fast
+
+    # 5) Retrieval (no expansion when the lexical index was confident)
+    return _retrieve(user_text, expansion.result() if expansion is not None else [])
+
+def _apply_tool_calls(messages: list, ai_msg) -> None:
+    """Append the assistant tool-call turn and one tool result per call to `messages`."""
+    messages.append({
+        "role": "assistant",
+        "content": ai_msg.content or "",
+        "tool_calls": [
+            {
+                "id": tc.id,
+                "type": "function",
+                "function": {"name": tc.function.name, "arguments": tc.function.arguments}
+            }
+            for tc in ai_msg.tool_calls if tc.type == "function"
+        ],
+    })
+
+    for tc in ai_msg.tool_calls:
+        if tc.type != "function":
+            continue
+        fn = tc.function.name
+        args = parse_json_loose(tc.function.arguments or "{}")
 
-    # 6) First call 
+        if fn == "get_summaries_by_titles":
+            titles = args.get("titles") or []
+            if isinstance(titles, str):
+                titles = [titles]
+            result_map = {t: get_summary_by_title_local(t) for t in titles}
+            messages.append({
+                "role": "tool",
+                "tool_call_id": tc.id,
+                "name": "get_summaries_by_titles",
+                "content": json.dumps(result_map, ensure_ascii=False),
+            })
+
+        elif fn == "get_summary_by_title":
+            title = (args.get("title") or "").strip()
+            summary_text = get_summary_by_title_local(title)
+            messages.append({
+                "role": "tool",
+                "tool_call_id": tc.id,
+                "name": "get_summary_by_title",
+                "content": summary_text,
+            })
+
+        else:
+            messages.append({
+                "role": "tool",
+                "tool_call_id": tc.id,
+                "name": fn,
+                "content": "NOT_IMPLEMENTED",
+            })
+
+def _rendered_reply(ai_msg):
+    """
+    Server-side reply for a recommend_books call (RENDER_MODE=server), or None when the
+    model made no such call. Titles are resolved against the catalog (fuzzily); unknown ones are dropped.
+    """
+    for tc in getattr(ai_msg, "tool_calls", None) or []:
+        if tc.type != "function" or tc.function.name != "recommend_books":
+            continue
+        args = parse_json_loose(tc.function.arguments or "{}")
+        picks, seen = [], set()
+        for book in args.get("books") or []:
+            if not isinstance(book, dict):
+                continue
+            title = title_index.resolve(str(book.get("title") or ""))
+            if title is None or title in seen:
+                continue
+            seen.add(title)
+            reasons = book.get("reasons") or []
+            if isinstance(reasons, str):
+                reasons = [reasons]
+            picks.append({"title": title, "reasons": [str(r).strip() for r in reasons if str(r).strip()]})
+        return render_recommendations(picks, get_summary_by_title_local) if picks else OFFTOPIC_MSG
+    return None
+
+def _tool_round(messages: list, tools: list):
+    """
+    First chat call plus tool execution.
+    Returns (messages, None) ready for the final call, or (None, content) when the
+    model answered directly without tools or the reply was rendered server-side.
+    """
     first = client.chat.completions.create(
         model=CHAT_MODEL,
         messages=messages,
@@ -107,68 +384,112 @@ def chat():
     )
     ai_msg = first.choices[0].message
 
-    # 7) Tool execution loop
-    if getattr(ai_msg, "tool_calls", None):
-        messages.append({
-            "role": "assistant",
-            "content": ai_msg.content or "",
-            "tool_calls": [
-                {
-                    "id": tc.id,
-                    "type": "function",
-                    "function": {"name": tc.function.name, "arguments": tc.function.arguments}
-                }
-                for tc in ai_msg.tool_calls if tc.type == "function"
-            ],
-        })
-
-        for tc in ai_msg.tool_calls:
-            if tc.type != "function":
-                continue
-            fn = tc.function.name
-            args = parse_json_loose(tc.function.arguments or "{}")
-
-            if fn == "get_summaries_by_titles":
-                titles = args.get("titles") or []
-                if isinstance(titles, str):
-                    titles = [titles]
-                result_map = {t: get_summary_by_title_local(t) for t in titles}
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tc.id,
-                    "name": "get_summaries_by_titles",
-                    "content": json.dumps(result_map, ensure_ascii=False),
-                })
-
-            elif fn == "get_summary_by_title":
-                title = (args.get("title") or "").strip()
-                summary_text = get_summary_by_title_local(title)
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tc.id,
-                    "name": "get_summary_by_title",
-                    "content": summary_text,
-                })
+    if not getattr(ai_msg, "tool_calls", None):
+        return None, (ai_msg.content or "")
 
-            else:
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tc.id,
-                    "name": fn,
-                    "content": "NOT_IMPLEMENTED",
-                })
+    rendered = _rendered_reply(ai_msg)
+    if rendered is not None:
+        return None, rendered
+
+    _apply_tool_calls(messages, ai_msg)
+    return messages, None
+
+def _delta_text(chunk) -> str:
+    choices = getattr(chunk, "choices", None) or []
+    return (getattr(choices[0].delta, "content", None) or "") if choices else ""
+
+@app.post("/chat")
+def chat():
+    data = request.get_json(force=True) or {}
+    user_text = (data.get("message") or data.get("text") or "").strip()
+    if not user_text:
+        return jsonify({"reply": EMPTY_MSG})
 
+    # 1-4) Cache, gates, safety, retrieval
+    payload, candidates = _pre_chat(user_text)
+    if payload is not None:
+        return jsonify(payload)
+
+    # 5) Prompt + tools
+    messages, tools = build_messages_and_tools(user_text, candidates)
+
+    # 6-7) First call + tool execution
+    messages, direct = _tool_round(messages, tools)
+
+    if messages is not None:
         final = client.chat.completions.create(
             model=CHAT_MODEL,
             messages=messages,
             temperature=0.2,
         )
         reply = clean_reply((final.choices[0].message.content or "").strip())
-        return jsonify({"reply": reply})
+    else:
+        # 8) No tools → direct reply
+        reply = clean_reply(direct.strip())
+
+    _remember_reply(user_text, reply)
+    return jsonify({"reply": reply, "cached": False})
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+def chat_stream():
+    """
+    Same pipeline as /chat, streamed as Server-Sent Events:
+    'delta' events carry cleaned text as the final completion arrives, then one
+    'done' event carries the full reply ({reply, cached}); failures send 'error'.
+    """
+    data = request.get_json(force=True) or {}
+    user_text = (data.get("message") or data.get("text") or "").strip()
+
+    def events():
+        try:
+            if not user_text:
+                payload, candidates = {"reply": EMPTY_MSG}, None
+            else:
+                payload, candidates = _pre_chat(user_text)
+            if payload is not None:
+                yield _sse("delta", {"text": payload["reply"]})
+                yield _sse("done", payload)
+                return
+
+            messages, tools = build_messages_and_tools(user_text, candidates)
+            messages, direct = _tool_round(messages, tools)
+
+            if messages is None:
+                reply = clean_reply(direct.strip())
+                yield _sse("delta", {"text": reply})
+            else:
+                cleaner = ReplyCleaner()
+                parts = []
+                stream = client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=messages,
+                    temperature=0.2,
+                    stream=True,
+                )
+                for chunk in stream:
+                    text = cleaner.feed(_delta_text(chunk))
+                    if text:
+                        parts.append(text)
+                        yield _sse("delta", {"text": text})
+                text = cleaner.flush()
+                if text:
+                    parts.append(text)
+                    yield _sse("delta", {"text": text})
+                reply = "".join(parts)
+
+            _remember_reply(user_text, reply)
+            yield _sse("done", {"reply": reply, "cached": False})
+        except Exception:
+            logger.exception("Streaming chat failed")
+            yield _sse("error", {"error": "server_error"})
 
-    # 8) No tools → direct reply
-    reply = clean_reply((ai_msg.content or "").strip())
-    return jsonify({"reply": reply})
+    r = Response(stream_with_context(events()), mimetype="text/event-stream")
+    r.headers["Cache-Control"] = "no-cache"
+    r.headers["X-Accel-Buffering"] = "no"
+    return r
 
 if __name__ == "__main__":
     app.run(host="127.0.0.1", port=5000, debug=True, threaded=True)